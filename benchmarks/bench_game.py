@@ -0,0 +1,179 @@
+"""
+Micro-benchmarks of the game engine's hot paths.
+
+Times Board.play, Board.is_winning_move, Board.is_full, Game.play,
+Game.status and whole random games, on boards of several shapes and
+values of k, and writes the time per call of each to a JSON file. With
+--compare, also reads a saved baseline and flags every benchmark that's
+slower than the baseline by more than the threshold, exiting with
+status 1 if any are, so it can gate a change.
+
+    PYTHONPATH=src python benchmarks/bench_game.py -o baseline.json
+    ... change game.py ...
+    PYTHONPATH=src python benchmarks/bench_game.py -o new.json --compare baseline.json
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+from game import ColumnFullException, Game, Player, new_board
+
+
+## rows, columns and k of the boards to time, from the standard game to
+## one big enough to be stored sparsely
+SHAPES = [(6, 7, 4), (9, 9, 5), (20, 20, 5), (40, 40, 10), (100, 100, 5)]
+
+## fraction slower than the baseline that counts as a regression
+THRESHOLD = 0.10
+
+
+def _random_moves(n, m, seed):
+    """
+    A random order in which to fill every cell of an n by m board, as a
+    list of columns.
+    """
+    rng = random.Random(seed)
+    moves = [j for j in range(m) for i in range(n)]
+    rng.shuffle(moves)
+    return moves
+
+
+def _best_time(f, calls, repeat):
+    """
+    Seconds per call of f, which makes calls calls, taking the fastest of
+    repeat runs as the one least disturbed by the rest of the machine.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best / calls
+
+
+def _bench_shape(n, m, k, repeat):
+    moves = _random_moves(n, m, seed=n*m*k)
+    tokens = 'xo'
+
+    def board_play():
+        board = new_board(n, m, k)
+        for t, column in enumerate(moves):
+            board.play(column, tokens[t % 2])
+
+    ## a board half full, with every cell we can check a move at
+    half = new_board(n, m, k)
+    for t, column in enumerate(moves[:len(moves)//2]):
+        half.play(column, tokens[t % 2])
+    cells = [(i, j, tokens[(i + j) % 2]) for j in range(m) for i in range(n)]
+
+    def is_winning_move():
+        for i, j, token in cells:
+            half.is_winning_move(i, j, token)
+
+    def is_full():
+        for _ in range(10000):
+            half.is_full()
+
+    ## k = n*m means nobody wins, so every move is played
+    alice, bob = Player('alice'), Player('bob')
+
+    def game_play():
+        g = Game(alice, bob, n=n, m=m, k=n*m)
+        players = g.players
+        for t, column in enumerate(moves):
+            g.play(players[t % 2], column)
+
+    g = Game(alice, bob, n=n, m=m, k=n*m)
+    for t, column in enumerate(moves[:len(moves)//2]):
+        g.play(g.players[t % 2], column)
+
+    def game_status():
+        for _ in range(10000):
+            g.status
+
+    def random_games():
+        rng = random.Random(k)
+        for _ in range(10):
+            g = Game(alice, bob, n=n, m=m, k=k)
+            while g.status == 'IN_PROGRESS':
+                try:
+                    g.play(g.players[g.turn], rng.randrange(m))
+                except ColumnFullException:
+                    pass
+
+    shape = f'{n}x{m} k={k}'
+    return {
+        f'Board.play {shape}': _best_time(board_play, len(moves), repeat),
+        f'Board.is_winning_move {shape}': _best_time(is_winning_move, len(cells), repeat),
+        f'Board.is_full {shape}': _best_time(is_full, 10000, repeat),
+        f'Game.play {shape}': _best_time(game_play, len(moves), repeat),
+        f'Game.status {shape}': _best_time(game_status, 10000, repeat),
+        f'random game {shape}': _best_time(random_games, 10, repeat),
+    }
+
+
+def run(shapes=SHAPES, repeat=5, progress=None):
+    """
+    Run every benchmark. Returns a dict of the results, in seconds per
+    call, along with the versions they were run on.
+    """
+    results = {}
+    for n, m, k in shapes:
+        if progress:
+            progress(f'{n}x{m} k={k}')
+        results.update(_bench_shape(n, m, k, repeat))
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Compare results to a baseline. Returns (name, baseline seconds, new
+    seconds, ratio) for each benchmark in both, and the names of those
+    more than threshold slower than the baseline.
+    """
+    rows = []
+    regressions = []
+    for name, seconds in results['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        ratio = seconds / old
+        rows.append((name, old, seconds, ratio))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the hot paths of the game engine.')
+    parser.add_argument('-o', '--output', default='bench_results.json', help='where to write the results')
+    parser.add_argument('--compare', metavar='BASELINE', help='results to compare against')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='fraction slower than the baseline that counts as a regression')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each benchmark, taking the fastest')
+    args = parser.parse_args()
+
+    results = run(repeat=args.repeat, progress=lambda shape: print(f'timing {shape}', file=sys.stderr))
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if not args.compare:
+        for name, seconds in results['results'].items():
+            print(f'{name:40} {seconds*1e6:12.2f} us')
+        sys.exit(0)
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    rows, regressions = compare(results, baseline, args.threshold)
+    for name, old, new, ratio in rows:
+        flag = '  REGRESSION' if name in regressions else ''
+        print(f'{name:40} {old*1e6:12.2f} us {new*1e6:12.2f} us {ratio:6.2f}x{flag}')
+    print(f'{len(regressions)} of {len(rows)} benchmarks are more than {args.threshold:.0%} slower.')
+    sys.exit(1 if regressions else 0)
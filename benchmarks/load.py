@@ -0,0 +1,216 @@
+"""
+Load generator that plays whole games against the API.
+
+Each of N simulated pairs of players, each on its own thread, creates
+games with POST /drop_token and plays them out, taking turns to POST
+moves in columns that aren't full. After each move the other player
+polls for it and for the state of the game, and now and then a player
+quits instead of moving. At the end, prints the throughput, and the
+error rate and p50/p95/p99 latency of each route.
+
+Run it against a server:
+
+    ./start.sh asgi &
+    PYTHONPATH=src python benchmarks/load.py --url http://127.0.0.1:8000 --pairs 50 --seconds 30
+
+or, with no --url, against the Flask app in this process through its test
+client, which measures the app and the store without any HTTP.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+
+## routes, as reported
+NEW_GAME = 'POST /drop_token'
+GET_GAME = 'GET /drop_token/{gameId}'
+LIST_MOVES = 'GET /drop_token/{gameId}/moves'
+PLAY_MOVE = 'POST /drop_token/{gameId}/{playerId}'
+QUIT = 'DELETE /drop_token/{gameId}/{playerId}'
+
+
+class HttpClient():
+    """
+    Requests to a server, over a connection kept alive per thread.
+    """
+    def __init__(self, url):
+        import httpx
+        self.url = url
+        self._local = threading.local()
+        self._httpx = httpx
+
+    def request(self, method, path, body=None):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self._httpx.Client(base_url=self.url, timeout=60)
+        res = self._local.client.request(method, path, json=body)
+        return res.status_code, res.json() if res.content else None
+
+
+class TestClient():
+    """
+    Requests to the Flask app in this process.
+    """
+    def __init__(self):
+        import api
+        self._app = api.app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self._app.test_client()
+        res = self._local.client.open(path, method=method, json=body)
+        return res.status_code, res.json
+
+
+class Stats():
+    """
+    Latencies and status codes of requests by route.
+    """
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def record(self, route, seconds, status):
+        with self.lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            codes = self.statuses.setdefault(route, {})
+            codes[status] = codes.get(status, 0) + 1
+            if status is None or status >= 400:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self, seconds):
+        """
+        A dict of the throughput overall and, for each route, the number
+        of requests, the fraction that failed, and latency percentiles in
+        milliseconds.
+        """
+        routes = {}
+        for route, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+            routes[route] = {
+                'requests': len(latencies),
+                'error_rate': self.errors.get(route, 0) / len(latencies),
+                'statuses': {str(code): count for code, count in self.statuses[route].items()},
+                'p50_ms': pick(0.50),
+                'p95_ms': pick(0.95),
+                'p99_ms': pick(0.99),
+            }
+        requests = sum(route['requests'] for route in routes.values())
+        return {
+            'seconds': seconds,
+            'requests': requests,
+            'requests_per_second': requests / seconds,
+            'routes': routes,
+        }
+
+
+def _timed(client, stats, route, method, path, body=None):
+    start = time.perf_counter()
+    try:
+        status, data = client.request(method, path, body)
+    except Exception:
+        status, data = None, None
+    stats.record(route, time.perf_counter() - start, status)
+    return status, data
+
+
+def play_game(client, stats, players, rows, columns, quit_rate, rng):
+    """
+    Play one game to the end between the two players. Returns the number
+    of moves made.
+    """
+    status, data = _timed(client, stats, NEW_GAME, 'POST', '/drop_token',
+                          {'players': players, 'rows': rows, 'columns': columns})
+    if status != 200:
+        return 0
+    game_id = data['gameId']
+    heights = [0] * columns
+    moves = 0
+
+    while True:
+        player = players[moves % 2]
+        if rng.random() < quit_rate:
+            _timed(client, stats, QUIT, 'DELETE', f'/drop_token/{game_id}/{player}')
+            return moves
+
+        column = rng.choice([j for j in range(columns) if heights[j] < rows])
+        status, data = _timed(client, stats, PLAY_MOVE, 'POST', f'/drop_token/{game_id}/{player}', {'column': column})
+        if status != 200:
+            return moves
+        heights[column] += 1
+        moves += 1
+
+        ## the opponent looks for the move, and whether the game is over
+        _timed(client, stats, LIST_MOVES, 'GET', f'/drop_token/{game_id}/moves?start={moves - 1}')
+        status, data = _timed(client, stats, GET_GAME, 'GET', f'/drop_token/{game_id}')
+        if status != 200 or data['state'] == 'DONE':
+            return moves
+
+
+def run(client, pairs=10, seconds=10, rows=6, columns=7, quit_rate=0.02, seed=0):
+    """
+    Run pairs of players playing game after game for the given number of
+    seconds. Returns a report of the requests made. See Stats.report.
+    """
+    stats = Stats()
+    totals = {'games': 0, 'moves': 0}
+    totals_lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def pair(i):
+        rng = random.Random(seed * 100003 + i)
+        players = [f'load{i}x', f'load{i}o']
+        while time.monotonic() < deadline:
+            moves = play_game(client, stats, players, rows, columns, quit_rate, rng)
+            with totals_lock:
+                totals['games'] += 1
+                totals['moves'] += moves
+
+    threads = [threading.Thread(target=pair, args=(i,), daemon=True) for i in range(pairs)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    report = stats.report(elapsed)
+    report.update(pairs=pairs, games=totals['games'], moves=totals['moves'],
+                  games_per_second=totals['games'] / elapsed, moves_per_second=totals['moves'] / elapsed)
+    return report
+
+
+def print_report(report, out=sys.stdout):
+    print(f"{report['pairs']} pairs played {report['games']} games, {report['moves']} moves, "
+          f"in {report['seconds']:.1f} s: {report['games_per_second']:.1f} games/s, "
+          f"{report['moves_per_second']:.1f} moves/s, {report['requests_per_second']:.1f} requests/s", file=out)
+    print(f"{'route':40} {'requests':>9} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}", file=out)
+    for route, r in report['routes'].items():
+        print(f"{route:40} {r['requests']:9} {r['error_rate']:7.2%} "
+              f"{r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f}", file=out)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play games against the connect-four API and time them.')
+    parser.add_argument('--url', help='server to load, or the Flask app in this process if not given')
+    parser.add_argument('--pairs', type=int, default=10, help='pairs of players playing at once')
+    parser.add_argument('--seconds', type=float, default=10, help='how long to run')
+    parser.add_argument('--rows', type=int, default=6)
+    parser.add_argument('--columns', type=int, default=7)
+    parser.add_argument('--quit-rate', type=float, default=0.02, help='chance a player quits instead of moving')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    client = HttpClient(args.url) if args.url else TestClient()
+    report = run(client, args.pairs, args.seconds, args.rows, args.columns, args.quit_rate, args.seed)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -1,17 +1,57 @@
 """
 REST API for connent-four game.
 """
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+import parallel
+import profiling
+import solver
 import store
+from errors import ClientError, error_fields
 from game import ColumnFullException, OutOfTurnError, GameOver
+from index import MAX_PAGE_SIZE, PAGE_SIZE
 
 from flask import Flask
-from flask import jsonify, request
+from flask import g, jsonify, request
 import jsonschema
-from jsonschema import validate
 
 
 app = Flask('connect_four')
 
+## longest search for a hint a client can ask for, in milliseconds
+MAX_HINT_BUDGET = 5000
+
+## longest a client can wait for a move when long-polling, in seconds
+MAX_WAIT = 60
+
+## most rows or columns a board can have
+MAX_BOARD_SIDE = 1 << 20
+
+## number of games whose encoded moves are cached
+MOVES_CACHE_GAMES = 10000
+
+## states of games a client can list
+GAME_STATES = {'IN_PROGRESS': 'IN_PROGRESS', 'DONE': 'DONE', 'ALL': None}
+
+
+HOME = {
+    'message': 'Welcome to the connect-four API!',
+    'version': '0.0.1',
+    'endpoints': {
+            'game': '/drop_token',
+            'move': '/drop_token/{gameId}/moves{/moveId}',
+            'post_move': '/drop_token/{gameId}/{playerId}',
+            'delete_player': '/drop_token/{gameId}/{playerId}',
+            'hint': '/drop_token/{gameId}/hint',
+            'metrics': '/metrics',
+        }
+    }
+
 
 #----------------------------------------------------------------------
 #  JSON schemas
@@ -19,23 +59,71 @@ app = Flask('connect_four')
 
 GAME_SCHEMA = {
     'type': 'object',
-    'players': {
-        'type': 'array',
-        'items': {'type': 'number'},
-        'minitems': 1,
-        'maxitems': 26,
+    'properties': {
+        'players': {
+            'type': 'array',
+            'items': {'type': 'string', 'minLength': 1},
+            'minItems': 1,
+            'maxItems': 26,
+        },
+        'rows': {'type': 'integer', 'minimum': 1, 'maximum': MAX_BOARD_SIDE},
+        'columns': {'type': 'integer', 'minimum': 1, 'maximum': MAX_BOARD_SIDE},
+        'k': {'type': 'integer', 'minimum': 1, 'maximum': MAX_BOARD_SIDE},
     },
-    'rows': {'type': 'integer'},
-    'columns': {'type': 'integer'},
     'required': ['players', 'rows', 'columns'],
 }
 
 MOVE_SCHEMA = {
     'type': 'object',
-    'column': {'type': 'integer'},
+    'properties': {
+        'column': {'type': 'integer'},
+    },
     'required': ['column'],
 }
 
+## validators compiled once, rather than on every request, whose integers
+## are only ints, not floats like 4.0 that the JSON schema drafts allow
+_Validator = jsonschema.validators.validator_for(GAME_SCHEMA)
+_Validator = jsonschema.validators.extend(_Validator, type_checker=_Validator.TYPE_CHECKER.redefine(
+    'integer', lambda checker, x: type(x) is int))
+_GAME_VALIDATOR = _Validator(GAME_SCHEMA)
+_MOVE_VALIDATOR = _Validator(MOVE_SCHEMA)
+_GAME_VALIDATOR.check_schema(GAME_SCHEMA)
+_MOVE_VALIDATOR.check_schema(MOVE_SCHEMA)
+
+
+def _is_board_side(x):
+    return type(x) is int and 1 <= x <= MAX_BOARD_SIDE
+
+
+def _validate_game(data):
+    """
+    Check a new game request against GAME_SCHEMA, raising a ValidationError
+    if it doesn't match. The usual well-formed request is accepted by a
+    few plain checks, and only the rest go through the validator.
+
+    A k longer than both sides of the board can never be won, and setting
+    up a board costs k squared, so it's refused.
+    """
+    if not (type(data) is dict
+            and type(data.get('players')) is list and 1 <= len(data['players']) <= 26
+            and all(type(p) is str and p for p in data['players'])
+            and _is_board_side(data.get('rows'))
+            and _is_board_side(data.get('columns'))
+            and _is_board_side(data.get('k', 1))):
+        _GAME_VALIDATOR.validate(data)
+    if 'k' in data and data['k'] > max(data['rows'], data['columns']):
+        raise ClientError(f'k must be at most the number of rows or columns, not {data["k"]}.', status_code=400)
+
+
+def _validate_move(data):
+    """
+    Check a move against MOVE_SCHEMA, like _validate_game.
+    """
+    if type(data) is dict and type(data.get('column')) is int:
+        return
+    _MOVE_VALIDATOR.validate(data)
+
 
 #----------------------------------------------------------------------
 #  Helpers
@@ -63,6 +151,55 @@ def _get_player(player_id):
         raise ClientError(error, status_code=404)
 
 
+def _encode_cursor(key):
+    return base64.urlsafe_b64encode(f'{key}'.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        key = int(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        key = -1
+    if key < 0:
+        raise ClientError(f'Invalid cursor "{cursor}".', status_code=400)
+    return key
+
+
+def _list_games(state, limit, cursor):
+    """
+    Look up a page of games, given the user-provided query parameters.
+    """
+    if state not in GAME_STATES:
+        raise ClientError(f'State must be one of {", ".join(GAME_STATES)}, not {state}.', status_code=400)
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ClientError(f'Limit must be between 1 and {MAX_PAGE_SIZE}, not {limit}.', status_code=400)
+
+    after = _decode_cursor(cursor) if cursor else 0
+    game_ids, key = store.list_games(GAME_STATES[state], after, limit)
+
+    output = {'games': game_ids}
+    if key is not None:
+        output['next'] = _encode_cursor(key)
+    return output
+
+
+def _not_modified(etag):
+    """
+    A 304 response if the client already has the version of a resource
+    with the given ETag, or None.
+    """
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def _tagged(response, etag):
+    response.set_etag(etag)
+    return response
+
+
 def _move_to_dict(player, column):
     """
     Turn a move into a dictionary
@@ -72,13 +209,55 @@ def _move_to_dict(player, column):
         {'type': 'MOVE', 'player': player.id, 'column': column}
 
 
-def _history_to_dict(history):
+def _encode_move(player, column):
+    return json.dumps(_move_to_dict(player, column), separators=(',', ':')).encode()
+
+
+class MovesCache():
     """
-    Turn list of moves into a dictionary
+    The moves of recently read games, each encoded as JSON once, the first
+    time it's read. A game's history only grows, so the moves already
+    encoded stay valid, and a read encodes only the moves made since the
+    last one. Holds the moves of up to size games, dropping those least
+    recently read.
     """
-    return {
-        'moves': [_move_to_dict(player, column) for player, column in history]
-    }
+    def __init__(self, size):
+        self.size = size
+        self.games = OrderedDict()
+        self.lock = threading.Lock()
+
+    def fragments(self, game):
+        """
+        A list of the encoded moves of the game, as of now or later.
+        """
+        with self.lock:
+            fragments = self.games.get(game.id)
+            if fragments is None:
+                fragments = self.games[game.id] = []
+                if len(self.games) > self.size:
+                    self.games.popitem(last=False)
+            else:
+                self.games.move_to_end(game.id)
+            have = len(fragments)
+
+        ## encode outside the lock, and keep the result unless someone beat us to it
+        new = [_encode_move(player, column) for player, column in game.history[have:]]
+        if new:
+            with self.lock:
+                if len(fragments) == have:
+                    fragments.extend(new)
+        return fragments
+
+
+MOVES = MovesCache(MOVES_CACHE_GAMES)
+
+
+def _encode_moves(game, start, until):
+    """
+    The JSON body listing a range of a game's moves, put together from
+    cached fragments.
+    """
+    return b'{"moves":[' + b','.join(MOVES.fragments(game)[start:until]) + b']}'
 
 
 
@@ -112,24 +291,22 @@ def home():
     """
     API home.
     """
-    return jsonify({
-        'message': 'Welcome to the connect-four API!',
-        'version': '0.0.1',
-        'endpoints': {
-                'game': '/drop_token',
-                'move': '/drop_token/{gameId}/moves{/moveId}',
-                'post_move': '/drop_token/{gameId}/{playerId}',
-                'delete_player': '/drop_token/{gameId}/{playerId}',
-            }
-        })
+    return jsonify(HOME)
 
 
 @app.route('/drop_token')
 def list_games():
     """
-    Return all in-progress games or create a new game.
+    Return a page of in-progress games.
+
+    The optional query parameters are state, which is IN_PROGRESS, DONE or
+    ALL, limit, the size of the page, and cursor. If there are more games,
+    the response holds a cursor called next, which gets the next page.
     """
-    return jsonify({'games': store.list_games()})
+    return jsonify(_list_games(
+        request.args.get('state', 'IN_PROGRESS'),
+        request.args.get('limit', PAGE_SIZE, type=int),
+        request.args.get('cursor')))
 
 
 @app.route('/drop_token', methods=['POST'])
@@ -137,15 +314,20 @@ def new_game():
     """
     Create a new game and returns gameId in the response body.
 
-    Accepts a JSON body with the schema GAME_SCHEMA.
+    Accepts a JSON body with the schema GAME_SCHEMA. The optional field
+    k is the number of tokens in a row needed to win, 4 by default.
     """
     data = request.get_json()
-    validate(data, GAME_SCHEMA)
+    _validate_game(data)
 
     player_ids = data['players']
     rows, columns = data['rows'], data['columns']
+    k = data.get('k', 4)
 
-    game = store.new_game(player_ids, rows, columns)
+    try:
+        game = store.new_game(player_ids, rows, columns, k)
+    except ValueError as error:
+        raise ClientError(error, status_code=400)
     return jsonify({
             'gameId': game.id
         })
@@ -154,47 +336,101 @@ def new_game():
 @app.route('/drop_token/<game_id>')
 def get_game(game_id):
     """
-    GET the state of the game.
+    GET the state of the game. The response's ETag is the game's version,
+    and a request with If-None-Match that version gets a 304.
     """
     game = _get_game(game_id)
+    etag = str(game.version)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
     output = {
         "players" : [player.id for player in game.players],
         "state": game.status,
     }
     if game.status=='DONE':
         output['winner'] = game.winner.id if game.winner else None
-    return jsonify(output)
+    return _tagged(jsonify(output), etag)
 
 
 @app.route('/drop_token/<game_id>/moves')
 def list_moves(game_id):
     """
     GET the list of moves played in a game or a sub-range that list.
+
+    With the query parameter wait, long-poll: if move number start hasn't
+    been played yet, wait up to that many seconds for it before answering.
+    Here each waiting client holds a server thread. To hold many waiting
+    clients, serve the ASGI app in the asgi module instead, where a wait
+    holds no thread.
+
+    Like get_game, answers If-None-Match the game's version with a 304,
+    after waiting if asked to.
     """
     game = _get_game(game_id)
 
     start = int(request.args.get('start', 0))
     until = int(request.args['until']) if 'until' in request.args else None
+    wait = request.args.get('wait', 0, type=float)
 
     if start < 0 or (until and until <= start):
         raise ClientError(f'Invalid range of moves ({start}, {until}).', status_code=404)
+    if wait < 0 or wait > MAX_WAIT:
+        raise ClientError(f'Wait must be between 0 and {MAX_WAIT} seconds, not {wait}.', status_code=400)
+
+    if wait:
+        store.wait_for_moves(game, start + 1, wait)
 
-    return jsonify(_history_to_dict(game.history[start:until]))
+    etag = str(game.version)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+
+    response = app.response_class(_encode_moves(game, start, until), mimetype='application/json')
+    return _tagged(response, etag)
 
 
 @app.route('/drop_token/<game_id>/moves/<int:move_number>')
 def get_move(game_id, move_number):
     """
-    GET a move.
+    GET a move. Answers If-None-Match the game's version with a 304.
     """
     game = _get_game(game_id)
+    etag = str(game.version)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
 
     if move_number < 0 or move_number >= len(game.history):
         raise ClientError(f'Move number {move_number} does not exist.', status_code=404)
 
-    player, column = game.history[move_number]
+    response = app.response_class(MOVES.fragments(game)[move_number], mimetype='application/json')
+    return _tagged(response, etag)
+
 
-    return jsonify(_move_to_dict(player, column))
+@app.route('/drop_token/<game_id>/hint')
+def hint(game_id):
+    """
+    GET a suggested move for the player whose turn it is. The optional
+    query parameter budget limits the search time in milliseconds.
+    """
+    game = _get_game(game_id)
+
+    budget = request.args.get('budget', solver.HINT_BUDGET * 1000, type=float)
+    if budget <= 0 or budget > MAX_HINT_BUDGET:
+        raise ClientError(f'Budget must be between 0 and {MAX_HINT_BUDGET} ms, not {budget}.', status_code=400)
+
+    try:
+        column, score = solver.suggest_move(game, budget / 1000, parallel.WORKERS)
+    except ValueError as error:
+        raise ClientError(error, status_code=400)
+
+    return jsonify({
+            'player': game.players[game.turn].id,
+            'column': column,
+            'score': score,
+        })
 
 
 @app.route('/drop_token/<game_id>/<player_id>', methods=['POST'])
@@ -208,13 +444,14 @@ def play_move(game_id, player_id):
     player = _get_player(player_id)
 
     data = request.get_json()
-    validate(data, MOVE_SCHEMA)
+    _validate_move(data)
     column = data['column']
 
     try:
-        move_number = game.play(player, column)
+        move_number = store.play(game, player, column)
     except IndexError as error:
         raise ClientError(error, status_code=400)
+    metrics.count_move()
 
     return jsonify({
             'move': f'{game_id}/moves/{move_number}',
@@ -229,27 +466,86 @@ def quit(game_id, player_id):
     game = _get_game(game_id)
     player = _get_player(player_id)
 
-    game.quit(player)
+    store.quit(game, player)
 
     # return empty body, status code 202
     return '', 202
 
 
 #----------------------------------------------------------------------
-#  Error handling
+#  Metrics
 #----------------------------------------------------------------------
 
-class ClientError(Exception):
+@app.before_request
+def _start_timer():
+    g.start = time.perf_counter()
+    g.profile = profiling.start() if profiling.RATE else None
+
+
+## route labels by Flask rule
+_ROUTE_LABELS = {}
+
+
+@app.after_request
+def _observe(response):
+    if g.get('profile') is not None:
+        profiling.stop(g.profile)
+    rule = request.url_rule.rule if request.url_rule else ''
+    route = _ROUTE_LABELS.get(rule)
+    if route is None:
+        route = _ROUTE_LABELS[rule] = metrics.route_label(rule)
+    metrics.observe_request(
+        request.method, route, response.status_code,
+        time.perf_counter() - g.get('start', time.perf_counter()))
+    return response
+
+
+@app.route('/metrics')
+def get_metrics():
     """
-    Wrap another exception to signal that this is a client error.
+    GET request latencies, response codes, and counts of games, players
+    and moves, in the Prometheus text format. See the metrics module.
     """
-    def __init__(self, error, status_code=400):
-        if isinstance(error, Exception):
-            self.args = error.args
-        else:
-            self.args = (error)
-        self.status_code = status_code
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """
+    GET the profiler's sampling rate and timings per function, or POST a
+    JSON body to change it. The optional field rate sets the fraction of
+    requests to profile, and dump, if true, writes the collapsed stacks
+    and the table of timings to files. Served only if CONNECT_FOUR_ADMIN
+    is set. See the profiling module.
+    """
+    if not profiling.ADMIN:
+        raise ClientError('Admin endpoints are not enabled.', status_code=404)
+
+    output = {}
+    if request.method == 'POST':
+        data = request.get_json() or {}
+        if 'rate' in data:
+            try:
+                profiling.set_rate(float(data['rate']))
+            except (TypeError, ValueError):
+                raise ClientError(f'Invalid profiling rate: {data["rate"]}.', status_code=400)
+        if data.get('dump'):
+            output['files'] = profiling.dump()
+
+    output.update({
+        'rate': profiling.RATE,
+        'samples': profiling.samples(),
+        'functions': [
+            {'function': name, 'calls': calls, 'total_ms': total * 1000, 'self_ms': own * 1000}
+            for name, calls, total, own in profiling.stats()],
+    })
+    return jsonify(output)
+
+
+
+#----------------------------------------------------------------------
+#  Error handling
+#----------------------------------------------------------------------
 
 @app.errorhandler(ClientError)
 @app.errorhandler(jsonschema.exceptions.ValidationError)
@@ -260,16 +556,11 @@ def handle_client_error(error):
     """
     Turn a Python exception into an appropriate HTTP response.
     """
-    fields = {'exception': str(type(error))}
-
-    if hasattr(error, 'args') and len(error.args) > 0:
-        fields['message'] = error.args[0]
+    fields, status_code = error_fields(error)
     response = jsonify(fields)
-
-    if hasattr(error, 'status_code') and error.status_code is not None:
-        response.status_code = error.status_code
-    else:
-        response.status_code = 400
-
+    response.status_code = status_code
     return response
 
+
+## exceptions that are the client's fault
+CLIENT_ERRORS = (ClientError, jsonschema.exceptions.ValidationError, GameOver, OutOfTurnError, ColumnFullException)
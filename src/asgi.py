@@ -0,0 +1,322 @@
+"""
+ASGI version of the connect-four API, serving the same routes as the
+Flask app in the api module, on an asyncio event loop.
+
+Calls into the store may block on the database, so they're run in a
+thread pool, except for lookups of games and players already in memory,
+which are made inline. Searches for hints can take seconds, so they get
+a separate pool of their own, and a burst of them can't starve the
+other routes of threads. Long-polls for moves wait on
+the event loop rather than in a thread, so an idle client costs a
+coroutine and a socket. Run it with start.sh asgi.
+"""
+import asyncio
+import concurrent.futures
+import os
+import time
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import api
+import metrics
+import parallel
+import solver
+import store
+from api import ClientError, MAX_HINT_BUDGET, MAX_WAIT
+
+
+## threads for searching for hints
+HINT_THREADS = int(os.environ.get('CONNECT_FOUR_HINT_THREADS', 4))
+_SEARCHES = concurrent.futures.ThreadPoolExecutor(max_workers=HINT_THREADS, thread_name_prefix='hint')
+
+
+#----------------------------------------------------------------------
+#  Helpers
+#----------------------------------------------------------------------
+
+async def _get_game(game_id):
+    game = store.GAMES.get(game_id)
+    if game is not None:
+        store._catch_up(game)
+        store._touch(game)
+        return game
+    try:
+        return await run_in_threadpool(store.get_game, game_id)
+    except KeyError as error:
+        raise ClientError(error, status_code=404)
+
+
+async def _get_player(player_id):
+    player = store.PLAYERS.get(player_id)
+    if player is not None:
+        return player
+    try:
+        return await run_in_threadpool(store.get_player, player_id)
+    except KeyError as error:
+        raise ClientError(error, status_code=404)
+
+
+async def _json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise ClientError('Request body must be JSON.', status_code=400)
+
+
+def _arg(request, name, default, type):
+    try:
+        return type(request.query_params[name]) if name in request.query_params else default
+    except ValueError:
+        raise ClientError(f'Invalid value for {name}: {request.query_params[name]}.', status_code=400)
+
+
+def _not_modified(request, etag):
+    """
+    A 304 response if the client already has the version of a resource
+    with the given ETag, or None.
+    """
+    header = request.headers.get('if-none-match')
+    if header is None:
+        return None
+    tags = {tag.strip() for tag in header.split(',')}
+    if tags & {'*', f'"{etag}"', f'W/"{etag}"'}:
+        return Response(status_code=304, headers={'ETag': f'"{etag}"'})
+    return None
+
+
+async def _wait_for_moves(game, count, timeout):
+    """
+    Wait on the event loop until the game's history holds at least count
+    moves or the game is over, or until timeout seconds pass.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    changed = asyncio.Event()
+    listener = lambda g: loop.call_soon_threadsafe(changed.set)
+
+    ## moves by other processes in a shared table call no listeners, so
+    ## then look for them every POLL_SECONDS
+    poll = store.POLL_SECONDS if store.SHARED else None
+
+    game.add_listener(listener)
+    try:
+        while True:
+            store._catch_up(game)
+            if len(game.history) >= count or game.status == 'DONE':
+                break
+            changed.clear()
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(changed.wait(), min(remaining, poll or remaining))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        game.remove_listener(listener)
+
+
+
+#----------------------------------------------------------------------
+#  Routes
+#----------------------------------------------------------------------
+
+async def home(request):
+    return JSONResponse(api.HOME)
+
+
+async def list_games(request):
+    return JSONResponse(await run_in_threadpool(
+        api._list_games,
+        request.query_params.get('state', 'IN_PROGRESS'),
+        _arg(request, 'limit', api.PAGE_SIZE, int),
+        request.query_params.get('cursor')))
+
+
+async def new_game(request):
+    data = await _json(request)
+    api._validate_game(data)
+
+    try:
+        game = await run_in_threadpool(
+            store.new_game, data['players'], data['rows'], data['columns'], data.get('k', 4))
+    except ValueError as error:
+        raise ClientError(error, status_code=400)
+    return JSONResponse({'gameId': game.id})
+
+
+async def get_game(request):
+    game = await _get_game(request.path_params['game_id'])
+    etag = str(game.version)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+
+    output = {
+        'players': [player.id for player in game.players],
+        'state': game.status,
+    }
+    if game.status == 'DONE':
+        output['winner'] = game.winner.id if game.winner else None
+    return JSONResponse(output, headers={'ETag': f'"{etag}"'})
+
+
+async def list_moves(request):
+    game = await _get_game(request.path_params['game_id'])
+
+    start = _arg(request, 'start', 0, int)
+    until = _arg(request, 'until', None, int)
+    wait = _arg(request, 'wait', 0, float)
+
+    if start < 0 or (until and until <= start):
+        raise ClientError(f'Invalid range of moves ({start}, {until}).', status_code=404)
+    if wait < 0 or wait > MAX_WAIT:
+        raise ClientError(f'Wait must be between 0 and {MAX_WAIT} seconds, not {wait}.', status_code=400)
+
+    if wait:
+        await _wait_for_moves(game, start + 1, wait)
+
+    etag = str(game.version)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+
+    return Response(api._encode_moves(game, start, until),
+                    media_type='application/json', headers={'ETag': f'"{etag}"'})
+
+
+async def get_move(request):
+    game = await _get_game(request.path_params['game_id'])
+    move_number = request.path_params['move_number']
+    etag = str(game.version)
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+
+    if move_number < 0 or move_number >= len(game.history):
+        raise ClientError(f'Move number {move_number} does not exist.', status_code=404)
+
+    return Response(api.MOVES.fragments(game)[move_number],
+                    media_type='application/json', headers={'ETag': f'"{etag}"'})
+
+
+async def hint(request):
+    game = await _get_game(request.path_params['game_id'])
+
+    budget = _arg(request, 'budget', solver.HINT_BUDGET * 1000, float)
+    if budget <= 0 or budget > MAX_HINT_BUDGET:
+        raise ClientError(f'Budget must be between 0 and {MAX_HINT_BUDGET} ms, not {budget}.', status_code=400)
+
+    try:
+        column, score = await asyncio.get_running_loop().run_in_executor(
+            _SEARCHES, solver.suggest_move, game, budget / 1000, parallel.WORKERS)
+    except ValueError as error:
+        raise ClientError(error, status_code=400)
+
+    return JSONResponse({
+            'player': game.players[game.turn].id,
+            'column': column,
+            'score': score,
+        })
+
+
+async def play_move(request):
+    game = await _get_game(request.path_params['game_id'])
+    player = await _get_player(request.path_params['player_id'])
+
+    data = await _json(request)
+    api._validate_move(data)
+
+    try:
+        move_number = await run_in_threadpool(store.play, game, player, data['column'])
+    except IndexError as error:
+        raise ClientError(error, status_code=400)
+    metrics.count_move()
+
+    return JSONResponse({'move': f'{game.id}/moves/{move_number}'})
+
+
+async def quit(request):
+    game = await _get_game(request.path_params['game_id'])
+    player = await _get_player(request.path_params['player_id'])
+
+    await run_in_threadpool(store.quit, game, player)
+
+    return Response(status_code=202)
+
+
+
+async def get_metrics(request):
+    return Response(metrics.render(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+
+#----------------------------------------------------------------------
+#  Metrics
+#----------------------------------------------------------------------
+
+class TimingMiddleware():
+    """
+    Time each request and record it under the path of the route that
+    answered it. Plain ASGI rather than Starlette's BaseHTTPMiddleware,
+    which would add a task and a queue to every request.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_and_note_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_note_status)
+        finally:
+            route = _ROUTE_PATHS.get(scope.get('endpoint'), '')
+            metrics.observe_request(scope['method'], route, status[0], time.perf_counter() - start)
+
+
+
+#----------------------------------------------------------------------
+#  Error handling
+#----------------------------------------------------------------------
+
+async def handle_client_error(request, error):
+    """
+    Turn a Python exception into an appropriate HTTP response.
+    """
+    fields, status_code = api.error_fields(error)
+    return JSONResponse(fields, status_code=status_code)
+
+
+routes = [
+    Route('/', home),
+    Route('/metrics', get_metrics),
+    Route('/drop_token', list_games),
+    Route('/drop_token', new_game, methods=['POST']),
+    Route('/drop_token/{game_id}', get_game),
+    Route('/drop_token/{game_id}/moves', list_moves),
+    Route('/drop_token/{game_id}/moves/{move_number:int}', get_move),
+    Route('/drop_token/{game_id}/hint', hint),
+    Route('/drop_token/{game_id}/{player_id}', play_move, methods=['POST']),
+    Route('/drop_token/{game_id}/{player_id}', quit, methods=['DELETE']),
+]
+
+## the paths of the routes, for recording metrics
+_ROUTE_PATHS = {route.endpoint: metrics.route_label(route.path) for route in routes}
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(TimingMiddleware)],
+    exception_handlers={error: handle_client_error for error in api.CLIENT_ERRORS})
@@ -0,0 +1,169 @@
+"""
+An opening book of precomputed best moves for the early plies of a game.
+
+The book is a binary file holding a header followed by fixed-size
+records, sorted by key:
+
+    header: magic 'C4BK', version, n, m, k, number of records
+    record: 64-bit position key, column, score
+
+A position's key is its Zobrist hash XORed with the key for the color
+of the player to move, as in the transposition table. Server workers
+mmap the file and binary search it, so they all share the same pages
+and there's nothing to parse at startup.
+
+To build a book for the standard 6x7 board:
+
+    PYTHONPATH=`pwd`/src python src/book.py book.bin --plies 6
+
+Then set CONNECT_FOUR_BOOK to the path of the book file, and the hint
+endpoint will use it for games whose board matches the book's shape.
+"""
+import argparse
+import copy
+import mmap
+import os
+import struct
+
+from game import Board
+from transposition import side_key
+
+
+MAGIC = b'C4BK'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHHI')
+RECORD = struct.Struct('<Qhh')
+
+
+def position_key(board, token):
+    """
+    Key for the position on the board with the given token to move.
+    """
+    return board.hash ^ side_key(board.colors.get(token, len(board.colors)))
+
+
+class OpeningBook():
+    """
+    A read-only, memory-mapped opening book.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.n, self.m, self.k, self.count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not an opening book.')
+        if len(self.mm) != HEADER.size + self.count * RECORD.size:
+            raise ValueError(f'Opening book {path} is truncated.')
+
+    def __repr__(self):
+        return f"OpeningBook('{self.path}')"
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.mm.close()
+
+    def matches(self, board):
+        return (board.n, board.m, board.k) == (self.n, self.m, self.k)
+
+    def _find(self, key):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k, column, score = RECORD.unpack_from(self.mm, HEADER.size + mid * RECORD.size)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return column, score
+        return None
+
+    def lookup(self, board, token):
+        """
+        Look up the best move for the player with the given token. Returns
+        a tuple of column and score or None if the position isn't in the book.
+        """
+        if not self.matches(board):
+            return None
+        return self._find(position_key(board, token))
+
+
+def _positions(board, tokens, plies, seen):
+    """
+    Generate boards for every position reachable in the given number of
+    plies that isn't already won, skipping transpositions.
+    """
+    token = tokens[board.moves % 2]
+    key = position_key(board, token)
+    if key in seen:
+        return
+    seen.add(key)
+    yield board, token
+
+    if plies == 0:
+        return
+    for j in range(board.m):
+        if board.heights[j] < board.n:
+            child = copy.deepcopy(board)
+            if not child.play(j, token) and not child.is_full():
+                yield from _positions(child, tokens, plies - 1, seen)
+
+
+def build(path, n=6, m=7, k=4, plies=6, budget=0.25, progress=None):
+    """
+    Search every position in the first plies of the game for up to budget
+    seconds each and write the results as an opening book. Returns the
+    number of positions in the book.
+    """
+    from solver import best_move
+
+    records = []
+    for board, token in _positions(Board(n, m, k), 'xo', plies, set()):
+        column, score = best_move(board, token, budget)
+        records.append((position_key(board, token), column, score))
+        if progress and len(records) % 100 == 0:
+            progress(len(records))
+    records.sort()
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, n, m, k, len(records)))
+        for record in records:
+            f.write(RECORD.pack(*record))
+    os.replace(tmp, path)
+    return len(records)
+
+
+_BOOK = None
+
+def get_book():
+    """
+    The opening book named by the CONNECT_FOUR_BOOK environment variable,
+    or None if there isn't one. Each process maps the file the first time
+    it's asked for.
+    """
+    global _BOOK
+    path = os.environ.get('CONNECT_FOUR_BOOK')
+    if not path:
+        return None
+    if _BOOK is None or _BOOK.path != path:
+        _BOOK = OpeningBook(path)
+    return _BOOK
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a connect-four opening book.')
+    parser.add_argument('path', help='where to write the book')
+    parser.add_argument('--rows', type=int, default=6)
+    parser.add_argument('--columns', type=int, default=7)
+    parser.add_argument('-k', type=int, default=4, help='tokens in a row to win')
+    parser.add_argument('--plies', type=int, default=6, help='depth of the book in moves')
+    parser.add_argument('--budget', type=float, default=0.25, help='seconds of search per position')
+    args = parser.parse_args()
+
+    count = build(args.path, args.rows, args.columns, args.k, args.plies, args.budget,
+                  progress=lambda i: print(f'{i} positions', end='\r', flush=True))
+    print(f'\rWrote {count} positions to {args.path}.')
@@ -0,0 +1,32 @@
+"""
+Client errors and how they're reported, shared by the Flask and ASGI
+apps and the router. This module imports nothing of the app, so the
+router can use it without loading the game engine or opening the store.
+"""
+
+
+
+class ClientError(Exception):
+    """
+    Wrap another exception to signal that this is a client error.
+    """
+    def __init__(self, error, status_code=400):
+        if isinstance(error, Exception):
+            self.args = error.args
+        else:
+            self.args = (error,)
+        self.status_code = status_code
+
+
+def error_fields(error):
+    """
+    The body and status code of the response to a client error.
+    """
+    fields = {'exception': str(type(error))}
+
+    if hasattr(error, 'args') and len(error.args) > 0:
+        fields['message'] = error.args[0]
+
+    if hasattr(error, 'status_code') and error.status_code is not None:
+        return fields, error.status_code
+    return fields, 400
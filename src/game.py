@@ -5,7 +5,12 @@ A game of connect-four is represented by an instance of Game, which
 has a Board of some dimensions (n,m) and a list of Players.
 """
 import io
+import threading
 import uuid
+from array import array
+from functools import lru_cache
+
+from transposition import shape_key, zobrist_key
 
 
 
@@ -22,11 +27,50 @@ class GameOver(Exception):
 
 
 
+## tokens to give players whose own tokens clash with others' in a game
+SPARE_TOKENS = 'abcdefghijklmnopqrstuvwxyz!@#$%^&*-+='
+
+
+def _typecode(largest):
+    """
+    The smallest signed array typecode that holds numbers up to largest.
+    """
+    return 'b' if largest < 1 << 7 else 'h' if largest < 1 << 15 else 'l'
+
+
+
+@lru_cache(maxsize=64)
+def _geometry(h, k):
+    """
+    The bit offsets between neighboring cells in each direction, up a
+    column, across a row and along the two diagonals, of a board whose
+    columns take h bits. And for each direction, a line of 2k-1 bits,
+    which when centered on a cell covers every possible run of k tokens
+    through that cell. Boards of the same shape share these.
+    """
+    directions = (1, h, h+1, h-1)
+    lines = tuple(sum(1 << (t*s) for t in range(2*k - 1)) for s in directions)
+    return directions, lines
+
+
+
 class Board():
     """
     Represent a game board with _n_ rows and _m_ columns. A win requires
     _k_ tokens of the same kind in a row, column or diagonal.
+
+    The board is stored as a set of bitboards, one integer mask per token.
+    Each column takes n+1 bits, numbered from the bottom, and the extra
+    bit on top of each column is always empty so that runs of tokens
+    can't wrap around from one column into the next. The cell in row i
+    and column j is bit j*(n+1) + i.
+
+    The board also keeps a Zobrist hash of the position, updated with
+    each play. See the transposition module.
     """
+    __slots__ = ('n', 'm', 'k', 'h', 'masks', 'heights', 'moves', 'colors', 'hash',
+                 'directions', '_lines')
+
     def __init__(self, n=4, m=4, k=4):
         if n < 1 or m < 1:
             raise ValueError(f'Can\'t create a board of dimensions ({n},{m}).')
@@ -35,7 +79,14 @@ class Board():
         self.n = n
         self.m = m
         self.k = k
-        self.board = [[' ' for _ in range(n)] for _ in range(m)]
+        self.h = n + 1
+        self.masks = {}
+        self.heights = [0] * m
+        self.moves = 0
+        self.colors = {}
+        self.hash = shape_key(n, m, k)
+
+        self.directions, self._lines = _geometry(self.h, k)
 
     def __repr__(self):
         return f'Board({self.n}, {self.m})'
@@ -44,7 +95,7 @@ class Board():
         out = io.StringIO()
         out.write('\n+' + '+'.join(f'---'  for j in range(self.m)) + '+\n')
         for i in range(self.n-1, -1, -1):
-            out.write('|' + '|'.join(f' {self.board[j][i]} '  for j in range(self.m)) + '|\n')
+            out.write('|' + '|'.join(f' {self._cell(i, j)} '  for j in range(self.m)) + '|\n')
             out.write('+' + '+'.join(f'---'  for j in range(self.m)) + '+\n')
         return out.getvalue()
 
@@ -55,63 +106,100 @@ class Board():
         column, where i and j are zero based.
         """
         if type(t)==int:
-            return [self.board[j][t] for j in range(self.m)]
+            return self._row(t)
         if len(t)==1:
-            return [self.board[j][t[0]] for j in range(self.m)]
+            return self._row(t[0])
         if len(t)==2:
-            return self.board[t[1]][t[0]]
+            i, j = t
+            if isinstance(i, slice):
+                return [self._cell(i, self._index(j, self.m)) for i in range(self.n)[i]]
+            return self._cell(self._index(i, self.n), self._index(j, self.m))
         raise ValueError(f'{len(t)} is the wrong number of dimensions.')
 
+    def _index(self, x, size):
+        """
+        Check an index and allow negative indices the way lists do.
+        """
+        if x < -size or x >= size:
+            raise IndexError(f'Index {x} is out of range.')
+        return x % size
 
-    def play(self, column, token):
+    def _row(self, i):
+        i = self._index(i, self.n)
+        return [self._cell(i, j) for j in range(self.m)]
+
+    def _color(self, token):
         """
-        Play a token in the specified column.
+        Number tokens in the order they were first played.
+        """
+        if token not in self.colors:
+            self.colors[token] = len(self.colors)
+        return self.colors[token]
+
+    def _cell(self, i, j):
+        bit = 1 << (j*self.h + i)
+        for token, mask in self.masks.items():
+            if mask & bit:
+                return token
+        return ' '
+
+    def occupied(self):
+        """
+        Generate (i, j, token) for each token on the board.
+        """
+        for token, mask in self.masks.items():
+            while mask:
+                bit = mask & -mask
+                j, i = divmod(bit.bit_length() - 1, self.h)
+                yield i, j, token
+                mask ^= bit
+
+
+    def check(self, column):
+        """
+        Raise an error unless a token can be played in the column. Returns
+        the row it would land in.
         """
         if column < 0 or column >= self.m:
             raise IndexError(f'Column {column} doesn\'t exist.')
 
-        for i in range(self.n):
-            if self.board[column][i] == ' ':
-                break
-        else:
+        i = self.heights[column]
+        if i >= self.n:
             raise ColumnFullException(f'Can\'t play in column {column}. That column is full.')
+        return i
 
-        self.board[column][i] = token
+
+    def play(self, column, token):
+        """
+        Play a token in the specified column.
+        """
+        i = self.check(column)
+
+        p = column*self.h + i
+        self.masks[token] = self.masks.get(token, 0) | (1 << p)
+        self.heights[column] = i + 1
+        self.moves += 1
+        self.hash ^= zobrist_key(p, self._color(token))
 
         return self.is_winning_move(i, column, token)
 
 
-    def _find_win(self, i, j, token, di, dj):
+    def _has_run(self, x, s):
         """
-        Helper method for is_winning_move. Asks whether the slot i,j is a
-        winning move. In other words, is it part of k tokens in a row in the
-        direction determined by di and dj?
+        Does the mask x hold k bits in a row spaced s bits apart? After
+        each step, bit p of x is set if bits p, p+s, ... p+(covered-1)*s
+        were all set, so we only need log2(k) shifts to cover k bits.
         """
-        count = 0
-
-        d = 0
-        while i+d*di<self.n and j+d*dj<self.m and i+d*di>=0 and j+d*dj>=0:
-            if self[i+d*di, j+d*dj] == token:
-                count += 1
-            else:
-                break
-            d += 1
-
-        di = di * -1
-        dj = dj * -1
-        d = 1
-        while i+d*di<self.n and j+d*dj<self.m and i+d*di>=0 and j+d*dj>=0:
-            if self[i+d*di, j+d*dj] == token:
-                count += 1
-            else:
-                break
-            d += 1
-
-        return count >= self.k
+        covered = 1
+        while covered < self.k and x:
+            step = min(covered, self.k - covered)
+            x &= x >> (step*s)
+            covered += step
+        return x != 0
 
 
     def is_winning_move(self, i, j, token):
-        """
+        r"""
         Has the game been won by playing a token at position (i,j)?
 
         Conditions for a win:
@@ -120,10 +208,14 @@ class Board():
          * k in / diagonal
          * k in \ diagonal
         """
-        return self._find_win(i, j, token, di=0, dj=1)  \
-            or self._find_win(i, j, token, di=1, dj=0)  \
-            or self._find_win(i, j, token, di=1, dj=1)  \
-            or self._find_win(i, j, token, di=1, dj=-1)
+        p = j*self.h + i
+        x = self.masks.get(token, 0) | (1 << p)
+        for s, line in zip(self.directions, self._lines):
+            offset = p - (self.k-1)*s
+            window = line << offset if offset >= 0 else line >> -offset
+            if self._has_run(x & window, s):
+                return True
+        return False
 
 
     def is_full(self):
@@ -131,15 +223,109 @@ class Board():
         Return true if the game board is completely full of tokens. If no
         player has won by this point, then the game is a draw.
         """
-        for i in range(self.n):
-            for j in range(self.m):
-                if self[i,j] == ' ':
-                    return False
-        return True
+        return self.moves >= self.n * self.m
+
+
+
+class SparseBoard(Board):
+    """
+    A board for very large grids, gomoku style, which stores only the
+    occupied cells. Memory is proportional to the number of tokens played
+    rather than to n*m, and checking for a win looks at no more than k-1
+    cells in each direction from the one just played.
+    """
+    __slots__ = ('cells',)
+
+    def __init__(self, n=4, m=4, k=4):
+        if n < 1 or m < 1:
+            raise ValueError(f'Can\'t create a board of dimensions ({n},{m}).')
+        if k < 1:
+            raise ValueError(f'Number of tokens in a row to win must be positive, not {k}.')
+        self.n = n
+        self.m = m
+        self.k = k
+        self.cells = {}
+        self.heights = {}
+        self.moves = 0
+        self.colors = {}
+        self.hash = shape_key(n, m, k)
+
+    def __repr__(self):
+        return f'SparseBoard({self.n}, {self.m})'
+
+    def _cell(self, i, j):
+        return self.cells.get((i, j), ' ')
+
+    def occupied(self):
+        for (i, j), token in self.cells.items():
+            yield i, j, token
+
+
+    def check(self, column):
+        if column < 0 or column >= self.m:
+            raise IndexError(f'Column {column} doesn\'t exist.')
+
+        i = self.heights.get(column, 0)
+        if i >= self.n:
+            raise ColumnFullException(f'Can\'t play in column {column}. That column is full.')
+        return i
+
+
+    def play(self, column, token):
+        """
+        Play a token in the specified column.
+        """
+        i = self.check(column)
+
+        self.cells[i, column] = token
+        self.heights[column] = i + 1
+        self.moves += 1
+        self.hash ^= zobrist_key(column*(self.n+1) + i, self._color(token))
+
+        return self.is_winning_move(i, column, token)
+
+
+    def _count(self, i, j, token, di, dj):
+        """
+        Count up to k-1 tokens in a row starting next to (i,j) and moving
+        in the direction di, dj.
+        """
+        count = 0
+        for d in range(1, self.k):
+            if self.cells.get((i+d*di, j+d*dj)) != token:
+                break
+            count += 1
+        return count
+
+
+    def is_winning_move(self, i, j, token):
+        """
+        Has the game been won by playing a token at position (i,j)?
+        """
+        for di, dj in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            if 1 + self._count(i, j, token, di, dj) + self._count(i, j, token, -di, -dj) >= self.k:
+                return True
+        return False
+
+
+
+## boards with more cells than this are stored sparsely
+MAX_DENSE_CELLS = 64*64
+
+
+def new_board(n=4, m=4, k=4):
+    """
+    Create a Board, or a SparseBoard if the grid is very large.
+    """
+    if n * m > MAX_DENSE_CELLS:
+        return SparseBoard(n, m, k)
+    return Board(n, m, k)
 
 
 
 class Player():
+    __slots__ = ('name', 'id', 'token')
+
     def __init__(self, name, player_id=None, token=None):
         if (not name):
             raise ValueError('Give the player a non-empty name')
@@ -158,18 +344,110 @@ class Player():
 
 
 
+def _assign_tokens(players):
+    """
+    Give each player in a game a different token. Players keep their own
+    tokens unless someone earlier in the order of play has already taken
+    it, in which case they get the last spare token nobody has. Returns
+    the tokens as a string, one per seat.
+    """
+    tokens = [None] * len(players)
+    taken = set()
+    for seat, player in enumerate(players):
+        if player.token not in taken:
+            tokens[seat] = player.token
+            taken.add(player.token)
+    spares = (t for t in reversed(SPARE_TOKENS) if t not in taken)
+    for seat, token in enumerate(tokens):
+        if token is None:
+            token = next(spares, None)
+            if token is None:
+                raise ValueError(f'Can\'t give {len(players)} players different tokens.')
+            tokens[seat] = token
+    return ''.join(tokens)
+
+
+
+class History():
+    """
+    The moves of a game, which look like a list of (player, column)
+    tuples, but are stored as two arrays: the seat of the player who moved
+    and the column played, or -1 for a quit.
+    """
+    __slots__ = ('players', 'seats', 'columns')
+
+    def __init__(self, players, m):
+        self.players = players
+        self.seats = array(_typecode(len(players)))
+        self.columns = array(_typecode(m))
+
+    def __repr__(self):
+        return f'History({list(self)})'
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [(self.players[seat], column) for seat, column in zip(self.seats[i], self.columns[i])]
+        column = self.columns[i]
+        return self.players[self.seats[i]], column
+
+    def __iter__(self):
+        for seat, column in zip(self.seats, self.columns):
+            yield self.players[seat], column
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def append(self, seat, column):
+        ## seats first, so a reader who sees the column sees the seat too
+        self.seats.append(seat)
+        self.columns.append(column)
+
+
+
 class Game():
     """
     A game of connect-four, with a board and a list of players.
+
+    Moves are made under a lock, one per game, so threads can play in
+    different games at once but not in the same one. Reads don't take the
+    lock. A move appends to the history only after the board and winner
+    are updated, so anyone who sees a move in the history sees its effects.
+    Threads can wait for the next move on the game's condition variable,
+    which is notified after every move. Code that can't block a thread,
+    like an event loop, can add a listener instead, a function that's
+    called with the game after every move.
+
+    Tokens only need to be different within a game, so each game gives
+    out its own, one per seat, taken from the players' own tokens where
+    they don't clash. See _assign_tokens.
+
+    The version counts changes to the game, and is bumped by every move
+    and quit after it's in the history, so a client that has seen a
+    version can be told nothing has changed without looking further.
+
+    Servers hold many games, so a game is kept small: its attributes are
+    slots, whether each player is still in the game is a byte per seat,
+    and the condition variable and listeners are only made when needed.
     """
-    def __init__(self, *args, n=4, m=4):
+    __slots__ = ('id', 'board', 'players', 'tokens', 'active', 'turn', 'history', 'winner',
+                 'version', 'lock', '_changed', '_listeners')
+
+    def __init__(self, *args, n=4, m=4, k=4):
         self.id = str(uuid.uuid4())
-        self.board = Board(n, m)
+        self.lock = threading.Lock()
+        self._changed = None
+        self._listeners = None
+        self.board = new_board(n, m, k)
         self.players = args
-        self.player_active = {player:True for player in args}
+        self.tokens = _assign_tokens(args)
+        self.active = bytearray(b'\x01' * len(args))
         self.turn = 0
-        self.history = []
+        self.history = History(args, m)
         self.winner = None
+        self.version = 0
 
     def __eq__(self, other):
         return self.id == other.id
@@ -181,12 +459,20 @@ class Game():
         return f"Game('{self.id}')"
 
 
+    @property
+    def player_active(self):
+        """
+        A dictionary of whether each player is still in the game.
+        """
+        return {player: bool(active) for player, active in zip(self.players, self.active)}
+
+
     @property
     def active_players(self):
         """
         returns the number of active players in the game.
         """
-        return sum(active for player, active in self.player_active.items())
+        return sum(self.active)
 
 
     @property
@@ -197,36 +483,82 @@ class Game():
         return 'DONE' if (self.winner or self.board.is_full() or self.active_players < 2) else 'IN_PROGRESS'
 
 
-    def quit(self, player):
+    def _seat(self, player):
+        """
+        Where the player sits in the order of play, or None if the player
+        isn't in the game.
+        """
+        for i, p in enumerate(self.players):
+            if p == player:
+                return i
+        return None
+
+
+    def quit(self, player, log=None):
         """
-        The specified player quits the game.
+        The specified player quits the game. If given, log is called with
+        the move number once the quit is known to be allowed but before
+        it's made, so that if log raises an error, the game is unchanged.
         """
+        with self.lock:
+            seat = self._check_quit(player)
+            if log is not None:
+                log(len(self.history))
+            move_number = self._quit(seat)
+            if self._changed is not None:
+                self._changed.notify_all()
+        self._notify()
+        return move_number
+
+
+    def _check_quit(self, player):
         if self.status == 'DONE':
             raise GameOver('Can\'t quit. Game is over.')
 
-        if player not in self.player_active:
+        seat = self._seat(player)
+        if seat is None:
             raise KeyError(f'{player.name} not in {self}.')
-        self.player_active[player] = False
+        return seat
 
-        ## record quitting in history as column -1
-        self.history.append((player, -1))
+
+    def _quit(self, seat):
+        self.active[seat] = 0
 
         ## if there's only one player left, that player wins
         if self.active_players == 1:
-            for player, active in self.player_active.items():
-                if active:
-                    self.winner = player
+            self.winner = self.players[self.active.index(1)]
 
         ## if the current player quits, figure out whose turn it is
-        current_player = self.players[self.turn]
-        if player == current_player:
+        if seat == self.turn:
             self._increment_turn()
 
+        ## record quitting in history as column -1
+        self.history.append(seat, -1)
+        self.version += 1
+
+        # return move number
+        return len(self.history)-1
+
 
-    def play(self, player, column):
+    def play(self, player, column, log=None):
         """
-        The given player places a token in the column specified.
+        The given player places a token in the column specified. If given,
+        log is called with the move number once the move is known to be
+        legal but before it's made, so that if log raises an error, the
+        game is unchanged.
         """
+        with self.lock:
+            self._check_play(player, column)
+            if log is not None:
+                log(len(self.history))
+            move_number = self._play(player, column)
+            if self._changed is not None:
+                self._changed.notify_all()
+        self._notify()
+        return move_number
+
+
+    def _check_play(self, player, column):
         if self.status == 'DONE':
             raise GameOver('Game Over')
 
@@ -234,30 +566,69 @@ class Game():
         if player != current_player:
             raise OutOfTurnError(f'{player.name} can\'t play right now. It\'s {current_player.name}\'s turn.')
 
-        if not self.player_active.get(player, False):
+        if not self.active[self.turn]:
             raise ValueError(f'{player.name} is not an active player in the game.')
 
+        self.board.check(column)
+
+
+    def _play(self, player, column):
         ## update board
-        win = self.board.play(column, player.token)
+        seat = self.turn
+        win = self.board.play(column, self.tokens[seat])
         if win:
             self.winner = player
 
-        ## record move in history
-        self.history.append((player, column))
-
         self._increment_turn()
 
+        ## record move in history
+        self.history.append(seat, column)
+        self.version += 1
+
         # return move number
         return len(self.history)-1
 
 
+    def add_listener(self, listener):
+        with self.lock:
+            if self._listeners is None:
+                self._listeners = set()
+            self._listeners.add(listener)
+
+
+    def remove_listener(self, listener):
+        with self.lock:
+            if self._listeners is not None:
+                self._listeners.discard(listener)
+
+
+    def _notify(self):
+        if self._listeners:
+            for listener in list(self._listeners):
+                listener(self)
+
+
+    def wait_for_moves(self, count, timeout=None):
+        """
+        Wait until the history holds at least count moves or the game is
+        over, or until timeout seconds pass. Returns True unless it timed
+        out.
+        """
+        if len(self.history) >= count:
+            return True
+        with self.lock:
+            if self._changed is None:
+                self._changed = threading.Condition(self.lock)
+            return self._changed.wait_for(
+                lambda: len(self.history) >= count or self.status == 'DONE',
+                timeout)
+
+
     def _increment_turn(self):
         """
         next active player's turn
         """
         i = 1
-        while i < len(self.players) and not \
-              self.player_active.get(self.players[(self.turn + i) % len(self.players)], False):
+        while i < len(self.players) and not self.active[(self.turn + i) % len(self.players)]:
             i += 1
         self.turn = (self.turn + i) % len(self.players)
-
@@ -0,0 +1,63 @@
+"""
+An ordered set of game IDs that can be paged through, used to list
+games by status. See the store and journal modules.
+"""
+import bisect
+
+
+## number of games listed per page, by default and at most
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class Index():
+    """
+    An ordered set of game IDs, each added with a key greater than any
+    before it, which can be paged through starting after a given key.
+    Removed IDs leave holes that are swept out once they outnumber the
+    IDs that are left.
+    """
+    def __init__(self):
+        self.keys = []
+        self.ids = []
+        self.positions = {}
+        self.holes = 0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, game_id):
+        return game_id in self.positions
+
+    def add(self, key, game_id):
+        self.positions[game_id] = len(self.ids)
+        self.keys.append(key)
+        self.ids.append(game_id)
+
+    def discard(self, game_id):
+        i = self.positions.pop(game_id, None)
+        if i is None:
+            return
+        self.ids[i] = None
+        self.holes += 1
+        if self.holes > len(self.positions):
+            self._sweep()
+
+    def _sweep(self):
+        live = [(key, game_id) for key, game_id in zip(self.keys, self.ids) if game_id is not None]
+        self.keys = [key for key, game_id in live]
+        self.ids = [game_id for key, game_id in live]
+        self.positions = {game_id: i for i, game_id in enumerate(self.ids)}
+        self.holes = 0
+
+    def page(self, after=0, limit=None):
+        """
+        Returns up to limit (key, game ID) tuples with keys greater than after.
+        """
+        out = []
+        i = bisect.bisect_right(self.keys, after)
+        while i < len(self.ids) and (limit is None or len(out) < limit):
+            if self.ids[i] is not None:
+                out.append((self.keys[i], self.ids[i]))
+            i += 1
+        return out
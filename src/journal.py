@@ -0,0 +1,256 @@
+"""
+Persistent storage of games in an append-only journal of events in a
+local directory, an alternative to the SQLite database in the sqlstore
+module that costs no database round trip per move.
+
+Each new player, new game, move, quit and finished game is appended to
+the journal as a line of JSON, and written through to the operating
+system before the move is made, so games survive the server restarting.
+Lines aren't fsynced as they're written, so the last moves before the
+machine itself goes down can be lost.
+
+Every SNAPSHOT_EVENTS events, a new journal file is started, and the
+state of every game as of then is written to a snapshot. The snapshot
+is built on a background thread from the previous snapshot and the
+journal files since, not from the live state, so writing it never holds
+up the events being appended. On startup, the latest
+snapshot is loaded and only the journal files written since then are
+replayed. Like the database, the journal holds games as their logs of
+moves rather than as boards, a few small arrays per game, so loading a
+million games costs seconds, and each game is rebuilt by replaying its
+moves only when it's first asked for. See the store module.
+
+File names carry a generation number. Snapshot G holds every event in
+journal files older than G, so after a crash at any point, replaying
+the journals from the latest complete snapshot's generation on gives
+back every event written.
+"""
+import json
+import os
+import pickle
+import re
+import threading
+from array import array
+
+from game import _typecode
+from index import Index
+
+
+## events to append between snapshots
+SNAPSHOT_EVENTS = int(os.environ.get('CONNECT_FOUR_SNAPSHOT_EVENTS', 100000))
+
+_FILE_NAME = re.compile(r'(journal|snapshot)\.(\d+)$')
+
+
+class Journal():
+    """
+    A journal of players, games and moves, with the same methods as the
+    sqlstore Database, and the state it describes held in memory. Each
+    game is a list of rows, columns, k, a tuple of player IDs, arrays of
+    the seat and column of each move, and the game's status.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.migrated = False
+        self.events = 0
+        self.snapshots = 0
+        self._lock = threading.Lock()
+        self._snapshotter = None
+
+        os.makedirs(path, exist_ok=True)
+        ## a new file, so nothing is appended to a line torn by a crash
+        self.generation = self._load() + 1
+        self._journal = open(self._file('journal', self.generation), 'a')
+
+    def __repr__(self):
+        return f"Journal('{self.path}')"
+
+    def _file(self, kind, gen):
+        return os.path.join(self.path, f'{kind}.{gen:08d}')
+
+    def _files(self):
+        """
+        (kind, generation) of each journal and complete snapshot file.
+        """
+        matches = (_FILE_NAME.match(name) for name in os.listdir(self.path))
+        return [(m.group(1), int(m.group(2))) for m in matches if m]
+
+    def _load(self, until=None):
+        """
+        Load the latest snapshot and replay the journal files since, only
+        those older than generation until if it's given. Returns the last
+        generation loaded.
+        """
+        self.players = {}
+        self.games = {}
+        self.indexes = {'IN_PROGRESS': Index(), 'DONE': Index(), None: Index()}
+        self.key = 0
+
+        files = [(kind, gen) for kind, gen in self._files() if until is None or gen < until]
+        start = max((gen for kind, gen in files if kind == 'snapshot'), default=0)
+        if start:
+            with open(self._file('snapshot', start), 'rb') as f:
+                self.players, self.games, self.indexes, self.key = pickle.load(f)
+        journals = sorted(gen for kind, gen in files if kind == 'journal' and gen >= start)
+        for gen in journals:
+            self._replay(self._file('journal', gen))
+        return max(journals + [start])
+
+    def _replay(self, path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    ## a line torn by a crash is the last one in its file
+                    continue
+                self._apply(event)
+
+    def close(self):
+        """
+        Flush the journal to disk and wait for any snapshot to be written.
+        """
+        snapshotter = self._snapshotter
+        if snapshotter is not None:
+            snapshotter.join()
+        with self._lock:
+            if not self._journal.closed:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+                self._journal.close()
+
+
+    def _append(self, event):
+        """
+        Write an event to the journal and apply it. An event that doesn't
+        apply raises an error and isn't written.
+        """
+        with self._lock:
+            self._check(event)
+            self._journal.write(json.dumps(event, separators=(',', ':')) + '\n')
+            self._journal.flush()
+            self._apply(event)
+            self.events += 1
+            if self.events >= SNAPSHOT_EVENTS and self._snapshotter is None:
+                self._snapshotter = threading.Thread(target=self.snapshot, name='journal-snapshot', daemon=True)
+                self._snapshotter.start()
+
+    def _check(self, event):
+        kind = event[0]
+        if kind == 'game' and event[1] in self.games:
+            raise ValueError(f'Game {event[1]} is already in the journal.')
+        if kind == 'move':
+            game_id, move_number, player_id, column = event[1:]
+            if game_id not in self.games:
+                raise KeyError(f'Game {game_id} is not in the journal.')
+            game = self.games[game_id]
+            if move_number != len(game[5]):
+                raise ValueError(f'Move {move_number} of game {game_id} is out of order.')
+            if player_id not in game[3] or not -1 <= column < game[1]:
+                raise ValueError(f'Move {move_number} of game {game_id} isn\'t a move in the game.')
+        if kind == 'status' and event[1] not in self.games:
+            raise KeyError(f'Game {event[1]} is not in the journal.')
+
+    def _apply(self, event):
+        kind = event[0]
+        if kind == 'player':
+            player_id, token = event[1:]
+            self.players[player_id] = token
+        elif kind == 'game':
+            game_id, rows, columns, k, player_ids = event[1:]
+            self.games[game_id] = [rows, columns, k, tuple(player_ids),
+                                   array(_typecode(len(player_ids))), array(_typecode(columns)), 'IN_PROGRESS']
+            self.key += 1
+            self.indexes[None].add(self.key, game_id)
+            self.indexes['IN_PROGRESS'].add(self.key, game_id)
+        elif kind == 'move':
+            game_id, move_number, player_id, column = event[1:]
+            game = self.games[game_id]
+            game[4].append(game[3].index(player_id))
+            game[5].append(column)
+        elif kind == 'status':
+            game_id, status = event[1:]
+            game = self.games[game_id]
+            if game[6] != status:
+                self.indexes[game[6]].discard(game_id)
+                self.key += 1
+                self.indexes[status].add(self.key, game_id)
+                game[6] = status
+
+
+    def snapshot(self):
+        """
+        Start a new journal file, write a snapshot of every game as of
+        then, and delete the files the snapshot replaces. Only starting the
+        file holds the lock. The snapshot is built from the previous one
+        and the journal files since, on a scratch Journal.
+        """
+        with self._lock:
+            self.generation += 1
+            gen = self.generation
+            self._journal.close()
+            self._journal = open(self._file('journal', gen), 'a')
+            self.events = 0
+
+        scratch = Journal.__new__(Journal)
+        scratch.path = self.path
+        scratch._load(until=gen)
+        data = pickle.dumps((scratch.players, scratch.games, scratch.indexes, scratch.key), pickle.HIGHEST_PROTOCOL)
+        del scratch
+
+        path = self._file('snapshot', gen)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        self.snapshots += 1
+
+        for kind, old in self._files():
+            if old < gen:
+                os.remove(self._file(kind, old))
+        with self._lock:
+            if self._snapshotter is threading.current_thread():
+                self._snapshotter = None
+
+
+    def get_player(self, player_id):
+        """
+        Returns the token of the given player, or None if there's no such
+        player.
+        """
+        return self.players.get(player_id)
+
+    def add_player(self, player_id, token):
+        self._append(['player', player_id, token])
+
+    def list_games(self, state=None, after=0, limit=-1):
+        """
+        Returns up to limit (key, game ID) tuples for games added to the
+        index of the given state after the one with the given key.
+        """
+        with self._lock:
+            return self.indexes[state].page(after, limit if limit >= 0 else None)
+
+    def get_game(self, game_id):
+        """
+        Returns a game's rows, columns, k, list of player IDs in order of
+        play and the log of its moves as (player ID, column) tuples, or None
+        if there's no such game.
+        """
+        with self._lock:
+            game = self.games.get(game_id)
+            if game is None:
+                return None
+            rows, columns, k, player_ids, seats, moves, status = game
+            return rows, columns, k, list(player_ids), [
+                (player_ids[seat], column) for seat, column in zip(seats, moves)]
+
+    def add_game(self, game_id, rows, columns, k, player_ids):
+        self._append(['game', game_id, rows, columns, k, list(player_ids)])
+
+    def append_move(self, game_id, move_number, player_id, column):
+        self._append(['move', game_id, move_number, player_id, column])
+
+    def set_status(self, game_id, status):
+        self._append(['status', game_id, status])
@@ -0,0 +1,244 @@
+"""
+Monte Carlo tree search player, for boards and values of k where
+exact search is hopeless.
+
+The tree is grown by UCT, and each leaf is scored by a batch of random
+playouts. The playouts don't go through Board.play. Instead the leaf
+position is copied into a stack of NumPy arrays, one per playout, and
+all of them are advanced a move at a time together, with vectorized
+checks for wins.
+
+On a big sparse board, play is limited to columns within k-1 of a
+column that already has a token in it, and playouts stop after
+ROLLOUT_PLIES moves, counting as draws if nobody has won.
+"""
+import math
+import time
+
+import numpy as np
+
+from solver import player_to_move
+
+
+## playouts per leaf
+BATCH = 512
+
+## most cells across a batch of playout boards
+MAX_BATCH_CELLS = 1 << 24
+
+## longest playout on a sparse board
+ROLLOUT_PLIES = 100
+
+## exploration constant for UCT
+EXPLORATION = 1.4
+
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+def _wins(boards, b, rows, cols, player, k):
+    """
+    For the boards indexed by b, is the token just played at rows, cols
+    part of k in a row for player?
+    """
+    _, n, m = boards.shape
+    won = np.zeros(len(b), dtype=bool)
+    ## no run on the board reaches further than its longer side
+    reach = min(k, max(n, m))
+    for di, dj in DIRECTIONS:
+        count = np.ones(len(b), dtype=np.int32)
+        for sign in (1, -1):
+            run = np.ones(len(b), dtype=bool)
+            for d in range(1, reach):
+                i = rows + sign*d*di
+                j = cols + sign*d*dj
+                inside = (i >= 0) & (i < n) & (j >= 0) & (j < m)
+                run &= inside & (boards[b, np.clip(i, 0, n-1), np.clip(j, 0, m-1)] == player)
+                count += run
+        won |= count >= k
+    return won
+
+
+def _wins_at(grid, i, j, player, k):
+    """
+    Would a token of player's at i, j in grid be part of k in a row? This
+    is checked for one cell at a time while expanding the tree, where
+    plain Python beats setting up NumPy arrays.
+    """
+    n, m = grid.shape
+    for di, dj in DIRECTIONS:
+        count = 1
+        for sign in (1, -1):
+            for d in range(1, k):
+                y, x = i + sign*d*di, j + sign*d*dj
+                if not (0 <= y < n and 0 <= x < m) or grid[y, x] != player:
+                    break
+                count += 1
+        if count >= k:
+            return True
+    return False
+
+
+def rollouts(grid, heights, allowed, player, count, k, plies, rng, deadline=None):
+    """
+    Play count random games from the position in grid, with player to
+    move, for at most the given number of plies, playing only in allowed
+    columns. Games still going at the deadline, if given, are cut short.
+    Returns an array of the winner of each game, 1 or 2, or 0 for a draw.
+    """
+    n, m = grid.shape
+    boards = np.repeat(grid[np.newaxis], count, axis=0)
+    hts = np.repeat(heights[np.newaxis], count, axis=0)
+    winner = np.zeros(count, dtype=np.int8)
+    live = np.arange(count)
+
+    for ply in range(plies):
+        if deadline is not None and time.monotonic() > deadline:
+            break
+        legal = (hts[live] < n) & allowed
+        live = live[legal.any(axis=1)]
+        if len(live) == 0:
+            break
+        legal = (hts[live] < n) & allowed
+
+        ## pick a random legal column for each live board
+        r = rng.random(legal.shape)
+        r[~legal] = -1.0
+        cols = r.argmax(axis=1)
+        rows = hts[live, cols]
+
+        boards[live, rows, cols] = player
+        hts[live, cols] += 1
+
+        won = _wins(boards, live, rows, cols, player, k)
+        winner[live[won]] = player
+        live = live[~won]
+        player = 3 - player
+
+    return winner
+
+
+class Node():
+    """
+    A node in the search tree, reached by player playing in column.
+    Wins are counted for that player, with draws as half a win.
+    """
+    __slots__ = ('column', 'player', 'parent', 'children', 'untried', 'visits', 'wins', 'terminal')
+
+    def __init__(self, column, player, parent, untried):
+        self.column = column
+        self.player = player
+        self.parent = parent
+        self.children = []
+        self.untried = untried
+        self.visits = 0
+        self.wins = 0.0
+        self.terminal = None
+
+    def select(self):
+        log_visits = math.log(self.visits)
+        return max(self.children, key=lambda c:
+            c.wins / c.visits + EXPLORATION * math.sqrt(log_visits / c.visits))
+
+
+def _window(board):
+    """
+    Find the part of the board we'll play in. Returns the tokens on the
+    board as (i, j, token) tuples, the range of columns lo to hi, the
+    columns in that range we'll play in, the number of rows and the
+    number of plies to play out.
+    """
+    cells = list(board.occupied())
+    if hasattr(board, 'masks'):
+        return cells, 0, board.m, set(range(board.m)), board.n, board.n * board.m - board.moves
+
+    occupied = {j for i, j, t in cells} or {board.m // 2}
+    allowed = {c for j in occupied for c in range(j - board.k + 1, j + board.k) if 0 <= c < board.m}
+    lo, hi = min(allowed), max(allowed) + 1
+    n = min(board.n, max([i + 1 for i, j, t in cells], default=0) + ROLLOUT_PLIES)
+    return cells, lo, hi, {j - lo for j in allowed}, n, ROLLOUT_PLIES
+
+
+def choose_move(game, time_ms=1000, batch=BATCH, seed=None):
+    """
+    Choose a column for the player whose turn it is in a two-player game,
+    searching for about time_ms milliseconds. Returns the column and a
+    dict of statistics, including playouts per second.
+    """
+    start = time.monotonic()
+    deadline = start + time_ms / 1000
+    rng = np.random.default_rng(seed)
+
+    player_to_move(game)
+    token = game.tokens[game.turn]
+    board = game.board
+    cells, lo, hi, columns, n, plies = _window(board)
+
+    grid = np.zeros((n, hi - lo), dtype=np.int8)
+    for i, j, t in cells:
+        grid[i, j - lo] = 1 if t == token else 2
+    heights = (grid != 0).sum(axis=0).astype(np.int32)
+    allowed = np.zeros(hi - lo, dtype=bool)
+    allowed[sorted(columns)] = True
+    batch = max(1, min(batch, MAX_BATCH_CELLS // grid.size))
+
+    def legal(heights):
+        return [j for j in sorted(columns) if heights[j] < n]
+
+    root = Node(None, 2, None, legal(heights))
+    if not root.untried:
+        raise ValueError('No legal moves near the tokens on the board.')
+    playouts = 0
+
+    while not root.visits or time.monotonic() < deadline:
+        node = root
+        g, h = grid.copy(), heights.copy()
+
+        ## walk down the tree to a node that isn't fully expanded
+        while not node.untried and node.children and node.terminal is None:
+            node = node.select()
+            g[h[node.column], node.column] = node.player
+            h[node.column] += 1
+
+        ## expand it by one move, a winning one if there is one
+        if node.untried and node.terminal is None:
+            mover = 3 - node.player
+            for j in node.untried:
+                if _wins_at(g, h[j], j, mover, board.k):
+                    node.untried.remove(j)
+                    break
+            else:
+                j = node.untried.pop(rng.integers(len(node.untried)))
+            i = h[j]
+            g[i, j] = mover
+            h[j] += 1
+            child = Node(j, mover, node, legal(h))
+            if _wins_at(g, i, j, mover, board.k):
+                child.terminal = mover
+            elif not child.untried:
+                child.terminal = 0
+            node.children.append(child)
+            node = child
+
+        ## score the node, by playouts unless the game is already over
+        if node.terminal is not None:
+            winners = np.full(batch, node.terminal, dtype=np.int8)
+        else:
+            winners = rollouts(g, h, allowed, 3 - node.player, batch, board.k, plies, rng, deadline)
+            playouts += len(winners)
+        ones = int((winners == 1).sum())
+        twos = int((winners == 2).sum())
+        draws = len(winners) - ones - twos
+
+        while node is not None:
+            node.visits += len(winners)
+            node.wins += (ones if node.player == 1 else twos) + draws / 2
+            node = node.parent
+
+    best = max(root.children, key=lambda c: c.visits)
+    elapsed = time.monotonic() - start
+    return best.column + lo, {
+        'playouts': playouts,
+        'seconds': elapsed,
+        'playouts_per_second': playouts / elapsed if elapsed else 0.0,
+        'win_rate': best.wins / best.visits,
+    }
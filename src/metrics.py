@@ -0,0 +1,157 @@
+"""
+Metrics for watching the server in production, served at /metrics in
+the Prometheus text format.
+
+The apps time every request and count its status code by route, and
+count every move played. Recording a request costs a bisect and a few
+additions under one lock, a microsecond or so, so it can sit on every
+request. Routes are labeled by their patterns in one format, such as
+/drop_token/{game_id}/{player_id}, whichever app serves them. Gauges of
+the games in memory come from counts the store keeps as games come and
+go, so a scrape costs the same however many games there are.
+"""
+import bisect
+import re
+import threading
+import time
+
+import store
+
+
+## upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+## seconds over which moves per second is averaged
+RATE_WINDOW = 60
+
+## content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_LOCK = threading.Lock()
+
+## by (method, route), a list of counts per bucket, the last for slower
+## requests, and the sum of the seconds taken
+_LATENCIES = {}
+_SUMS = {}
+
+## by (method, route, status code), the number of responses
+_STATUSES = {}
+
+## moves ever, and moves in each of the last RATE_WINDOW seconds
+_MOVES = [0]
+_MOVES_BY_SECOND = [0] * RATE_WINDOW
+_SECONDS = [0] * RATE_WINDOW
+
+
+## a path parameter in a Flask or Starlette route pattern, with any converter
+_PARAMETER = re.compile(r'<(?:\w+:)?(\w+)>|\{(\w+)(?::\w+)?\}')
+
+
+def route_label(pattern):
+    """
+    The label of a route with the given Flask or Starlette pattern.
+    """
+    return _PARAMETER.sub(lambda m: '{' + (m.group(1) or m.group(2)) + '}', pattern)
+
+
+def observe_request(method, route, status, seconds):
+    """
+    Record a request to a route, by the pattern that matched it rather
+    than its path, so that each game doesn't get its own series.
+    """
+    i = bisect.bisect_left(BUCKETS, seconds)
+    key = (method, route)
+    with _LOCK:
+        counts = _LATENCIES.get(key)
+        if counts is None:
+            counts = _LATENCIES[key] = [0] * (len(BUCKETS) + 1)
+            _SUMS[key] = 0.0
+        counts[i] += 1
+        _SUMS[key] += seconds
+        key = (method, route, status)
+        _STATUSES[key] = _STATUSES.get(key, 0) + 1
+
+
+def count_move():
+    now = int(time.monotonic())
+    i = now % RATE_WINDOW
+    with _LOCK:
+        _MOVES[0] += 1
+        if _SECONDS[i] != now:
+            _SECONDS[i] = now
+            _MOVES_BY_SECOND[i] = 0
+        _MOVES_BY_SECOND[i] += 1
+
+
+def moves_per_second():
+    """
+    Moves per second over the last RATE_WINDOW seconds, not counting the
+    second under way.
+    """
+    now = int(time.monotonic())
+    with _LOCK:
+        moves = sum(count for count, second in zip(_MOVES_BY_SECOND, _SECONDS)
+                    if now - RATE_WINDOW <= second < now)
+    return moves / RATE_WINDOW
+
+
+def reset():
+    with _LOCK:
+        _LATENCIES.clear()
+        _SUMS.clear()
+        _STATUSES.clear()
+        _MOVES[0] = 0
+        _MOVES_BY_SECOND[:] = [0] * RATE_WINDOW
+        _SECONDS[:] = [0] * RATE_WINDOW
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+
+def render():
+    """
+    All the metrics in the Prometheus text format.
+    """
+    with _LOCK:
+        latencies = {key: list(counts) for key, counts in _LATENCIES.items()}
+        sums = dict(_SUMS)
+        statuses = dict(_STATUSES)
+        moves = _MOVES[0]
+
+    games = dict(store.COUNTS)
+
+    lines = [
+        '# HELP connect_four_request_seconds Time taken to answer requests, by route.',
+        '# TYPE connect_four_request_seconds histogram',
+    ]
+    for (method, route), counts in sorted(latencies.items()):
+        total = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), counts):
+            total += count
+            lines.append(f'connect_four_request_seconds_bucket{_labels(method=method, route=route, le=bound)} {total}')
+        lines.append(f'connect_four_request_seconds_sum{_labels(method=method, route=route)} {sums[method, route]}')
+        lines.append(f'connect_four_request_seconds_count{_labels(method=method, route=route)} {total}')
+
+    lines += [
+        '# HELP connect_four_responses_total Responses, by route and status code.',
+        '# TYPE connect_four_responses_total counter',
+    ]
+    for (method, route, status), count in sorted(statuses.items()):
+        lines.append(f'connect_four_responses_total{_labels(method=method, route=route, status=status)} {count}')
+
+    lines += [
+        '# HELP connect_four_games Games held in memory, by status.',
+        '# TYPE connect_four_games gauge',
+        *(f'connect_four_games{_labels(status=status)} {count}' for status, count in games.items()),
+        '# HELP connect_four_players Players held in memory.',
+        '# TYPE connect_four_players gauge',
+        f'connect_four_players {len(store.PLAYERS)}',
+        '# HELP connect_four_moves_total Moves played.',
+        '# TYPE connect_four_moves_total counter',
+        f'connect_four_moves_total {moves}',
+        f'# HELP connect_four_moves_per_second Moves per second over the last {RATE_WINDOW} seconds.',
+        '# TYPE connect_four_moves_per_second gauge',
+        f'connect_four_moves_per_second {moves_per_second()}',
+    ]
+    return '\n'.join(lines) + '\n'
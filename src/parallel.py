@@ -0,0 +1,177 @@
+"""
+Parallel search that splits the moves at the root of the game tree
+across a pool of processes.
+
+Each worker searches one root move by iterative deepening until the
+deadline. Workers publish the scores of the wins they prove in a shared
+array, so the others can narrow their window to look only for better
+wins. Positions are sent to the workers as a handful of ints (the
+masks, move count, hash and color the solver works with), not as
+Board or Player objects.
+
+The number of workers defaults to the CONNECT_FOUR_SEARCH_WORKERS
+environment variable, or 1, which means don't use the pool at all.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from solver import HINT_BUDGET, Search, Timeout
+from transposition import shared_table, zobrist_key
+
+
+WORKERS = int(os.environ.get('CONNECT_FOUR_SEARCH_WORKERS', 1))
+
+## how many searches can share the pool at once
+SLOTS = 64
+
+
+## in the workers, the shared array of best scores, one slot per search
+_alphas = None
+
+def _init(alphas):
+    global _alphas
+    _alphas = alphas
+
+
+def _search_move(shape, encoded, column, slot, deadline):
+    """
+    Search the root move in the given column of an encoded position until
+    the deadline, given as wall clock time. Returns the column, its score,
+    the depth searched to and the alpha the score was searched against.
+    A score at or below that alpha is only an upper bound.
+    """
+    n, m, k = shape
+    position, mask, moves, key, color = encoded
+    table = shared_table()
+    search = Search(n, m, k, deadline=time.monotonic() + deadline - time.time(), table=table)
+    table.new_search()
+
+    move = (mask + search.bottom[column]) & search.columns[column]
+    if search.wins(position | move):
+        score = (search.size + 1 - moves) // 2
+        _publish(slot, score)
+        return column, score, 0, -search.size
+
+    child = (position ^ mask, mask | move, moves + 1)
+    child_key = key ^ zobrist_key(move.bit_length() - 1, color)
+
+    result = column, 0, 0, -search.size
+    for depth in range(1, search.size - moves + 1):
+        ## only proven wins are worth sharing, a 0 might just mean
+        ## the search didn't look far enough
+        shared = _alphas[slot]
+        alpha = shared if shared > 0 else -search.size
+        try:
+            score = -search.negamax(*child, depth - 1, -search.size, -alpha, child_key, color ^ 1)
+        except Timeout:
+            break
+        result = column, score, depth, alpha
+        if score != 0:
+            break
+
+    _publish(slot, result[1])
+    return result
+
+
+def _publish(slot, score):
+    with _alphas.get_lock():
+        if score > _alphas[slot]:
+            _alphas[slot] = score
+
+
+class Pool():
+    """
+    A process pool for root-split searches.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        ## the server forks from a process with threads running, like the
+        ## database writer, so start the workers from a clean server process
+        context = multiprocessing.get_context('forkserver')
+        self.alphas = context.Array('i', SLOTS)
+        self.slots = queue.Queue()
+        for i in range(SLOTS):
+            self.slots.put(i)
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_init, initargs=(self.alphas,))
+
+    def __repr__(self):
+        return f'Pool({self.workers})'
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def best_move(self, board, token, budget=HINT_BUDGET):
+        """
+        Find the best column for the player with the given token, like
+        solver.best_move but searching root moves in parallel.
+        """
+        if not hasattr(board, 'masks'):
+            raise ValueError(f'Can\'t search a board of dimensions ({board.n},{board.m}).')
+
+        search = Search(board.n, board.m, board.k)
+        position = board.masks.get(token, 0)
+        mask = 0
+        for x in board.masks.values():
+            mask |= x
+        color = board.colors.get(token, len(board.colors))
+
+        legal = [j for j, move in search.moves(mask)]
+        if not legal:
+            raise ValueError('Board is full.')
+        for j, move in search.moves(mask):
+            if search.wins(position | move):
+                return j, (search.size + 1 - board.moves) // 2
+
+        slot = self.slots.get()
+        try:
+            self.alphas[slot] = -search.size
+            ## with more moves than workers, the moves are searched in
+            ## waves, each with an equal share of the budget
+            start = time.time()
+            waves = -(-len(legal) // self.workers)
+            encoded = (position, mask, board.moves, board.hash, color)
+            pending = [self.executor.submit(_search_move, (board.n, board.m, board.k), encoded, j, slot,
+                                            start + budget * (i // self.workers + 1) / waves)
+                       for i, j in enumerate(legal)]
+            done, not_done = concurrent.futures.wait(pending, timeout=budget + 1.0)
+            for future in not_done:
+                future.cancel()
+            results = [future.result() for future in done if not future.cancelled()]
+        finally:
+            self.slots.put(slot)
+
+        if not results:
+            return legal[0], 0
+
+        ## prefer scores that are exact over upper bounds, then higher
+        ## scores, then moves nearer the center
+        rank = {j: i for i, j in enumerate(legal)}
+        column, score, depth, alpha = max(results, key=lambda r: (r[1] > r[3], r[1], -rank[r[0]]))
+        return column, score
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool(workers=None):
+    """
+    The process-wide pool, created the first time it's needed and
+    recreated if asked for a different number of workers.
+    """
+    global _POOL
+    workers = workers or WORKERS
+    with _POOL_LOCK:
+        if _POOL is None or _POOL.workers != workers:
+            if _POOL is not None:
+                _POOL.shutdown()
+            _POOL = Pool(workers)
+        return _POOL
+
+
+def best_move(board, token, budget=HINT_BUDGET, workers=None):
+    return get_pool(workers).best_move(board, token, budget)
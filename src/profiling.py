@@ -0,0 +1,180 @@
+"""
+Opt-in sampling profiler for the game engine and store.
+
+When switched on, a random RATE fraction of requests to the Flask app are
+profiled. Calls to functions in game.py and store.py are timed, and
+calls to anything else are skipped. Aggregated timings per function
+accumulate across requests. They can be dumped as a table, or as
+collapsed stacks that flame graph tools like flamegraph.pl or speedscope
+read, one line per stack of engine functions with its self time in
+microseconds.
+
+Switch it on with the CONNECT_FOUR_PROFILE environment variable, set to
+the fraction of requests to sample, or at run time through the
+/admin/profile endpoint when CONNECT_FOUR_ADMIN is set. When it's off,
+the cost is one test of RATE per request. Only the sampled requests pay
+for the profile hook, on their own thread.
+"""
+import atexit
+import os
+import random
+import sys
+import threading
+import time
+
+
+## fraction of requests to profile, 0 for none
+RATE = float(os.environ.get('CONNECT_FOUR_PROFILE', 0))
+
+## where to dump collapsed stacks, with the table of timings alongside
+OUTPUT = os.environ.get('CONNECT_FOUR_PROFILE_OUTPUT', 'profile.collapsed')
+
+## whether the admin endpoints are served
+ADMIN = bool(os.environ.get('CONNECT_FOUR_ADMIN'))
+
+## the source files whose functions are timed
+FILES = {'game.py', 'store.py'}
+
+_LOCK = threading.Lock()
+
+## by function name, [calls, total seconds, self seconds]
+_STATS = {}
+
+## by stack of function names joined with ';', self seconds
+_STACKS = {}
+
+_SAMPLES = [0]
+
+
+def _name(code):
+    module = os.path.basename(code.co_filename)[:-3]
+    ## co_qualname is new in Python 3.11
+    return f'{module}.{getattr(code, "co_qualname", code.co_name)}'
+
+
+class Sampler():
+    """
+    A profile hook for one request. It keeps a stack of the engine
+    functions under way, each with its frame, name, start time and time
+    spent in engine functions it called.
+    """
+    def __init__(self):
+        self.stack = []
+        self.stats = {}
+        self.stacks = {}
+        self._files = {}
+
+    def _tracked(self, code):
+        tracked = self._files.get(code.co_filename)
+        if tracked is None:
+            tracked = self._files[code.co_filename] = os.path.basename(code.co_filename) in FILES
+        return tracked
+
+    def __call__(self, frame, event, arg):
+        if event == 'call':
+            if self._tracked(frame.f_code):
+                self.stack.append([frame, _name(frame.f_code), time.perf_counter(), 0.0])
+        elif event == 'return':
+            if self.stack and self.stack[-1][0] is frame:
+                now = time.perf_counter()
+                path = ';'.join(entry[1] for entry in self.stack)
+                frame, name, start, children = self.stack.pop()
+                elapsed = now - start
+                if self.stack:
+                    self.stack[-1][3] += elapsed
+                stats = self.stats.get(name)
+                if stats is None:
+                    stats = self.stats[name] = [0, 0.0, 0.0]
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] += elapsed - children
+                self.stacks[path] = self.stacks.get(path, 0.0) + elapsed - children
+
+
+def start():
+    """
+    Maybe start profiling the current thread, with chance RATE. Returns the
+    sampler to pass to stop, or None.
+    """
+    if random.random() >= RATE:
+        return None
+    sampler = Sampler()
+    sys.setprofile(sampler)
+    return sampler
+
+
+def stop(sampler):
+    """
+    Stop profiling the current thread and add what the sampler saw to the
+    totals.
+    """
+    sys.setprofile(None)
+    with _LOCK:
+        _SAMPLES[0] += 1
+        for name, (calls, total, own) in sampler.stats.items():
+            stats = _STATS.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += calls
+            stats[1] += total
+            stats[2] += own
+        for path, seconds in sampler.stacks.items():
+            _STACKS[path] = _STACKS.get(path, 0.0) + seconds
+
+
+def set_rate(rate):
+    global RATE
+    if not 0 <= rate <= 1:
+        raise ValueError(f'Profiling rate must be between 0 and 1, not {rate}.')
+    RATE = rate
+
+
+def reset():
+    with _LOCK:
+        _STATS.clear()
+        _STACKS.clear()
+        _SAMPLES[0] = 0
+
+
+def samples():
+    return _SAMPLES[0]
+
+
+def stats():
+    """
+    (function, calls, total seconds, self seconds) for each function seen,
+    most total time first.
+    """
+    with _LOCK:
+        rows = [(name, *values) for name, values in _STATS.items()]
+    return sorted(rows, key=lambda row: -row[2])
+
+
+def collapsed():
+    """
+    The stacks seen, in the collapsed format of flame graph tools, with
+    self times in microseconds.
+    """
+    with _LOCK:
+        stacks = sorted(_STACKS.items())
+    return ''.join(f'{path} {round(seconds * 1e6)}\n' for path, seconds in stacks)
+
+
+def dump(path=None):
+    """
+    Write the collapsed stacks to path, OUTPUT by default, and the table of
+    timings to the same path with .txt added. Returns the paths written.
+    """
+    path = path or OUTPUT
+    with open(path, 'w') as f:
+        f.write(collapsed())
+    with open(path + '.txt', 'w') as f:
+        f.write(f'{samples()} requests sampled\n')
+        f.write(f'{"function":40} {"calls":>10} {"total ms":>10} {"self ms":>10}\n')
+        for name, calls, total, own in stats():
+            f.write(f'{name:40} {calls:10} {total*1000:10.3f} {own*1000:10.3f}\n')
+    return [path, path + '.txt']
+
+
+@atexit.register
+def _dump_at_exit():
+    if samples():
+        dump()
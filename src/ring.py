@@ -0,0 +1,43 @@
+"""
+Consistent hashing of game IDs onto shards.
+
+Each shard is placed at REPLICAS points around a ring of 64-bit hashes,
+and a game belongs to the shard at the first point at or after the hash
+of its ID. With many points per shard, each shard owns close to an equal
+share of games. Adding or removing a shard changes the owner of only the
+games in the arcs it gains or loses, about 1/N of them, rather than
+nearly all of them, as hashing modulo N would. See the router module.
+"""
+import bisect
+import hashlib
+
+
+## points on the ring for each shard
+REPLICAS = 160
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class Ring():
+    """
+    A consistent hash ring of shards, named by strings such as their URLs.
+    """
+    def __init__(self, shards, replicas=REPLICAS):
+        if not shards:
+            raise ValueError('A ring needs at least one shard.')
+        self.shards = list(shards)
+        points = sorted((_hash(f'{shard}#{i}'), shard) for shard in self.shards for i in range(replicas))
+        self.points = [point for point, shard in points]
+        self.owners = [shard for point, shard in points]
+
+    def __repr__(self):
+        return f'Ring({self.shards})'
+
+    def owner(self, key):
+        """
+        The shard that owns the given key.
+        """
+        i = bisect.bisect_left(self.points, _hash(key))
+        return self.owners[i % len(self.owners)]
@@ -0,0 +1,187 @@
+"""
+Router in front of the API sharded across worker processes.
+
+Each shard is a server process running the ASGI app with its own store,
+and games belong to shards by consistent hashing of their IDs. See the
+ring module. The router, an ASGI app of its own, forwards each request
+about a game to the shard that owns it. New games are created on each
+shard in turn, and a shard gives its new games IDs that hash to itself,
+so that creation spreads evenly. Listing games asks every shard for a
+share of the page at once and merges the answers, with a cursor that
+holds each shard's place by its URL.
+
+Changing the number of shards changes the owner of only about 1/N of
+the games. Rather than moving those, start the router with the old list
+of shards as CONNECT_FOUR_PREVIOUS_SHARDS, and a request for a game its
+new owner doesn't have is passed on to its old owner, which, with a
+database or journal, still has it.
+
+The router takes the shards' URLs, comma separated, from
+CONNECT_FOUR_SHARDS. Run it and the shards with start.sh sharded.
+"""
+import asyncio
+import base64
+import itertools
+import json
+import os
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from errors import ClientError, error_fields
+from index import MAX_PAGE_SIZE, PAGE_SIZE
+from ring import Ring
+
+
+## request and response headers passed through
+REQUEST_HEADERS = ('content-type', 'if-none-match')
+RESPONSE_HEADERS = ('content-type', 'etag')
+
+
+class Router():
+    """
+    Forwards requests to the shards with the given URLs. If previous is a
+    list of the URLs of the shards before they were changed, requests for
+    games their new owners don't have go to their old owners.
+    """
+    def __init__(self, shards, previous=None, transport=None):
+        self.shards = list(shards)
+        self.ring = Ring(self.shards)
+        self.previous = Ring(previous) if previous else None
+        self._next_shard = itertools.cycle(self.shards)
+        self._transport = transport
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(transport=self._transport, timeout=120)
+        return self._client
+
+    async def _send(self, shard, request, path=None, body=None):
+        headers = {name: request.headers[name] for name in REQUEST_HEADERS if name in request.headers}
+        return await self.client.request(
+            request.method, shard + (path or request.url.path),
+            params=request.query_params if path is None else None,
+            content=body if body is not None else await request.body(),
+            headers=headers)
+
+    def _response(self, res):
+        headers = {name: res.headers[name] for name in RESPONSE_HEADERS if name in res.headers}
+        return Response(res.content, status_code=res.status_code, headers=headers)
+
+
+    async def game_request(self, request):
+        """
+        Forward a request about a game to the shard that owns it.
+        """
+        game_id = request.path_params['game_id']
+        body = await request.body()
+        owner = self.ring.owner(game_id)
+        res = await self._send(owner, request, body=body)
+        if res.status_code == 404 and self.previous is not None:
+            old_owner = self.previous.owner(game_id)
+            if old_owner != owner:
+                res = await self._send(old_owner, request, body=body)
+        return self._response(res)
+
+
+    async def any_shard(self, request):
+        """
+        Forward a request to the next shard in turn, as for a new game.
+        """
+        return self._response(await self._send(next(self._next_shard), request))
+
+
+    async def list_games(self, request):
+        """
+        Ask every shard that has games left for its share of a page, and
+        merge them. The cursor maps each shard's URL to its cursor, or None
+        if it has no games left. Shards not in the cursor, added since it
+        was given out, start at the beginning, and shards no longer in use
+        are left out.
+        """
+        try:
+            limit = int(request.query_params.get('limit', PAGE_SIZE))
+        except ValueError:
+            limit = 0
+        if limit < 1 or limit > MAX_PAGE_SIZE:
+            return _error(f'Limit must be between 1 and {MAX_PAGE_SIZE}, not {request.query_params["limit"]}.')
+
+        cursor = request.query_params.get('cursor')
+        try:
+            given = _decode_cursor(cursor) if cursor else {}
+        except ValueError:
+            return _error(f'Invalid cursor "{cursor}".')
+        cursors = [given.get(shard, '') for shard in self.shards]
+
+        ## a page smaller than the number of shards asks only some of them
+        active = [i for i, c in enumerate(cursors) if c is not None][:limit]
+        share = limit // len(active) if active else 0
+        state = request.query_params.get('state', 'IN_PROGRESS')
+
+        async def page(i):
+            params = {'state': state, 'limit': share}
+            if cursors[i]:
+                params['cursor'] = cursors[i]
+            return await self.client.get(self.shards[i] + '/drop_token', params=params)
+
+        responses = await asyncio.gather(*(page(i) for i in active))
+
+        games = []
+        for i, res in zip(active, responses):
+            if res.status_code != 200:
+                return self._response(res)
+            data = res.json()
+            games.extend(data['games'])
+            cursors[i] = data.get('next')
+
+        output = {'games': games}
+        if any(c is not None for c in cursors):
+            output['next'] = _encode_cursor(dict(zip(self.shards, cursors)))
+        return JSONResponse(output)
+
+
+def _encode_cursor(cursors):
+    return base64.urlsafe_b64encode(json.dumps(cursors).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        cursors = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError(cursor)
+    if not isinstance(cursors, dict) or not all(c is None or isinstance(c, str) for c in cursors.values()):
+        raise ValueError(cursor)
+    return cursors
+
+
+def _error(message):
+    fields, status_code = error_fields(ClientError(message, status_code=400))
+    return JSONResponse(fields, status_code=status_code)
+
+
+def make_app(shards, previous=None, transport=None):
+    """
+    An ASGI app routing requests across the shards with the given URLs.
+    """
+    router = Router(shards, previous, transport)
+    app = Starlette(routes=[
+        Route('/', router.any_shard),
+        Route('/drop_token', router.list_games),
+        Route('/drop_token', router.any_shard, methods=['POST']),
+        Route('/drop_token/{game_id}', router.game_request),
+        Route('/drop_token/{game_id}/{rest:path}', router.game_request, methods=['GET', 'POST', 'DELETE']),
+    ])
+    app.state.router = router
+    return app
+
+
+def _shards(name):
+    urls = os.environ.get(name)
+    return urls.split(',') if urls else None
+
+
+app = make_app(_shards('CONNECT_FOUR_SHARDS') or ['http://127.0.0.1:8001'], _shards('CONNECT_FOUR_PREVIOUS_SHARDS'))
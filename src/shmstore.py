@@ -0,0 +1,343 @@
+"""
+Storage of games in shared memory, so that every worker process of a
+prefork server like gunicorn can serve every game, without a database.
+
+The table is a multiprocessing.shared_memory block of fixed-size slots,
+one per game and one per player, sized when it's created. A game's slot
+holds its ID, shape, players and history, two bytes per move: the seat
+of the player who moved, and the column played plus one, or 0 for a
+quit. Boards, turns and winners follow from the history, so they aren't
+kept twice. Each process keeps its own Game objects, just as it would
+without the table, and replays onto them only the moves other processes
+have made since it last looked. See the store module.
+
+Moves in a game are made under a lock on its slot, held by one thread
+of one process at a time: a striped thread lock within the process and,
+across processes, an fcntl lock on the slot's byte of a lock file kept
+alongside. Adding a game or player locks the whole table. Reads take no
+locks. A write fills in a slot before publishing it, by bumping the
+count of moves or setting an entry of the hash index, so readers never
+see half a move or half a game.
+
+Games and players are found by open addressing in hash indexes with
+twice as many entries as slots. Slots are never freed, so a table holds
+as many games and players as it was made for, and no more. It outlives
+the processes using it, until it's unlinked or the machine restarts.
+"""
+import contextlib
+import fcntl
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from multiprocessing import resource_tracker, shared_memory
+
+
+## slots for games and players in a new table, and most moves in a game
+GAMES = int(os.environ.get('CONNECT_FOUR_SHM_GAMES', 100000))
+PLAYERS = int(os.environ.get('CONNECT_FOUR_SHM_PLAYERS', 100000))
+MOVES = int(os.environ.get('CONNECT_FOUR_SHM_MOVES', 128))
+
+## most players in a game, as the API allows, and longest player ID in bytes
+MAX_PLAYERS = 26
+MAX_PLAYER_ID = 64
+
+## number of striped thread locks over the slots of games
+STRIPES = 64
+
+_MAGIC = b'c4table1'
+
+## magic, game slots, player slots, moves per game, games added, players added
+_HEADER = struct.Struct('<8s5I')
+_GAMES_ADDED = 20
+_PLAYERS_ADDED = 24
+
+## game ID, rows, columns, k, number of players, number of moves, and the
+## slot of each player, followed by the history
+_GAME = struct.Struct(f'<36s4BH{MAX_PLAYERS}I')
+_MOVE_COUNT = 40
+
+## length of the player ID, the ID and the token
+_PLAYER = struct.Struct(f'<B{MAX_PLAYER_ID}s4s')
+
+_UINT = struct.Struct('<I')
+_USHORT = struct.Struct('<H')
+
+_STATUSES = {'IN_PROGRESS': 1, 'DONE': 2}
+
+
+class TableFull(Exception):
+    pass
+
+
+class SharedTable():
+    """
+    A table of players, games and moves in the shared memory block with
+    the given name, created with room for the given numbers of games,
+    players and moves per game if it doesn't exist yet. It has the same
+    methods as the sqlstore Database, plus lock, count and moves, for
+    keeping each process's copy of a game in step with the table.
+    """
+    def __init__(self, name, games=GAMES, players=PLAYERS, moves=MOVES):
+        self.name = name
+        self.migrated = False
+        self._shm = None
+        self._lock_path = os.path.join(tempfile.gettempdir(), f'{name}.lock')
+        self._lock_file = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._table_lock = threading.Lock()
+        self._slot_locks = [threading.Lock() for _ in range(STRIPES)]
+
+        ## slots and player IDs of games, cached as they're looked up, as
+        ## they never change
+        self._slots = {}
+        self._player_ids = {}
+
+        with self._locked(0, self._table_lock):
+            try:
+                self._shm = shared_memory.SharedMemory(name, create=True, size=_size(games, players, moves))
+                _HEADER.pack_into(self._shm.buf, 0, _MAGIC, games, players, moves, 0, 0)
+            except FileExistsError:
+                self._shm = shared_memory.SharedMemory(name)
+        ## the block belongs to no one process, so it stays when this one exits
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+
+        self._buf = self._shm.buf
+        magic, self.game_slots, self.player_slots, self.max_moves, _, _ = _HEADER.unpack_from(self._buf, 0)
+        if magic != _MAGIC:
+            self.close()
+            raise ValueError(f'Shared memory "{name}" doesn\'t hold a table of games.')
+        self._statuses_at = _HEADER.size
+        self._game_index_at = self._statuses_at + self.game_slots
+        self._player_index_at = self._game_index_at + 2 * self.game_slots * _UINT.size
+        self._games_at = self._player_index_at + 2 * self.player_slots * _UINT.size
+        self._game_size = _GAME.size + 2 * self.max_moves
+        self._players_at = self._games_at + self.game_slots * self._game_size
+
+    def __repr__(self):
+        return f'SharedTable({self.name!r})'
+
+    def close(self):
+        if self._shm is not None:
+            self._buf = None
+            self._shm.close()
+            self._shm = None
+            os.close(self._lock_file)
+
+    def unlink(self):
+        """
+        Close the table and remove it, losing every game in it.
+        """
+        self.close()
+        shared_memory.SharedMemory(self.name).unlink()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._lock_path)
+
+
+    @contextlib.contextmanager
+    def _locked(self, byte, thread_lock):
+        with thread_lock:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_EX, 1, byte)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._lock_file, fcntl.LOCK_UN, 1, byte)
+
+    def lock(self, game_id):
+        """
+        A context in which no other thread or process can move in the game.
+        """
+        slot = self._slot(game_id)
+        return self._locked(1 + slot, self._slot_locks[slot % STRIPES])
+
+
+    def _find(self, index_at, entries, matches, key):
+        """
+        Look up a key in a hash index. Returns the slot it names, or None,
+        and the index entry where it is or would go.
+        """
+        i = zlib.crc32(key) % entries
+        while True:
+            entry, = _UINT.unpack_from(self._buf, index_at + i * _UINT.size)
+            if entry == 0:
+                return None, i
+            if matches(entry - 1, key):
+                return entry - 1, i
+            i = (i + 1) % entries
+
+    def _game_at(self, slot):
+        return self._games_at + slot * self._game_size
+
+    def _player_at(self, slot):
+        return self._players_at + slot * _PLAYER.size
+
+    def _is_game(self, slot, key):
+        at = self._game_at(slot)
+        return self._buf[at:at + len(key)] == key
+
+    def _is_player(self, slot, key):
+        at = self._player_at(slot)
+        return self._buf[at] == len(key) and self._buf[at + 1:at + 1 + len(key)] == key
+
+    def _find_game(self, game_id):
+        key = game_id.encode()
+        if len(key) != 36:
+            return None, None
+        return self._find(self._game_index_at, 2 * self.game_slots, self._is_game, key)
+
+    def _find_player(self, player_id):
+        key = player_id.encode()
+        if len(key) > MAX_PLAYER_ID:
+            return None, None
+        return self._find(self._player_index_at, 2 * self.player_slots, self._is_player, key)
+
+    def _slot(self, game_id):
+        slot = self._slots.get(game_id)
+        if slot is None:
+            slot, _ = self._find_game(game_id)
+            if slot is None:
+                raise KeyError(f'Game {game_id} does not exist.')
+            self._slots[game_id] = slot
+        return slot
+
+    def _players(self, slot):
+        player_ids = self._player_ids.get(slot)
+        if player_ids is None:
+            fields = _GAME.unpack_from(self._buf, self._game_at(slot))
+            player_ids = []
+            for player_slot in fields[6:6 + fields[4]]:
+                length, player_id, token = _PLAYER.unpack_from(self._buf, self._player_at(player_slot))
+                player_ids.append(player_id[:length].decode())
+            self._player_ids[slot] = player_ids
+        return player_ids
+
+    def _read_moves(self, slot, start):
+        at = self._game_at(slot)
+        count, = _USHORT.unpack_from(self._buf, at + _MOVE_COUNT)
+        player_ids = self._players(slot)
+        history = self._buf[at + _GAME.size + 2 * start:at + _GAME.size + 2 * count].tobytes()
+        return [(player_ids[history[i]], history[i + 1] - 1) for i in range(0, len(history), 2)]
+
+
+    def get_player(self, player_id):
+        """
+        Returns the token of the given player, or None if there's no such
+        player.
+        """
+        slot, _ = self._find_player(player_id)
+        if slot is None:
+            return None
+        length, key, token = _PLAYER.unpack_from(self._buf, self._player_at(slot))
+        return token.rstrip(b'\0').decode()
+
+    def add_player(self, player_id, token):
+        key = player_id.encode()
+        if len(key) > MAX_PLAYER_ID:
+            raise ValueError(f'Player IDs in shared memory can be at most {MAX_PLAYER_ID} bytes long.')
+        with self._locked(0, self._table_lock):
+            slot, i = self._find_player(player_id)
+            if slot is not None:
+                return
+            slot, = _UINT.unpack_from(self._buf, _PLAYERS_ADDED)
+            if slot >= self.player_slots:
+                raise TableFull(f'No room for more than {self.player_slots} players in shared memory.')
+            _PLAYER.pack_into(self._buf, self._player_at(slot), len(key), key, token.encode())
+            _UINT.pack_into(self._buf, _PLAYERS_ADDED, slot + 1)
+            _UINT.pack_into(self._buf, self._player_index_at + i * _UINT.size, slot + 1)
+
+    def list_games(self, state=None, after=0, limit=-1):
+        """
+        Returns up to limit (key, game ID) tuples for games in the given
+        state, or in any state if state is None, added after the one with
+        the given key. A game's key is its slot plus one.
+        """
+        added, = _UINT.unpack_from(self._buf, _GAMES_ADDED)
+        after = min(max(after, 0), added)
+        if limit < 0:
+            limit = added
+        if state is None:
+            slots = range(after, min(added, after + limit))
+        else:
+            statuses = self._buf[self._statuses_at + after:self._statuses_at + added].tobytes()
+            status = bytes([_STATUSES[state]])
+            slots = []
+            i = statuses.find(status)
+            while i >= 0 and len(slots) < limit:
+                slots.append(after + i)
+                i = statuses.find(status, i + 1)
+        return [(slot + 1, self._buf[self._game_at(slot):self._game_at(slot) + 36].tobytes().decode())
+                for slot in slots]
+
+    def get_game(self, game_id):
+        """
+        Returns a game's rows, columns, k, list of player IDs in order of
+        play and the log of its moves as (player ID, column) tuples, or None
+        if there's no such game.
+        """
+        try:
+            slot = self._slot(game_id)
+        except KeyError:
+            return None
+        game_id, rows, columns, k, *_ = _GAME.unpack_from(self._buf, self._game_at(slot))
+        return rows, columns, k, list(self._players(slot)), self._read_moves(slot, 0)
+
+    def add_game(self, game_id, rows, columns, k, player_ids):
+        if rows > 255 or columns > 254 or k > 255:
+            raise ValueError('Games in shared memory can have at most 255 rows and 254 columns, and k at most 255.')
+        if len(player_ids) > MAX_PLAYERS:
+            raise ValueError(f'Games in shared memory can have at most {MAX_PLAYERS} players.')
+        if rows * columns + len(player_ids) > self.max_moves:
+            raise ValueError(f'Games in shared memory can have at most {self.max_moves} moves, '
+                             f'so {rows} rows, {columns} columns and {len(player_ids)} players is too many.')
+        player_slots = [self._find_player(player_id)[0] for player_id in player_ids]
+        if None in player_slots:
+            raise KeyError(f'Players of game {game_id} must be added first.')
+        key = game_id.encode()
+
+        with self._locked(0, self._table_lock):
+            _, i = self._find_game(game_id)
+            slot, = _UINT.unpack_from(self._buf, _GAMES_ADDED)
+            if slot >= self.game_slots:
+                raise TableFull(f'No room for more than {self.game_slots} games in shared memory.')
+            _GAME.pack_into(self._buf, self._game_at(slot), key, rows, columns, k, len(player_ids), 0,
+                            *player_slots, *[0] * (MAX_PLAYERS - len(player_ids)))
+            self._buf[self._statuses_at + slot] = _STATUSES['IN_PROGRESS']
+            _UINT.pack_into(self._buf, _GAMES_ADDED, slot + 1)
+            _UINT.pack_into(self._buf, self._game_index_at + i * _UINT.size, slot + 1)
+        self._slots[game_id] = slot
+
+    def count(self, game_id):
+        """
+        The number of moves made in a game.
+        """
+        count, = _USHORT.unpack_from(self._buf, self._game_at(self._slot(game_id)) + _MOVE_COUNT)
+        return count
+
+    def moves(self, game_id, start=0):
+        """
+        The moves of a game from move number start on, as (player ID,
+        column) tuples.
+        """
+        return self._read_moves(self._slot(game_id), start)
+
+    def append_move(self, game_id, move_number, player_id, column):
+        """
+        Log a move, which must be the next one in the game. Call with the
+        game locked.
+        """
+        slot = self._slot(game_id)
+        at = self._game_at(slot)
+        count, = _USHORT.unpack_from(self._buf, at + _MOVE_COUNT)
+        if move_number != count:
+            raise RuntimeError(f'Move {move_number} of game {game_id} isn\'t the next, {count}.')
+        seat = self._players(slot).index(player_id)
+        self._buf[at + _GAME.size + 2 * count:at + _GAME.size + 2 * count + 2] = bytes((seat, column + 1))
+        _USHORT.pack_into(self._buf, at + _MOVE_COUNT, count + 1)
+
+    def set_status(self, game_id, status):
+        self._buf[self._statuses_at + self._slot(game_id)] = _STATUSES[status]
+
+
+def _size(games, players, moves):
+    return (_HEADER.size + games + 2 * (games + players) * _UINT.size
+            + games * (_GAME.size + 2 * moves) + players * _PLAYER.size)
@@ -0,0 +1,237 @@
+"""
+Solver for connect-four positions.
+
+Searches the game tree by negamax with alpha-beta pruning, trying
+central columns first, and deepens iteratively until it either solves
+the position or runs out of time. The search works directly on the
+bitboards of a game.Board (see Board for the layout), representing a
+position by two masks: the tokens of the player to move and all tokens
+on the board.
+
+Positions are cached in a transposition table keyed by their Zobrist
+hash, shared by every search in the process, so analysis of one game
+speeds up analysis of any other that reaches the same positions.
+
+Scores follow the usual convention. A positive score means the player
+to move can force a win, and the sooner the win the higher the score.
+Negative scores are forced losses and 0 is a draw or a position the
+search didn't see far enough into to decide.
+"""
+import time
+
+import book
+from game import GameOver
+from transposition import EXACT, LOWER, UPPER, shared_table, side_key, zobrist_key
+
+
+## default time budget for a move suggestion, in seconds
+HINT_BUDGET = 0.2
+
+
+class Timeout(Exception):
+    pass
+
+
+class Search():
+    """
+    Negamax search over positions on an n by m board with k in a row to
+    win. A search with a deadline raises Timeout when the deadline passes.
+
+    Along with the masks, the search tracks the Zobrist hash of each
+    position and the color of the player to move, which it uses to look
+    up positions in the transposition table, if given one.
+    """
+    def __init__(self, n, m, k, deadline=None, table=None):
+        self.n = n
+        self.m = m
+        self.k = k
+        self.h = n + 1
+        self.size = n * m
+        self.directions = (1, self.h, self.h+1, self.h-1)
+        self.bottom = [1 << (j*self.h) for j in range(m)]
+        self.top = [1 << (j*self.h + n - 1) for j in range(m)]
+        self.columns = [((1 << n) - 1) << (j*self.h) for j in range(m)]
+        self.order = sorted(range(m), key=lambda j: abs(2*j - (m-1)))
+        self.deadline = deadline
+        self.table = table
+        self.nodes = 0
+
+    def wins(self, x):
+        """
+        Does the mask x contain k tokens in a row in any direction?
+        """
+        for s in self.directions:
+            y = x
+            covered = 1
+            while covered < self.k and y:
+                step = min(covered, self.k - covered)
+                y &= y >> (step*s)
+                covered += step
+            if y:
+                return True
+        return False
+
+    def moves(self, mask, first=-1):
+        """
+        Generate (column, move) pairs for each column that isn't full, in
+        search order, where move is the bit of the cell a token would land in.
+        The column first, if given, is tried before the others.
+        """
+        if first >= 0 and not mask & self.top[first]:
+            yield first, (mask + self.bottom[first]) & self.columns[first]
+        for j in self.order:
+            if j != first and not mask & self.top[j]:
+                yield j, (mask + self.bottom[j]) & self.columns[j]
+
+    def negamax(self, position, mask, moves, depth, alpha, beta, key=0, color=0):
+        """
+        Score a position, looking ahead depth moves, within the window
+        alpha, beta. The result is exact if it falls inside the window,
+        otherwise it's a bound on the true score.
+        """
+        self.nodes += 1
+        if self.deadline and time.monotonic() > self.deadline:
+            raise Timeout()
+
+        if moves >= self.size:
+            return 0
+
+        for j, move in self.moves(mask):
+            if self.wins(position | move):
+                return (self.size + 1 - moves) // 2
+
+        if depth <= 0:
+            return 0
+
+        first = -1
+        if self.table is not None:
+            entry = self.table.get(key ^ side_key(color))
+            if entry is not None:
+                score, flag, searched, first = entry
+                if searched >= depth and (flag == EXACT
+                                          or flag == LOWER and score >= beta
+                                          or flag == UPPER and score <= alpha):
+                    return score
+
+        ## we can't win on this move, so we can't do better than this
+        best_possible = (self.size - 1 - moves) // 2
+        if beta > best_possible:
+            beta = best_possible
+            if alpha >= beta:
+                return beta
+
+        alpha_in, best = alpha, -1
+        for j, move in self.moves(mask, first):
+            score = -self.negamax(position ^ mask, mask | move, moves + 1, depth - 1, -beta, -alpha,
+                                  key ^ zobrist_key(move.bit_length() - 1, color), color ^ 1)
+            if score >= beta:
+                self._store(key, color, score, LOWER, depth, j)
+                return score
+            if score > alpha:
+                alpha, best = score, j
+
+        self._store(key, color, alpha, EXACT if alpha > alpha_in else UPPER, depth, best)
+        return alpha
+
+    def _store(self, key, color, score, flag, depth, move):
+        if self.table is not None:
+            self.table.put(key ^ side_key(color), score, flag, depth, move)
+
+    def root(self, position, mask, moves, depth, key=0, color=0, first=-1):
+        """
+        Search to the given depth from the root, returning the best column
+        and its score.
+        """
+        best, alpha, beta = None, -self.size, self.size
+        for j, move in self.moves(mask, first):
+            if self.wins(position | move):
+                return j, (self.size + 1 - moves) // 2
+            score = -self.negamax(position ^ mask, mask | move, moves + 1, depth - 1, -beta, -alpha,
+                                  key ^ zobrist_key(move.bit_length() - 1, color), color ^ 1)
+            if best is None or score > alpha:
+                best, alpha = j, score
+        return best, alpha
+
+
+def best_move(board, token, budget=HINT_BUDGET, table=None):
+    """
+    Find the best column for the player with the given token to play on
+    the board, searching for at most budget seconds. Tokens other than
+    the given one all count as the opponent's. Positions are cached in
+    the given transposition table, or the one shared by the process.
+    Returns a tuple of column and score.
+    """
+    if not hasattr(board, 'masks'):
+        raise ValueError(f'Can\'t search a board of dimensions ({board.n},{board.m}).')
+
+    if table is None:
+        table = shared_table()
+    table.new_search()
+    search = Search(board.n, board.m, board.k, deadline=time.monotonic() + budget, table=table)
+    color = board.colors.get(token, len(board.colors))
+    position = board.masks.get(token, 0)
+    mask = 0
+    for x in board.masks.values():
+        mask |= x
+
+    legal = [j for j, move in search.moves(mask)]
+    if not legal:
+        raise ValueError('Board is full.')
+    best = legal[0], 0
+
+    ## a search deeper than the number of empty cells would add nothing
+    for depth in range(1, search.size - board.moves + 1):
+        try:
+            best = search.root(position, mask, board.moves, depth, board.hash, color, first=best[0])
+        except Timeout:
+            break
+        ## wins and losses found at this depth are exact
+        if best[1] != 0:
+            break
+
+    return best
+
+
+def player_to_move(game):
+    """
+    The player whose turn it is, as long as the game is between two
+    players and no tokens but theirs are on the board.
+    """
+    if game.status == 'DONE':
+        raise GameOver('Game Over')
+
+    player = game.players[game.turn]
+    opponents = [p for p in game.players if p != player and game.player_active[p]]
+    tokens = {game.tokens[seat] for seat, active in enumerate(game.active) if active}
+    if len(opponents) != 1 or any(token not in tokens for i, j, token in game.board.occupied()):
+        raise ValueError('Move suggestions are only available for two-player games.')
+    return player
+
+
+def suggest_move(game, budget=HINT_BUDGET, workers=1):
+    """
+    Suggest a move for the player whose turn it is in a two-player game.
+    Positions in the opening book, if there is one, are looked up rather
+    than searched. With more than one worker, the search is split across
+    a pool of processes. Sparse boards are too big to search exactly, so
+    for them we fall back on Monte Carlo tree search, which doesn't
+    score its moves.
+    """
+    player_to_move(game)
+    token = game.tokens[game.turn]
+
+    if not hasattr(game.board, 'masks'):
+        import mcts
+        column, stats = mcts.choose_move(game, budget * 1000)
+        return column, 0
+
+    opening = book.get_book()
+    if opening is not None:
+        entry = opening.lookup(game.board, token)
+        if entry is not None:
+            return entry
+
+    if workers > 1:
+        import parallel
+        return parallel.best_move(game.board, token, budget, workers)
+    return best_move(game.board, token, budget)
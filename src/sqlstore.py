@@ -0,0 +1,237 @@
+"""
+Persistent storage of games in a SQLite database.
+
+Games aren't stored as boards. Each game is a row recording its shape
+and players, plus an append-only log of moves, with quits logged as
+column -1 just as in Game.history. A game is rebuilt by replaying its
+log the first time it's asked for. See the store module.
+
+The database runs in WAL mode, and all writes go through a single
+writer thread. Callers queue their writes and wait for them to be
+committed. While one commit is waiting on its fsync, the writes that
+pile up behind it are committed together in the next transaction, so
+under load many moves share one fsync.
+"""
+import concurrent.futures
+import queue
+import sqlite3
+import threading
+
+
+## seconds to wait for another process to release a lock on the database
+BUSY_TIMEOUT = 10
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    id TEXT PRIMARY KEY,
+    token TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS games (
+    id TEXT PRIMARY KEY,
+    rows INTEGER NOT NULL,
+    columns INTEGER NOT NULL,
+    k INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'IN_PROGRESS'
+);
+CREATE INDEX IF NOT EXISTS games_by_status ON games (status);
+CREATE TABLE IF NOT EXISTS game_players (
+    game_id TEXT NOT NULL REFERENCES games(id),
+    seat INTEGER NOT NULL,
+    player_id TEXT NOT NULL REFERENCES players(id),
+    PRIMARY KEY (game_id, seat)
+);
+CREATE TABLE IF NOT EXISTS moves (
+    game_id TEXT NOT NULL REFERENCES games(id),
+    move_number INTEGER NOT NULL,
+    player_id TEXT NOT NULL,
+    column INTEGER NOT NULL,
+    PRIMARY KEY (game_id, move_number)
+) WITHOUT ROWID;
+"""
+
+
+class Database():
+    """
+    A SQLite database of players, games and moves. Reads happen on a
+    connection per thread. Writes are queued for the writer thread and
+    block until they're committed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.commits = 0
+        self.writes = 0
+        self.committing = 0
+        self.migrated = False
+        self._local = threading.local()
+        self._queue = queue.Queue()
+
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(games)')]
+        if columns and 'status' not in columns:
+            ## games that finished before the status column existed are
+            ## marked DONE by replaying them. See store.open_database.
+            conn.execute("ALTER TABLE games ADD COLUMN status TEXT NOT NULL DEFAULT 'IN_PROGRESS'")
+            self.migrated = True
+        conn.executescript(SCHEMA)
+        conn.close()
+
+        self._writer = threading.Thread(target=self._write_loop, name='sqlstore-writer', daemon=True)
+        self._writer.start()
+
+    def __repr__(self):
+        return f"Database('{self.path}')"
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA synchronous=FULL')
+        return conn
+
+    @property
+    def _reader(self):
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = self._connect()
+        return self._local.conn
+
+    def close(self):
+        """
+        Commit any queued writes and stop the writer thread.
+        """
+        self._queue.put(None)
+        self._writer.join()
+
+
+    def _write(self, *statements):
+        """
+        Queue a list of (sql, params) statements to be run together and wait
+        until they've been committed.
+        """
+        future = concurrent.futures.Future()
+        self._queue.put((statements, future))
+        return future.result()
+
+    def _write_loop(self):
+        conn = self._connect()
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            writes = [write for write in batch if write is not None]
+            if writes:
+                self.committing = len(writes)
+                self._commit(conn, writes)
+                self.committing = 0
+        conn.close()
+
+    def _commit(self, conn, writes):
+        """
+        Run a batch of writes in one transaction. Each write gets its own
+        savepoint, so one that fails doesn't take the others down with it.
+        Any error, not only SQLite's, such as a number too big for SQLite,
+        goes to the writes it fails, so the writer thread never dies.
+        """
+        failed = {}
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for statements, future in writes:
+                conn.execute('SAVEPOINT write')
+                try:
+                    for sql, params in statements:
+                        conn.execute(sql, params)
+                except Exception as error:
+                    conn.execute('ROLLBACK TO write')
+                    failed[future] = error
+                conn.execute('RELEASE write')
+            conn.execute('COMMIT')
+        except Exception as error:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            for statements, future in writes:
+                future.set_exception(error)
+            return
+
+        self.commits += 1
+        self.writes += len(writes)
+        for statements, future in writes:
+            if future in failed:
+                future.set_exception(failed[future])
+            else:
+                future.set_result(None)
+
+
+    def get_player(self, player_id):
+        """
+        Returns the token of the given player, or None if there's no such
+        player.
+        """
+        row = self._reader.execute('SELECT token FROM players WHERE id = ?', (player_id,)).fetchone()
+        return row[0] if row else None
+
+    def add_player(self, player_id, token):
+        self._write(('INSERT INTO players (id, token) VALUES (?, ?)', (player_id, token)))
+
+    def list_games(self, state=None, after=0, limit=-1):
+        """
+        Returns up to limit (rowid, game ID) tuples for games created after
+        the one with the given rowid, in the given state or in any state if
+        state is None. The index on status lets SQLite skip games in other
+        states and start at the rowid, so the cost is that of the page.
+        """
+        if state is None:
+            return self._reader.execute(
+                'SELECT rowid, id FROM games WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                (after, limit)).fetchall()
+        return self._reader.execute(
+            'SELECT rowid, id FROM games WHERE status = ? AND rowid > ? ORDER BY rowid LIMIT ?',
+            (state, after, limit)).fetchall()
+
+    def get_game(self, game_id):
+        """
+        Returns a game's rows, columns, k, list of player IDs in order of
+        play and the log of its moves as (player ID, column) tuples, or None
+        if there's no such game.
+        """
+        conn = self._reader
+        row = conn.execute('SELECT rows, columns, k FROM games WHERE id = ?', (game_id,)).fetchone()
+        if row is None:
+            return None
+        player_ids = [player_id for player_id, in conn.execute(
+            'SELECT player_id FROM game_players WHERE game_id = ? ORDER BY seat', (game_id,))]
+        moves = conn.execute(
+            'SELECT player_id, column FROM moves WHERE game_id = ? ORDER BY move_number', (game_id,)).fetchall()
+        return (*row, player_ids, moves)
+
+    def add_game(self, game_id, rows, columns, k, player_ids):
+        self._write(
+            ('INSERT INTO games (id, rows, columns, k) VALUES (?, ?, ?, ?)', (game_id, rows, columns, k)),
+            *(('INSERT INTO game_players (game_id, seat, player_id) VALUES (?, ?, ?)', (game_id, seat, player_id))
+              for seat, player_id in enumerate(player_ids)))
+
+    def append_move(self, game_id, move_number, player_id, column):
+        self._write((
+            'INSERT INTO moves (game_id, move_number, player_id, column) VALUES (?, ?, ?, ?)',
+            (game_id, move_number, player_id, column)))
+
+    def set_status(self, game_id, status):
+        self._write(('UPDATE games SET status = ? WHERE id = ?', (status, game_id)))
+
+    def archive_game(self, game_id, rows, columns, k, player_ids, moves, status):
+        """
+        Save a whole game, with its log of moves as (player ID, column)
+        tuples, in one write. Saving a game that's already there does
+        nothing.
+        """
+        self._write(
+            ('INSERT OR IGNORE INTO games (id, rows, columns, k, status) VALUES (?, ?, ?, ?, ?)',
+             (game_id, rows, columns, k, status)),
+            *(('INSERT OR IGNORE INTO game_players (game_id, seat, player_id) VALUES (?, ?, ?)', (game_id, seat, player_id))
+              for seat, player_id in enumerate(player_ids)),
+            *(('INSERT OR IGNORE INTO moves (game_id, move_number, player_id, column) VALUES (?, ?, ?, ?)',
+               (game_id, move_number, player_id, column))
+              for move_number, (player_id, column) in enumerate(moves)))
@@ -1,66 +1,506 @@
 """
 This module is a stub implementation of an abstraction layer between the
-game and some form of storage. This is a demo, so we store everything in
-local memory.
+game and some form of storage. This is a demo, so by default we store
+everything in local memory.
+
+If the CONNECT_FOUR_DB environment variable names a SQLite database, games
+and their moves are also saved there, and the in-memory dicts act as a
+cache which is filled lazily from the database. See the sqlstore module.
+If instead CONNECT_FOUR_JOURNAL names a directory, games are kept in an
+event journal there, which works the same way but appends to a local
+file rather than committing to a database. See the journal module.
+Or if CONNECT_FOUR_SHM names a block of shared memory, games are kept
+in a table there, which every process on the machine that opens it
+shares, so that all the workers of a prefork server like gunicorn can
+serve all the games. See the shmstore module.
+
+In each case, "the database" below means whichever one is in use. Moves
+must then go through play and quit here rather than through the Game,
+so they're appended to the log.
+
+With a shared table, other processes move in the games this one holds,
+so a game is caught up with the moves in the table whenever it's asked
+for, and moves are made with its slot in the table locked.
+
+The number of games held in memory can be capped by setting the
+CONNECT_FOUR_MAX_GAMES environment variable. Past the cap, the least
+recently used games are evicted to cold storage and reloaded when they're
+next asked for. Cold storage is the database, if there is one, or else a
+SQLite archive named by CONNECT_FOUR_ARCHIVE. Finished games can always
+be evicted. Games in progress are evicted only once they've been idle for
+IDLE_SECONDS, and only to a database, which already holds every move;
+an archive holds a copy of a game taken when it was evicted, so it only
+takes games that can't change.
+
+When the server runs as shards, each process holding some of the games,
+CONNECT_FOUR_SHARD and CONNECT_FOUR_SHARDS name this shard and all of
+them, and new games get IDs that hash to this shard. See the router
+module.
+
+Game IDs are kept in indexes by status, which are updated as moves end
+games, so that listing one page of games in progress costs the size of
+the page, not the number of games ever played.
+
+The store is safe to use from many threads. Looking up a game or player
+that's already in memory takes no locks. Creating or loading one takes
+one of a set of striped locks, chosen by hashing its ID, so that
+requests for different players rarely wait on each other.
 
 Alternate implementations might include:
  - REDIS if your goal is distributed shared memory
  - PostgreSQL if your goal is to be transactional and persistent
  - Dynamo / Casandra if your goal is to be distributed and persistent
 """
+import contextlib
+import itertools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
 from game import Game, Player
+from index import Index
+from journal import Journal
+from ring import Ring
+from shmstore import SharedTable
+from sqlstore import Database
 
 GAMES = {}
 PLAYERS = {}
-ASSIGNED_TOKENS = set()
-POSSIBLE_TOKENS = 'abcdefghijklmnopqrstuvwxyz!@#$%^&*-+='
+DB = None
+ARCHIVE = None
+
+## whether the database is a table in shared memory
+SHARED = False
+
+## seconds between looks at a shared table for moves by other processes
+## while waiting for moves
+POLL_SECONDS = 0.05
+
+## most games to hold in memory, or 0 for no limit
+MAX_GAMES = int(os.environ.get('CONNECT_FOUR_MAX_GAMES', 0))
+
+## seconds without a request after which a game in progress counts as idle
+IDLE_SECONDS = float(os.environ.get('CONNECT_FOUR_IDLE_SECONDS', 600))
+
+## when this process is one shard of several, the URL it's known by and a
+## ring of all the shards' URLs, to give new games IDs this shard owns
+SHARD = os.environ.get('CONNECT_FOUR_SHARD')
+RING = Ring(os.environ['CONNECT_FOUR_SHARDS'].split(',')) if SHARD else None
+
+## number of games in memory by status, for metrics
+COUNTS = {'IN_PROGRESS': 0, 'DONE': 0}
+_COUNTS_LOCK = threading.Lock()
+
+## IDs of games in memory, least recently used first, with when they were
+## used, kept apart by status so eviction never has to step over games it
+## can't take: every finished game can go, and the games in progress that
+## can go are the idle ones at the front
+_LRU = OrderedDict()
+_DONE_LRU = OrderedDict()
+_LRU_LOCK = threading.Lock()
+
+## number of striped locks guarding creation of players and loading of games
+STRIPES = 64
+_PLAYER_LOCKS = [threading.Lock() for _ in range(STRIPES)]
+_GAME_LOCKS = [threading.Lock() for _ in range(STRIPES)]
+
+
+def _stripe(locks, key):
+    return locks[hash(key) % len(locks)]
+
+
+## game IDs by status and all together, with keys in the order they were added
+INDEXES = {'IN_PROGRESS': Index(), 'DONE': Index(), None: Index()}
+_INDEX_KEYS = itertools.count(1)
+_INDEX_LOCK = threading.Lock()
+
+
+def _count(status, n=1):
+    with _COUNTS_LOCK:
+        COUNTS[status] += n
+
+
+def _index_game(game):
+    with _INDEX_LOCK:
+        key = next(_INDEX_KEYS)
+        INDEXES[None].add(key, game.id)
+        INDEXES[game.status].add(key, game.id)
+
+
+def _update_index(game):
+    """
+    Move a game that's just finished from the index of games in progress
+    to that of finished games.
+    """
+    if game.status == 'DONE' and game.id in INDEXES['IN_PROGRESS']:
+        with _INDEX_LOCK:
+            if game.id in INDEXES['IN_PROGRESS']:
+                INDEXES['IN_PROGRESS'].discard(game.id)
+                INDEXES['DONE'].add(next(_INDEX_KEYS), game.id)
+
+
+def open_database(path):
+    """
+    Keep games in the SQLite database at the given path, or only in memory
+    if path is None. Forgets any games and players already in memory.
+    """
+    _open(Database(path) if path else None)
+
+
+def open_journal(path):
+    """
+    Keep games in an event journal in the directory at the given path, or
+    only in memory if path is None. Forgets any games and players already
+    in memory.
+    """
+    _open(Journal(path) if path else None)
+
+
+def open_shared(name):
+    """
+    Keep games in a table in the shared memory block with the given name,
+    creating it if need be, or only in memory if name is None. Forgets
+    any games and players already in memory.
+    """
+    _open(SharedTable(name) if name else None)
+
+
+def _open(db):
+    global DB, SHARED
+    if DB is not None:
+        DB.close()
+    GAMES.clear()
+    with _COUNTS_LOCK:
+        COUNTS.update(IN_PROGRESS=0, DONE=0)
+    _LRU.clear()
+    _DONE_LRU.clear()
+    PLAYERS.clear()
+    for index in INDEXES.values():
+        index.__init__()
+    DB = db
+    SHARED = isinstance(db, SharedTable)
+    if DB is not None:
+        if DB.migrated:
+            _backfill_status()
+
+
+def _backfill_status():
+    """
+    Replay every game in a database that's just gained its status column,
+    marking those that are over as DONE.
+    """
+    after = 0
+    while True:
+        page = DB.list_games('IN_PROGRESS', after, 1000)
+        for key, game_id in page:
+            if _load_game(game_id).status == 'DONE':
+                DB.set_status(game_id, 'DONE')
+        if not page:
+            break
+        after = page[-1][0]
 
 
-def _assign_unique_token(proposed_token=None):
+def open_archive(path):
     """
-    A hokey way of giving out unique tokens.
+    Evict finished games to a SQLite archive at the given path, or don't
+    if path is None.
     """
-    ## use the proposed token if not already assigned
-    if proposed_token and proposed_token not in ASSIGNED_TOKENS:
-        ASSIGNED_TOKENS.add(proposed_token)
-        return proposed_token
+    global ARCHIVE
+    if ARCHIVE is not None:
+        ARCHIVE.close()
+    ARCHIVE = Database(path) if path else None
+
+
+def _touch(game):
+    """
+    Mark a game as just used.
+    """
+    if not MAX_GAMES:
+        return
+    with _LRU_LOCK:
+        if game.status == 'DONE':
+            _LRU.pop(game.id, None)
+            lru = _DONE_LRU
+        else:
+            lru = _LRU
+        lru[game.id] = time.monotonic()
+        lru.move_to_end(game.id)
+
+
+def _evictable(game, used, now):
+    if game.status == 'DONE':
+        return DB is not None or ARCHIVE is not None
+    return DB is not None and now - used > IDLE_SECONDS
 
-    ## assign a symbol from back of list
-    for t in reversed(POSSIBLE_TOKENS):
-        if t not in ASSIGNED_TOKENS:
-            ASSIGNED_TOKENS.add(t)
-            return t
 
-    ## fresh out of tokens
-    raise RuntimeError('All tokens used.')
+def _last_used(game_id):
+    return _DONE_LRU.get(game_id, _LRU.get(game_id))
+
+
+def _evict(keep=None):
+    """
+    Evict the least recently used games that can be evicted, other than
+    the one with ID keep, until the number in memory is back under
+    MAX_GAMES. Finished games go first, then idle games in progress.
+    """
+    excess = len(GAMES) - MAX_GAMES
+    if not MAX_GAMES or excess <= 0 or (DB is None and ARCHIVE is None):
+        return
+
+    now = time.monotonic()
+    with _LRU_LOCK:
+        victims = []
+        for game_id, used in _DONE_LRU.items():
+            if len(victims) >= excess:
+                break
+            if game_id != keep:
+                victims.append((game_id, used))
+        if DB is not None:
+            for game_id, used in _LRU.items():
+                if len(victims) >= excess or now - used <= IDLE_SECONDS:
+                    break
+                if game_id != keep:
+                    victims.append((game_id, used))
+
+    for game_id, used in victims:
+        with _stripe(_GAME_LOCKS, game_id):
+            ## skip games used since they were picked
+            g = GAMES.get(game_id)
+            with _LRU_LOCK:
+                if _last_used(game_id) != used:
+                    continue
+            if g is not None and not _evictable(g, used, time.monotonic()):
+                continue
+            if g is not None and DB is None:
+                ARCHIVE.archive_game(
+                    g.id, g.board.n, g.board.m, g.board.k, [p.id for p in g.players],
+                    [(p.id, column) for p, column in g.history], g.status)
+            if GAMES.pop(game_id, None) is not None:
+                _count(g.status, -1)
+            with _LRU_LOCK:
+                _LRU.pop(game_id, None)
+                _DONE_LRU.pop(game_id, None)
+
+
+def _load_game(game_id):
+    """
+    Rebuild a game from cold storage by replaying its log of moves.
+    """
+    cold = DB if DB is not None else ARCHIVE
+    row = cold.get_game(game_id) if cold is not None else None
+    if row is None:
+        return None
+    rows, columns, k, player_ids, moves = row
+    g = Game(*[get_player(player_id) for player_id in player_ids], n=rows, m=columns, k=k)
+    g.id = game_id
+    _replay(g, moves)
+    return g
+
+
+def _replay(game, moves):
+    for player_id, column in moves:
+        if column < 0:
+            game.quit(get_player(player_id))
+        else:
+            game.play(get_player(player_id), column)
+
+
+def _catch_up(game):
+    """
+    Replay the moves other processes have made in a game in a shared
+    table since this process last looked.
+    """
+    if SHARED and DB.count(game.id) > len(game.history):
+        with _stripe(_GAME_LOCKS, game.id):
+            _replay_new(game)
+
+
+def _replay_new(game):
+    """
+    Call with the game's stripe lock held, so no other thread replays the
+    same moves, or makes a move that's logged but not yet in the history.
+    """
+    status = game.status
+    _replay(game, DB.moves(game.id, len(game.history)))
+    if game.status != status and game.id in GAMES:
+        _count(status, -1)
+        _count(game.status)
+    _update_index(game)
+
+
+@contextlib.contextmanager
+def _moving(game):
+    """
+    A context for making a move in a game. With a shared table, the game
+    is locked there and caught up, so the move follows every other.
+    """
+    if not SHARED:
+        yield
+        return
+    with DB.lock(game.id), _stripe(_GAME_LOCKS, game.id):
+        _replay_new(game)
+        yield
 
 
 def get_game(game_id):
-    if game_id not in GAMES:
+    g = GAMES.get(game_id)
+    loaded = False
+    if g is None and (DB is not None or ARCHIVE is not None):
+        with _stripe(_GAME_LOCKS, game_id):
+            g = GAMES.get(game_id)
+            if g is None:
+                g = _load_game(game_id)
+                if g is not None:
+                    GAMES[game_id] = g
+                    _count(g.status)
+                    loaded = True
+    if g is None:
         raise KeyError(f'Game {game_id} does not exist.')
-    return GAMES[game_id]
+    _catch_up(g)
+    _touch(g)
+    if loaded:
+        _evict(keep=game_id)
+    return g
 
 
-def list_games():
-    return list(GAMES.keys())
+def list_games(state=None, after=0, limit=None):
+    """
+    List games in the given state, IN_PROGRESS or DONE, or in any state if
+    state is None. Returns up to limit game IDs that come after the given
+    key, and the key to start the next page after, or None if there are no
+    more games.
+    """
+    fetch = limit + 1 if limit is not None else None
+    if DB is not None:
+        page = DB.list_games(state, after, fetch if fetch is not None else -1)
+    else:
+        with _INDEX_LOCK:
+            page = INDEXES[state].page(after, fetch)
 
+    if limit is not None and len(page) > limit:
+        page = page[:limit]
+        return [game_id for key, game_id in page], page[-1][0]
+    return [game_id for key, game_id in page], None
 
-def new_game(player_ids, rows, columns):
+
+def new_game(player_ids, rows, columns, k=4):
     players = [get_or_create_player(player_id) for player_id in player_ids]
-    g = Game(*players, n=rows, m=columns)
+    g = Game(*players, n=rows, m=columns, k=k)
+    while RING is not None and RING.owner(g.id) != SHARD:
+        g.id = str(uuid.uuid4())
+    if DB is not None:
+        DB.add_game(g.id, rows, columns, k, [p.id for p in players])
     GAMES[g.id] = g
+    _count('IN_PROGRESS')
+    _index_game(g)
+    _touch(g)
+    _evict(keep=g.id)
     return g
 
 
+def play(game, player, column):
+    """
+    The given player places a token in the column specified. Returns the
+    move number. With a database, the move is logged before it's made in
+    memory, so a move that can't be logged isn't made.
+    """
+    log = None
+    if DB is not None:
+        log = lambda move_number: DB.append_move(game.id, move_number, player.id, column)
+    with _moving(game):
+        move_number = game.play(player, column, log)
+        _finish(game)
+    return move_number
+
+
+def quit(game, player):
+    """
+    The given player quits the game.
+    """
+    log = None
+    if DB is not None:
+        log = lambda move_number: DB.append_move(game.id, move_number, player.id, -1)
+    with _moving(game):
+        game.quit(player, log)
+        _finish(game)
+
+
+def wait_for_moves(game, count, timeout):
+    """
+    Wait like Game.wait_for_moves. Moves by other processes in a shared
+    table don't wake the game's waiters, so then look for them every
+    POLL_SECONDS.
+    """
+    if not SHARED:
+        return game.wait_for_moves(count, timeout)
+    deadline = time.monotonic() + timeout
+    while True:
+        _catch_up(game)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return game.wait_for_moves(count, 0)
+        if game.wait_for_moves(count, min(remaining, POLL_SECONDS)):
+            return True
+
+
+def _finish(game):
+    """
+    Record that a game has ended, if it has.
+    """
+    if game.status == 'DONE':
+        ## only a game in progress can be moved in, so it's just finished
+        if game.id in GAMES:
+            _count('IN_PROGRESS', -1)
+            _count('DONE')
+        if DB is not None:
+            DB.set_status(game.id, 'DONE')
+        _touch(game)
+    _update_index(game)
+
+
+def _load_player(player_id):
+    """
+    Look up a player in memory, or failing that in the database. Call
+    with the player's stripe lock held.
+    """
+    p = PLAYERS.get(player_id)
+    if p is None and DB is not None:
+        token = DB.get_player(player_id)
+        if token is not None:
+            p = PLAYERS[player_id] = Player(player_id, token=token)
+    return p
+
+
 def get_or_create_player(player_id):
-    if player_id not in PLAYERS:
-        p = Player(player_id, token=_assign_unique_token(player_id[0] if player_id else None))
-        PLAYERS[player_id] = p
-    return PLAYERS[player_id]
+    p = PLAYERS.get(player_id)
+    if p is None:
+        with _stripe(_PLAYER_LOCKS, player_id):
+            p = _load_player(player_id)
+            if p is None:
+                p = Player(player_id)
+                if DB is not None:
+                    DB.add_player(p.id, p.token)
+                PLAYERS[player_id] = p
+    return p
 
 
 def get_player(player_id):
-    if player_id not in PLAYERS:
+    p = PLAYERS.get(player_id)
+    if p is None and DB is not None:
+        with _stripe(_PLAYER_LOCKS, player_id):
+            p = _load_player(player_id)
+    if p is None:
         raise KeyError(f'Player "{player_id}" does not exist.')
-    return PLAYERS[player_id]
+    return p
+
+
 
+if os.environ.get('CONNECT_FOUR_SHM'):
+    open_shared(os.environ['CONNECT_FOUR_SHM'])
+elif os.environ.get('CONNECT_FOUR_JOURNAL'):
+    open_journal(os.environ['CONNECT_FOUR_JOURNAL'])
+else:
+    open_database(os.environ.get('CONNECT_FOUR_DB'))
+open_archive(os.environ.get('CONNECT_FOUR_ARCHIVE'))
@@ -0,0 +1,173 @@
+"""
+Zobrist hashing of board positions and a transposition table for
+caching the results of searches.
+
+A position's hash is the XOR of a key for the board's shape with one
+key for each token on the board, chosen by the token's cell and its
+color. Colors number the tokens in the order they were first played, so
+two games that reach the same position by any order of moves hash the
+same, whatever tokens their players use. Keys are derived from a fixed
+mixing function rather than a random table, so hashes agree across
+processes.
+
+The table is a fixed number of slots held in two arrays of unsigned
+64-bit ints. It's meant to be shared by every search in the process,
+and is only made by the first search, so that processes that never
+search, like most that import the game module, don't hold its 16 MB.
+"""
+import threading
+from array import array
+from functools import lru_cache
+
+
+MASK64 = (1 << 64) - 1
+
+
+def _mix(x):
+    """
+    The splitmix64 finalizer, which scrambles the bits of x.
+    """
+    x = (x + 0x9e3779b97f4a7c15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & MASK64
+    return x ^ (x >> 31)
+
+
+@lru_cache(maxsize=1 << 16)
+def zobrist_key(cell, color):
+    """
+    Key for a token of the given color in the given cell, where cells are
+    numbered like the bits of a Board.
+    """
+    return _mix((cell << 8) | color)
+
+
+def shape_key(n, m, k):
+    """
+    Key for an empty board of the given shape.
+    """
+    return _mix(_mix((n << 42) | (m << 21) | k) ^ 0x5a5a5a5a5a5a5a5a)
+
+
+@lru_cache(maxsize=256)
+def side_key(color):
+    """
+    Key for the color of the player to move.
+    """
+    return _mix(~color & MASK64)
+
+
+
+## bounds stored with a score
+EXACT, LOWER, UPPER = 0, 1, 2
+
+## packing of an entry into 64 bits
+VALUE_BITS = 20
+VALUE_OFFSET = 1 << (VALUE_BITS - 1)
+FLAG_SHIFT = VALUE_BITS
+DEPTH_SHIFT = FLAG_SHIFT + 2
+MOVE_SHIFT = DEPTH_SHIFT + 16
+GENERATION_SHIFT = MOVE_SHIFT + 16
+
+
+class TranspositionTable():
+    """
+    A fixed-size hash table mapping position hashes to a score, the kind
+    of bound the score is, the depth it was searched to and the best move.
+
+    When two positions land in the same slot, the deeper search wins,
+    except that entries left over from earlier searches can always be
+    replaced. Each slot stores the hash XORed with the entry, so a slot
+    torn by two threads writing at once reads as a miss, not a bad entry.
+    """
+    def __init__(self, size=1 << 20):
+        if size < 1 or size & (size - 1):
+            raise ValueError(f'Table size must be a power of two, not {size}.')
+        self.size = size
+        self.keys = array('Q', bytes(8 * size))
+        self.data = array('Q', bytes(8 * size))
+        self.generation = 1
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f'TranspositionTable({self.size})'
+
+    def __len__(self):
+        return sum(1 for d in self.data if d)
+
+    def new_search(self):
+        """
+        Mark the entries stored so far as old, so they can be replaced.
+        """
+        self.generation = self.generation % 255 + 1
+
+    def clear(self):
+        for i in range(self.size):
+            self.keys[i] = 0
+            self.data[i] = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Look up a position. Returns a tuple of score, flag, depth and move,
+        or None if the position isn't in the table.
+        """
+        i = key & (self.size - 1)
+        d = self.data[i]
+        if d and self.keys[i] ^ d == key:
+            self.hits += 1
+            return (
+                (d & ((1 << VALUE_BITS) - 1)) - VALUE_OFFSET,
+                (d >> FLAG_SHIFT) & 0x3,
+                (d >> DEPTH_SHIFT) & 0xffff,
+                ((d >> MOVE_SHIFT) & 0xffff) - 1)
+        self.misses += 1
+        return None
+
+    def put(self, key, value, flag, depth, move=-1):
+        """
+        Store a position, unless its slot holds a deeper search of another
+        position from the current generation.
+        """
+        i = key & (self.size - 1)
+        old = self.data[i]
+        if old and self.keys[i] ^ old != key \
+               and old >> GENERATION_SHIFT == self.generation \
+               and (old >> DEPTH_SHIFT) & 0xffff > depth:
+            return
+        d = (value + VALUE_OFFSET) \
+            | flag << FLAG_SHIFT \
+            | min(depth, 0xffff) << DEPTH_SHIFT \
+            | (move + 1) << MOVE_SHIFT \
+            | self.generation << GENERATION_SHIFT
+        self.data[i] = d
+        self.keys[i] = key ^ d
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+## shared by every search in the process, once there's been one
+_TABLE = None
+_TABLE_LOCK = threading.Lock()
+
+
+def shared_table():
+    """
+    The table shared by every search in the process, made on first use.
+    """
+    global _TABLE
+    if _TABLE is None:
+        with _TABLE_LOCK:
+            if _TABLE is None:
+                _TABLE = TranspositionTable()
+    return _TABLE
@@ -7,6 +7,40 @@ if [ $CMND = "flask" ]; then
     PYTHONPATH=`pwd`/src FLASK_APP=api.py flask run --host=0.0.0.0
 fi
 
+if [ $CMND = "asgi" ]; then
+    ## each idle connection holds a file descriptor
+    ulimit -n `ulimit -Hn`
+    PYTHONPATH=`pwd`/src uvicorn asgi:app --host=0.0.0.0 --port=${PORT:-8000} \
+        --loop=uvloop --http=httptools --backlog=16384 --timeout-keep-alive=75
+fi
+
+if [ $CMND = "gunicorn" ]; then
+    ## workers share games through a table in shared memory
+    CONNECT_FOUR_SHM=${CONNECT_FOUR_SHM:-connect-four} gunicorn api:app --pythonpath=`pwd`/src \
+        --bind=0.0.0.0:${PORT:-8000} --workers=${WORKERS:-`nproc`} --threads=${THREADS:-8}
+fi
+
+if [ $CMND = "sharded" ]; then
+    ## one uvicorn process per shard, and the router in front of them
+    ulimit -n `ulimit -Hn`
+    PORTS=`seq 8001 $((8000 + ${SHARDS:-4}))`
+    URLS=`for P in $PORTS; do echo -n "http://127.0.0.1:$P,"; done`
+    export CONNECT_FOUR_SHARDS=${URLS%,}
+    for P in $PORTS; do
+        ## each shard keeps its games in its own database, journal or table
+        env PYTHONPATH=`pwd`/src CONNECT_FOUR_SHARD=http://127.0.0.1:$P \
+            ${CONNECT_FOUR_DB:+CONNECT_FOUR_DB=$CONNECT_FOUR_DB.$P} \
+            ${CONNECT_FOUR_JOURNAL:+CONNECT_FOUR_JOURNAL=$CONNECT_FOUR_JOURNAL.$P} \
+            ${CONNECT_FOUR_ARCHIVE:+CONNECT_FOUR_ARCHIVE=$CONNECT_FOUR_ARCHIVE.$P} \
+            ${CONNECT_FOUR_SHM:+CONNECT_FOUR_SHM=$CONNECT_FOUR_SHM.$P} \
+            uvicorn asgi:app \
+            --host=127.0.0.1 --port=$P --loop=uvloop --http=httptools --timeout-keep-alive=75 &
+    done
+    trap 'kill $(jobs -p)' EXIT
+    PYTHONPATH=`pwd`/src uvicorn router:app --host=0.0.0.0 --port=${PORT:-8000} \
+        --loop=uvloop --http=httptools --backlog=16384 --timeout-keep-alive=75
+fi
+
 if [ $CMND = "test" ]; then
     PYTHONPATH=`pwd`/src py.test -v -Wignore::DeprecationWarning
 fi
@@ -1,3 +1,5 @@
+import threading
+
 import pytest
 import api
 
@@ -223,3 +225,178 @@ def test_multiple_games(client):
     res = client.get(f'/drop_token/{game_ids[2]}')
     assert res.json['state'] == 'IN_PROGRESS'
 
+
+
+def test_gomoku(client):
+    res = client.post('/drop_token', json={
+            'players': ['go', 'moku'],
+            'rows': 1000,
+            'columns': 1000,
+            'k': 5
+        })
+    game_id = res.json['gameId']
+
+    for i in range(4):
+        res = client.post(f'/drop_token/{game_id}/go', json={
+            'column': 100 + i
+            })
+        res = client.post(f'/drop_token/{game_id}/moku', json={
+            'column': 100 + i
+            })
+
+    res = client.get(f'/drop_token/{game_id}')
+    assert res.json['state'] == 'IN_PROGRESS'
+
+    res = client.post(f'/drop_token/{game_id}/go', json={
+        'column': 104
+        })
+    res = client.get(f'/drop_token/{game_id}')
+    assert res.json['state'] == 'DONE'
+    assert res.json['winner'] == 'go'
+
+
+def test_hint(client):
+    res = client.post('/drop_token', json={
+            'players': ['hinter', 'hintee'],
+            'rows': 6,
+            'columns': 7
+        })
+    game_id = res.json['gameId']
+
+    for i in range(3):
+        client.post(f'/drop_token/{game_id}/hinter', json={'column': 1})
+        client.post(f'/drop_token/{game_id}/hintee', json={'column': 2})
+
+    res = client.get(f'/drop_token/{game_id}/hint?budget=100')
+    assert res.status_code == 200
+    assert res.json['player'] == 'hinter'
+    assert res.json['column'] == 1
+    assert res.json['score'] > 0
+
+    res = client.get(f'/drop_token/{game_id}/hint?budget=0')
+    assert res.status_code == 400
+
+    res = client.get(f'/drop_token/nonesuch/hint')
+    assert res.status_code == 404
+
+
+def test_long_poll(client):
+    res = client.post('/drop_token', json={
+            'players': ['waiter', 'waitee'],
+            'rows': 4,
+            'columns': 4
+        })
+    game_id = res.json['gameId']
+    client.post(f'/drop_token/{game_id}/waiter', json={'column': 0})
+
+    ## move 0 has been played, so no waiting
+    res = client.get(f'/drop_token/{game_id}/moves?start=0&wait=10')
+    assert len(res.json['moves']) == 1
+
+    ## nobody plays move 1, so we time out with no moves
+    res = client.get(f'/drop_token/{game_id}/moves?start=1&wait=0.05')
+    assert res.status_code == 200
+    assert res.json['moves'] == []
+
+    ## move 1 is played while we wait
+    other = api.app.test_client()
+    timer = threading.Timer(0.1, other.post, args=(f'/drop_token/{game_id}/waitee',), kwargs={'json': {'column': 2}})
+    timer.start()
+    res = client.get(f'/drop_token/{game_id}/moves?start=1&wait=10')
+    timer.join()
+    assert res.json['moves'] == [{'type': 'MOVE', 'player': 'waitee', 'column': 2}]
+
+    ## quitting ends the game, which ends the wait
+    timer = threading.Timer(0.1, other.delete, args=(f'/drop_token/{game_id}/waiter',))
+    timer.start()
+    res = client.get(f'/drop_token/{game_id}/moves?start=2&wait=10')
+    timer.join()
+    assert res.json['moves'] == [{'type': 'QUIT', 'player': 'waiter'}]
+
+    res = client.get(f'/drop_token/{game_id}/moves?wait=1000')
+    assert res.status_code == 400
+
+
+def test_list_games_paging(client, monkeypatch):
+    import store
+    for name in ('GAMES', 'PLAYERS'):
+        monkeypatch.setattr(store, name, {})
+    monkeypatch.setattr(store, 'INDEXES', {'IN_PROGRESS': store.Index(), 'DONE': store.Index(), None: store.Index()})
+
+    game_ids = []
+    for i in range(5):
+        res = client.post('/drop_token', json={'players': ['pager1', 'pager2'], 'rows': 4, 'columns': 4})
+        game_ids.append(res.json['gameId'])
+    client.delete(f'/drop_token/{game_ids[2]}/pager1')
+
+    res = client.get('/drop_token?limit=2')
+    assert res.json['games'] == game_ids[:2]
+    res = client.get(f'/drop_token?limit=2&cursor={res.json["next"]}')
+    assert res.json['games'] == game_ids[3:5]
+    assert 'next' not in res.json
+
+    res = client.get('/drop_token?state=DONE')
+    assert res.json == {'games': [game_ids[2]]}
+    res = client.get('/drop_token?state=ALL')
+    assert res.json == {'games': game_ids}
+
+    assert client.get('/drop_token?state=WHATEVER').status_code == 400
+    assert client.get('/drop_token?limit=0').status_code == 400
+    assert client.get('/drop_token?cursor=$$$').status_code == 400
+
+
+def test_etags(client):
+    res = client.post('/drop_token', json={'players': ['etag1', 'etag2'], 'rows': 4, 'columns': 4})
+    game_id = res.json['gameId']
+    urls = [f'/drop_token/{game_id}', f'/drop_token/{game_id}/moves', f'/drop_token/{game_id}/moves/0']
+    client.post(f'/drop_token/{game_id}/etag1', json={'column': 0})
+
+    etags = {}
+    for url in urls:
+        res = client.get(url)
+        assert res.status_code == 200
+        etags[url] = res.headers['ETag']
+        res = client.get(url, headers={'If-None-Match': etags[url]})
+        assert res.status_code == 304
+        assert res.headers['ETag'] == etags[url]
+        assert res.data == b''
+
+    ## a move changes the version of everything in the game
+    client.post(f'/drop_token/{game_id}/etag2', json={'column': 1})
+    for url in urls:
+        res = client.get(url, headers={'If-None-Match': etags[url]})
+        assert res.status_code == 200
+        assert res.headers['ETag'] != etags[url]
+    assert len(client.get(urls[1], headers={'If-None-Match': etags[urls[1]]}).json['moves']) == 2
+
+
+def test_moves_cache(client, monkeypatch):
+    res = client.post('/drop_token', json={'players': ['cache1', 'cache2'], 'rows': 6, 'columns': 7})
+    game_id = res.json['gameId']
+    for column in (0, 1, 2):
+        client.post(f'/drop_token/{game_id}/cache{column % 2 + 1}', json={'column': column})
+
+    encoded = []
+    encode = api._encode_move
+    monkeypatch.setattr(api, '_encode_move', lambda player, column: encoded.append(column) or encode(player, column))
+
+    res = client.get(f'/drop_token/{game_id}/moves?start=1&until=3')
+    assert res.json['moves'] == [
+        {'type': 'MOVE', 'player': 'cache2', 'column': 1},
+        {'type': 'MOVE', 'player': 'cache1', 'column': 2}]
+    assert encoded == [0, 1, 2]
+
+    ## only new moves are encoded
+    client.post(f'/drop_token/{game_id}/cache2', json={'column': 3})
+    client.delete(f'/drop_token/{game_id}/cache1')
+    assert len(client.get(f'/drop_token/{game_id}/moves').json['moves']) == 5
+    assert client.get(f'/drop_token/{game_id}/moves/4').json == {'type': 'QUIT', 'player': 'cache1'}
+    assert client.get(f'/drop_token/{game_id}/moves?start=9').json == {'moves': []}
+    assert encoded == [0, 1, 2, 3, -1]
+
+
+def test_many_players(client):
+    ## once there were only 37 tokens to go around
+    for i in range(50):
+        res = client.post('/drop_token', json={'players': [f'crowd{2*i}', f'crowd{2*i+1}'], 'rows': 4, 'columns': 4})
+        assert res.status_code == 200
@@ -133,3 +133,38 @@ def test_errorrz(client):
     res = client.get(f'/drop_token/{game_id}/moves/999')
     assert res.status_code == 404
 
+
+
+def test_bad_k(client):
+    for k in (0, -2, 'x', 2.5):
+        res = client.post('/drop_token', json={
+                'players': ['kay1', 'kay2'],
+                'rows': 4,
+                'columns': 4,
+                'k': k,
+            })
+        assert res.status_code == 400
+
+
+def test_error_messages(client):
+    res = client.post('/drop_token', json={'players': ['msg1', 'msg2'], 'rows': 4, 'columns': 4})
+    game_id = res.json['gameId']
+
+    res = client.get(f'/drop_token/{game_id}/moves?wait=-1')
+    assert res.status_code == 400
+    assert res.json['message'].startswith('Wait must be between 0 and')
+
+    res = client.get('/drop_token?cursor=bogus')
+    assert res.status_code == 400
+    assert res.json['message'] == 'Invalid cursor "bogus".'
+
+    res = client.get('/drop_token?state=NAPPING')
+    assert res.status_code == 400
+    assert res.json['message'] == 'State must be one of IN_PROGRESS, DONE, ALL, not NAPPING.'
+
+    res = client.get(f'/drop_token/{game_id}/hint?budget=0')
+    assert res.status_code == 400
+    assert res.json['message'].startswith('Budget must be between 0 and')
+
+    res = client.get(f'/drop_token/{game_id}/moves/9')
+    assert res.json['message'] == 'Move number 9 does not exist.'
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+from starlette.testclient import TestClient
+
+import asgi
+import store
+
+
+@pytest.fixture
+def client():
+    with TestClient(asgi.app) as client:
+        yield client
+
+
+def test_game(client):
+    res = client.get('/')
+    assert res.json()['endpoints']['game'] == '/drop_token'
+
+    res = client.post('/drop_token', json={
+            'players': ['async1', 'async2'],
+            'rows': 4,
+            'columns': 4
+        })
+    game_id = res.json()['gameId']
+    assert game_id in client.get('/drop_token').json()['games']
+
+    for i in range(3):
+        res = client.post(f'/drop_token/{game_id}/async1', json={'column': 0})
+        assert res.status_code == 200
+        client.post(f'/drop_token/{game_id}/async2', json={'column': 1})
+    res = client.post(f'/drop_token/{game_id}/async1', json={'column': 0})
+    assert res.json()['move'] == f'{game_id}/moves/6'
+
+    res = client.get(f'/drop_token/{game_id}')
+    assert res.json() == {'players': ['async1', 'async2'], 'state': 'DONE', 'winner': 'async1'}
+
+    res = client.get(f'/drop_token/{game_id}/moves?start=5')
+    assert res.json()['moves'] == [
+        {'type': 'MOVE', 'player': 'async2', 'column': 1},
+        {'type': 'MOVE', 'player': 'async1', 'column': 0}]
+    assert client.get(f'/drop_token/{game_id}/moves/6').json()['column'] == 0
+
+
+def test_errors(client):
+    res = client.post('/drop_token', json={
+            'players': ['async3', 'async4'],
+            'rows': 4,
+            'columns': 4
+        })
+    game_id = res.json()['gameId']
+
+    assert client.post('/drop_token', json={'players': ['harry', 'draco']}).status_code == 400
+    assert client.post(f'/drop_token/{game_id}/async4', json={'column': 2}).status_code == 409
+    assert client.post(f'/drop_token/{game_id}/monkey', json={'column': 2}).status_code == 404
+    assert client.post(f'/drop_token/nonesuch/async3', json={'column': 2}).status_code == 404
+    assert client.post(f'/drop_token/{game_id}/async3', json={'column': 4}).status_code == 400
+    assert client.get(f'/drop_token/{game_id}/moves/0').status_code == 404
+    assert client.get(f'/drop_token/{game_id}/moves?start=x').status_code == 400
+    assert client.get(f'/drop_token/{game_id}/hint?budget=0').status_code == 400
+
+    res = client.delete(f'/drop_token/{game_id}/async3')
+    assert res.status_code == 202
+    res = client.delete(f'/drop_token/{game_id}/async4')
+    assert res.status_code == 410
+    assert 'exception' in res.json()
+
+
+def test_many_long_polls():
+    g = store.new_game(['async5', 'async6'], 4, 4)
+    waiters = 500
+
+    async def main():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            polls = [
+                asyncio.ensure_future(client.get(f'/drop_token/{g.id}/moves?start=0&wait=10'))
+                for i in range(waiters)]
+            await asyncio.sleep(0.2)
+            assert not any(poll.done() for poll in polls)
+            threads = threading.active_count()
+
+            threading.Timer(0.1, store.play, args=(g, g.players[0], 3)).start()
+            responses = await asyncio.gather(*polls)
+            return threads, responses
+
+    threads, responses = asyncio.run(main())
+    assert threads < 50
+    for res in responses:
+        assert res.json()['moves'] == [{'type': 'MOVE', 'player': 'async5', 'column': 3}]
+
+
+def test_hints_dont_starve_other_routes(client, monkeypatch):
+    res = client.post('/drop_token', json={'players': ['async7', 'async8'], 'rows': 6, 'columns': 7})
+    game_id = res.json()['gameId']
+
+    ## hold every thread in the shared pool, as a burst of slow hints would
+    release = threading.Event()
+    real = asgi.solver.suggest_move
+    def slow(*args):
+        release.wait(5)
+        return real(*args)
+    monkeypatch.setattr(asgi.solver, 'suggest_move', slow)
+
+    threads = [threading.Thread(target=client.get, args=(f'/drop_token/{game_id}/hint?budget=10',))
+               for i in range(asgi.HINT_THREADS + 2)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    start = time.monotonic()
+    assert client.get(f'/drop_token/{game_id}').status_code == 200
+    assert time.monotonic() - start < 1
+    release.set()
+    for t in threads:
+        t.join()
+
+
+def test_etags(client):
+    res = client.post('/drop_token', json={'players': ['async9', 'async10'], 'rows': 4, 'columns': 4})
+    game_id = res.json()['gameId']
+    url = f'/drop_token/{game_id}/moves'
+
+    etag = client.get(url).headers['ETag']
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert client.get(url, headers={'If-None-Match': f'W/{etag}'}).status_code == 304
+
+    client.post(f'/drop_token/{game_id}/async9', json={'column': 0})
+    res = client.get(url, headers={'If-None-Match': etag})
+    assert res.status_code == 200
+    assert res.headers['ETag'] != etag
@@ -0,0 +1,57 @@
+import pytest
+
+import book
+import game
+import solver
+
+
+def test_build_and_lookup(tmp_path):
+    path = str(tmp_path / 'book.bin')
+    count = book.build(path, n=4, m=5, k=3, plies=2, budget=0.01)
+    assert count == 1 + 5 + 25
+
+    opening = book.OpeningBook(path)
+    assert len(opening) == count
+
+    b = game.Board(4, 5, 3)
+    column, score = opening.lookup(b, 'x')
+    assert 0 <= column < 5
+
+    ## same position, different tokens
+    b.play(1, 'r')
+    b.play(3, 'b')
+    assert opening.lookup(b, 'r') is not None
+
+    ## too deep for the book
+    b.play(2, 'r')
+    b.play(2, 'b')
+    assert opening.lookup(b, 'r') is None
+
+    ## wrong shape
+    assert opening.lookup(game.Board(6, 7), 'x') is None
+    opening.close()
+
+
+def test_not_a_book(tmp_path):
+    path = tmp_path / 'junk.bin'
+    path.write_bytes(b'0123456789abcdef')
+    with pytest.raises(ValueError):
+        book.OpeningBook(str(path))
+
+
+def test_suggest_move_uses_book(tmp_path, monkeypatch):
+    path = str(tmp_path / 'book.bin')
+    book.build(path, n=4, m=5, k=3, plies=1, budget=0.01)
+    monkeypatch.setenv('CONNECT_FOUR_BOOK', path)
+
+    ## a book that disagrees with the solver, to tell where moves come from
+    opening = book.get_book()
+    monkeypatch.setattr(opening, '_find', lambda key: (4, 99))
+
+    p = game.Player('Player1', '1')
+    q = game.Player('Player2', '2')
+    g = game.Game(p, q, n=4, m=5, k=3)
+    assert solver.suggest_move(g) == (4, 99)
+
+    g = game.Game(p, q, n=4, m=6, k=3)
+    assert solver.suggest_move(g) != (4, 99)
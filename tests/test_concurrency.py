@@ -0,0 +1,94 @@
+import random
+import threading
+import time
+
+import pytest
+
+import store
+from game import ColumnFullException, OutOfTurnError, GameOver
+
+
+THREADS = 16
+
+
+@pytest.fixture(autouse=True)
+def empty_store(monkeypatch):
+    for name in ('GAMES', 'PLAYERS'):
+        monkeypatch.setattr(store, name, {})
+
+
+def _run(target):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(THREADS)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def _check_game(g):
+    """
+    Check that the board, history and turn of a game agree.
+    """
+    moves = [(player, column) for player, column in g.history if column >= 0]
+    assert g.board.moves == len(moves)
+    for player, (p, column) in zip(g.players * len(moves), moves):
+        assert player == p
+
+    heights = [0] * g.board.m
+    for p, column in moves:
+        assert g.board[heights[column], column] == g.tokens[g.players.index(p)]
+        heights[column] += 1
+    assert heights == g.board.heights
+
+    if g.status == 'IN_PROGRESS':
+        assert g.players[g.turn] == g.players[len(moves) % len(g.players)]
+
+
+def test_hammer_one_game():
+    g = store.new_game(['hammer_x', 'hammer_o'], 40, 40, 40)
+    moves = []
+
+    def hammer(i):
+        rnd = random.Random(i)
+        for _ in range(1000):
+            try:
+                moves.append(store.play(g, rnd.choice(g.players), rnd.randrange(g.board.m)))
+            except (ColumnFullException, OutOfTurnError, GameOver):
+                pass
+
+    _run(hammer)
+    assert sorted(moves) == list(range(len(g.history)))
+    assert len(moves) > 0
+    _check_game(g)
+
+
+def test_hammer_many_games():
+    games = []
+
+    def hammer(i):
+        rnd = random.Random(i)
+        for n in range(20):
+            ## players are shared between threads, so they race to create them
+            g = store.new_game([f'many{rnd.randrange(10)}', f'many{10 + rnd.randrange(10)}'], 6, 7)
+            games.append(g)
+            while g.status == 'IN_PROGRESS':
+                try:
+                    store.play(g, g.players[g.turn], rnd.randrange(7))
+                except ColumnFullException:
+                    pass
+
+    seconds = _run(hammer)
+
+    assert len(games) == THREADS * 20
+    for g in games:
+        _check_game(g)
+
+    assert len({store.get_player(f'many{i}') for i in range(20)}) == 20
+    for g in games:
+        assert len(set(g.tokens)) == 2
+
+    moves = sum(len(g.history) for g in games)
+    print(f'{moves / seconds:.0f} moves per second in {len(games)} games on {THREADS} threads')
+    assert moves / seconds > 100
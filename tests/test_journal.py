@@ -0,0 +1,128 @@
+import os
+import time
+
+import pytest
+
+import journal
+import store
+from journal import Journal
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    for name in ('GAMES', 'PLAYERS'):
+        monkeypatch.setattr(store, name, {})
+    monkeypatch.setattr(store, 'DB', None)
+    path = str(tmp_path / 'journal')
+    store.open_journal(path)
+    yield path
+    store.open_journal(None)
+
+
+def _play_some(game, moves):
+    for column in moves:
+        store.play(game, game.players[game.turn], column)
+
+
+def test_games_survive_restart(path):
+    g = store.new_game(['alice', 'bob', 'carol'], 4, 5, 3)
+    h = store.new_game(['alice', 'bob'], 6, 7)
+    _play_some(g, [0, 1, 2, 0])
+    store.quit(g, g.players[1])
+    _play_some(g, [2, 0])
+    _play_some(h, [3, 3, 4])
+    assert g.status == 'DONE'
+
+    ## simulate a restart
+    store.open_journal(path)
+    assert store.GAMES == {}
+    assert store.list_games('DONE') == ([g.id], None)
+    assert store.list_games('IN_PROGRESS') == ([h.id], None)
+    assert store.get_game(g.id).history == g.history
+    assert store.get_game(g.id).winner == g.winner
+
+    h2 = store.get_game(h.id)
+    assert h2.history == h.history
+    store.play(h2, h2.players[1], 4)
+    assert store.get_player('bob').token == g.players[1].token
+
+
+def test_snapshot_and_replay_tail(path, monkeypatch):
+    monkeypatch.setattr(journal, 'SNAPSHOT_EVENTS', 10)
+    games = [store.new_game(['alice', 'bob'], 6, 7) for i in range(3)]
+    for g in games:
+        _play_some(g, [1, 2, 3])
+    store.DB.close()
+    assert store.DB.snapshots >= 1
+
+    ## only the latest snapshot and the journal since are kept
+    names = sorted(os.listdir(path))
+    assert len([name for name in names if name.startswith('snapshot.')]) == 1
+    snapshot = [name for name in names if name.startswith('snapshot.')][0]
+    assert all(name >= snapshot.replace('snapshot', 'journal') for name in names if name.startswith('journal.'))
+
+    store.open_journal(path)
+    for g in games:
+        assert store.get_game(g.id).history == g.history
+
+
+def test_torn_line(path):
+    g = store.new_game(['alice', 'bob'], 6, 7)
+    _play_some(g, [1, 2])
+    store.DB.close()
+    journals = sorted(name for name in os.listdir(path) if name.startswith('journal.'))
+    with open(os.path.join(path, journals[-1]), 'a') as f:
+        f.write('["move","' + g.id[:5])
+
+    store.open_journal(path)
+    h = store.get_game(g.id)
+    assert h.history == g.history
+    store.play(h, h.players[0], 3)
+    store.open_journal(path)
+    assert len(store.get_game(g.id).history) == 3
+
+
+def test_wide_board(path):
+    ## a column past what a short holds is journaled and replayed
+    g = store.new_game(['alice', 'bob'], 1, 100000)
+    _play_some(g, [40000, 99999])
+    with pytest.raises(ValueError):
+        store.DB.append_move(g.id, 2, 'alice', 100000)
+    store.open_journal(path)
+    assert [column for player, column in store.get_game(g.id).history] == [40000, 99999]
+
+
+def test_snapshot_off_lock(tmp_path):
+    ## appends made while a snapshot is built go to the next one
+    j = Journal(str(tmp_path))
+    j.add_game('game0', 6, 7, 4, ['alice', 'bob'])
+    load = j._load
+    def appending_load(self, until=None):
+        j.append_move('game0', 0, 'alice', 3)
+        return load.__func__(self, until)
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr(Journal, '_load', appending_load)
+        j.snapshot()
+    j.close()
+
+    j = Journal(str(tmp_path))
+    j.close()
+    assert j.get_game('game0')[4] == [('alice', 3)]
+
+
+def test_fast_recovery(tmp_path):
+    games = 100000
+    j = Journal(str(tmp_path))
+    for i in range(games):
+        j.add_game(f'game{i}', 6, 7, 4, ['alice', 'bob'])
+        j.append_move(f'game{i}', 0, 'alice', i % 7)
+    j.snapshot()
+    j.close()
+
+    start = time.perf_counter()
+    j = Journal(str(tmp_path))
+    seconds = time.perf_counter() - start
+    j.close()
+    print(f'loaded {games} games in {seconds:.2f} seconds')
+    assert len(j.games) == games
+    assert seconds < 2
@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+import pytest
+
+import game
+import mcts
+
+
+def test_wins():
+    boards = np.zeros((3, 4, 5), dtype=np.int8)
+    boards[0, 0, 0:3] = 1
+    boards[1, 0:3, 2] = 1
+    boards[2, [0, 1, 2], [0, 1, 2]] = 2
+    won = mcts._wins(boards, np.arange(3), np.array([0, 2, 1]), np.array([2, 2, 1]), 1, 3)
+    assert list(won) == [True, True, False]
+    won = mcts._wins(boards, np.arange(3), np.array([0, 2, 1]), np.array([2, 2, 1]), 2, 3)
+    assert list(won) == [False, False, True]
+
+
+def test_rollouts():
+    rng = np.random.default_rng(0)
+    grid = np.zeros((4, 4), dtype=np.int8)
+    heights = np.zeros(4, dtype=np.int32)
+    winners = mcts.rollouts(grid, heights, np.ones(4, dtype=bool), 1, 1000, 4, 16, rng)
+    assert winners.shape == (1000,)
+    assert set(np.unique(winners)) <= {0, 1, 2}
+
+    ## player 1 can't lose with three in a column and the move
+    grid[0:3, 0] = 1
+    grid[0:3, 3] = 2
+    heights[[0, 3]] = 3
+    winners = mcts.rollouts(grid, heights, np.ones(4, dtype=bool), 1, 1000, 4, 10, rng)
+    assert (winners == 1).mean() > 0.2
+
+
+def test_takes_the_win():
+    x = game.Player('x')
+    o = game.Player('o')
+    g = game.Game(x, o, n=6, m=7)
+    for i in range(3):
+        g.play(x, 2)
+        g.play(o, 5)
+    column, stats = mcts.choose_move(g, 200, seed=1)
+    assert column == 2
+    assert stats['playouts'] > 0
+    assert stats['playouts_per_second'] > 0
+
+
+def test_blocks_on_a_big_board():
+    x = game.Player('x')
+    o = game.Player('o')
+    g = game.Game(x, o, n=1000, m=1000, k=5)
+    for j in range(500, 504):
+        g.play(x, j)
+        g.play(o, 300 + j % 2)
+    column, stats = mcts.choose_move(g, 300, seed=1)
+    assert column in (499, 504)
+
+
+def test_budget_on_a_wide_window():
+    x = game.Player('x')
+    o = game.Player('o')
+    g = game.Game(x, o, n=200, m=2000, k=5)
+    for i, j in enumerate(range(0, 800, 20)):
+        g.play(g.players[i % 2], j)
+    start = time.monotonic()
+    mcts.choose_move(g, 50, seed=1)
+    assert time.monotonic() - start < 0.1
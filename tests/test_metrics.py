@@ -0,0 +1,87 @@
+import timeit
+
+import pytest
+from starlette.testclient import TestClient
+
+import api
+import asgi
+import metrics
+import store
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    metrics.reset()
+
+
+def _metric(text, line):
+    for l in text.splitlines():
+        if l.startswith(line + ' '):
+            return float(l.rsplit(' ', 1)[1])
+    return None
+
+
+def test_flask_metrics():
+    client = api.app.test_client()
+    res = client.post('/drop_token', json={'players': ['metric1', 'metric2'], 'rows': 4, 'columns': 4})
+    game_id = res.json['gameId']
+    client.post(f'/drop_token/{game_id}/metric1', json={'column': 0})
+    client.post(f'/drop_token/{game_id}/metric2', json={'column': 0})
+    client.post(f'/drop_token/{game_id}/metric2', json={'column': 0})
+    client.get('/drop_token/no-such-game')
+
+    res = client.get('/metrics')
+    assert res.status_code == 200
+    assert res.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    text = res.data.decode()
+
+    route = 'method="POST",route="/drop_token/{game_id}/{player_id}"'
+    assert _metric(text, f'connect_four_request_seconds_count{{{route}}}') == 3
+    assert _metric(text, f'connect_four_request_seconds_bucket{{{route},le="+Inf"}}') == 3
+    assert _metric(text, f'connect_four_responses_total{{{route},status="200"}}') == 2
+    assert _metric(text, f'connect_four_responses_total{{{route},status="409"}}') == 1
+    assert _metric(text, 'connect_four_responses_total{method="GET",route="/drop_token/{game_id}",status="404"}') == 1
+    assert _metric(text, 'connect_four_moves_total') == 2
+    assert _metric(text, 'connect_four_games{status="IN_PROGRESS"}') >= 1
+    assert _metric(text, 'connect_four_players') >= 2
+    assert _metric(text, 'connect_four_moves_per_second') is not None
+
+
+def test_asgi_metrics():
+    with TestClient(asgi.app) as client:
+        res = client.post('/drop_token', json={'players': ['metric3', 'metric4'], 'rows': 4, 'columns': 4})
+        game_id = res.json()['gameId']
+        client.post(f'/drop_token/{game_id}/metric3', json={'column': 0})
+        text = client.get('/metrics').text
+
+    route = 'method="POST",route="/drop_token/{game_id}/{player_id}"'
+    assert _metric(text, f'connect_four_responses_total{{{route},status="200"}}') == 1
+    assert _metric(text, 'connect_four_moves_total') == 1
+
+
+def test_game_counts():
+    client = api.app.test_client()
+    before = dict(store.COUNTS)
+    res = client.post('/drop_token', json={'players': ['metric5', 'metric6'], 'rows': 4, 'columns': 4})
+    game_id = res.json['gameId']
+    assert store.COUNTS['IN_PROGRESS'] == before['IN_PROGRESS'] + 1
+    client.delete(f'/drop_token/{game_id}/metric5')
+    assert store.COUNTS == {'IN_PROGRESS': before['IN_PROGRESS'], 'DONE': before['DONE'] + 1}
+
+    text = client.get('/metrics').data.decode()
+    assert _metric(text, 'connect_four_games{status="DONE"}') == store.COUNTS['DONE']
+
+
+def test_route_label():
+    assert metrics.route_label('/drop_token/<game_id>/<player_id>') == '/drop_token/{game_id}/{player_id}'
+    assert metrics.route_label('/drop_token/<string:game_id>/moves') == '/drop_token/{game_id}/moves'
+    assert metrics.route_label('/drop_token/{game_id:str}') == '/drop_token/{game_id}'
+    assert metrics.route_label('/drop_token') == '/drop_token'
+
+
+def test_cost_of_recording():
+    n = 100000
+    seconds = timeit.timeit(
+        lambda: metrics.observe_request('POST', '/drop_token/{game_id}/{player_id}', 200, 0.0003), number=n) / n
+    print(f'{seconds*1e6:.2f} us to record a request')
+    assert seconds < 5e-6
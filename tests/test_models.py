@@ -1,3 +1,5 @@
+import types
+
 import pytest
 
 import game
@@ -101,6 +103,67 @@ def test_is_winning_move_diagonal():
     assert b.is_winning_move(1,1,'x')
 
 
+def test_board_move_count():
+    b = game.Board(3,2)
+    assert b.moves == 0
+
+    b.play(0, 'r')
+    b.play(0, 'b')
+    b.play(1, 'r')
+    assert b.moves == 3
+
+    with pytest.raises(game.ColumnFullException):
+        b.play(0, 'r')
+        b.play(0, 'b')
+    assert b.moves == 4
+
+
+def test_is_winning_move_anti_diagonal_k3():
+    b = game.Board(5,6,k=3)
+    for i in range(3):
+        for j in range(2-i):
+            b.play(i+3, 'o')
+        b.play(i+3, 'x')
+    assert b.is_winning_move(0,5,'x')
+    assert b.is_winning_move(2,3,'x')
+
+    ## no wrap around from the top of one column to the next
+    b = game.Board(2,3,k=3)
+    b.play(0, 'o')
+    b.play(0, 'x')
+    b.play(1, 'x')
+    assert b.play(1, 'x') is False
+
+
+def test_sparse_board_matches_board():
+    import random
+    rng = random.Random(42)
+    for trial in range(200):
+        n, m, k = rng.randint(1,7), rng.randint(1,7), rng.randint(1,5)
+        a = game.Board(n, m, k)
+        b = game.SparseBoard(n, m, k)
+        for _ in range(n*m):
+            column = rng.choice([j for j in range(m) if a.heights[j] < n])
+            token = rng.choice('xo')
+            assert a.play(column, token) == b.play(column, token)
+        assert str(a) == str(b)
+        assert a.is_full() and b.is_full()
+        with pytest.raises(game.ColumnFullException):
+            b.play(0, 'x')
+
+
+def test_sparse_board_large():
+    b = game.new_board(1000, 1000, 5)
+    assert isinstance(b, game.SparseBoard)
+    for j in range(500, 504):
+        b.play(j, 'x')
+        b.play(j, 'o')
+    assert b[999, 999] == ' '
+    assert b[1, 502] == 'o'
+    assert b.play(504, 'x')
+    assert len(b.cells) == 9
+
+
 def test_game():
     p = game.Player('Player1', '1')
     q = game.Player('Player2', '2')
@@ -159,3 +222,99 @@ def test_win_game():
     assert g.status == 'DONE'
     assert g.winner == p
 
+
+
+def test_history():
+    alice, bob = game.Player('alice'), game.Player('bob')
+    g = game.Game(alice, bob, n=6, m=7)
+    g.play(alice, 3)
+    g.play(bob, 6)
+    g.quit(alice)
+
+    assert len(g.history) == 3
+    assert g.history[1] == (bob, 6)
+    assert g.history[-1] == (alice, -1)
+    assert g.history[1:] == [(bob, 6), (alice, -1)]
+    assert g.history == [(alice, 3), (bob, 6), (alice, -1)]
+    assert g.player_active == {alice: False, bob: True}
+    assert g.winner == bob
+
+    with pytest.raises(AttributeError):
+        g.extra = 1
+
+
+class _LooseGame():
+    """
+    The layout games had before they were made compact: instance dicts, a
+    dict of active players, a list of (player, column) tuples for history
+    and a condition variable and listener set made up front.
+    """
+    def __init__(self, g):
+        import threading
+        board = types.SimpleNamespace(**{name: getattr(g.board, name) for name in game.Board.__slots__})
+        board.directions = tuple(board.directions)
+        board._lines = tuple(line + 0 for line in board._lines)
+        self.id = str(g.id)
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.listeners = set()
+        self.board = board
+        self.players = g.players
+        self.player_active = dict(g.player_active)
+        self.turn = g.turn
+        self.history = list(g.history)
+        self.winner = g.winner
+
+
+def _bytes_per_object(make, count=100):
+    import tracemalloc
+    make()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    objects = [make() for i in range(count)]
+    size = (tracemalloc.get_traced_memory()[0] - start) / count
+    tracemalloc.stop()
+    return size
+
+
+def test_bytes_per_game():
+    """
+    A typical 7x6 game of 20 moves, along with its board and history,
+    should take well under half the memory it took before games were
+    made compact. When this was written, that was about 4000 bytes
+    before and 1200 after.
+    """
+    alice, bob = game.Player('alice'), game.Player('bob')
+    columns = [3, 3, 2, 4, 4, 2, 5, 1, 1, 5, 0, 6, 6, 0, 2, 4, 3, 5, 6, 1]
+
+    def play():
+        g = game.Game(alice, bob, n=6, m=7)
+        for i, column in enumerate(columns):
+            g.play(g.players[i % 2], column)
+        return g
+
+    g = play()
+    assert g.status == 'IN_PROGRESS'
+
+    after = _bytes_per_object(play)
+    ## the loose copy keeps the board's masks, heights and colors, but
+    ## the compact game it's made from is freed
+    before = _bytes_per_object(lambda: _LooseGame(play()))
+    print(f'{before:.0f} bytes per game before, {after:.0f} after')
+    assert after < before / 2
+
+
+def test_tokens():
+    ## tokens are only unique within a game
+    alice, adam, ann, bob = (game.Player(name) for name in ('alice', 'adam', 'ann', 'bob'))
+    assert game.Game(alice, bob).tokens == 'ab'
+    assert game.Game(alice, adam, bob, ann).tokens == 'a=b+'
+    assert game.Game(adam, alice).tokens == 'a='
+
+    g = game.Game(alice, adam, n=4, m=4)
+    g.play(alice, 0)
+    g.play(adam, 0)
+    assert g.board[:, 0] == ['a', '=', ' ', ' ']
+
+    with pytest.raises(ValueError):
+        game.Game(*(game.Player(f'x{i}') for i in range(len(game.SPARE_TOKENS) + 2)))
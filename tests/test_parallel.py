@@ -0,0 +1,45 @@
+import pytest
+
+import game
+import parallel
+import solver
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = parallel.Pool(2)
+    yield pool
+    pool.shutdown()
+
+
+def test_takes_the_win(pool):
+    b = game.Board(6,7)
+    for i in range(3):
+        b.play(2, 'x')
+        b.play(5, 'o')
+    column, score = pool.best_move(b, 'x', budget=1)
+    assert column == 2
+    assert score > 0
+
+
+def test_finds_forced_win(pool):
+    b = game.Board(6,7)
+    b.play(2, 'x')
+    b.play(2, 'o')
+    b.play(3, 'x')
+    b.play(3, 'o')
+    column, score = pool.best_move(b, 'x', budget=2)
+    assert column in (1, 4)
+    assert score == solver.best_move(b, 'x', budget=2)[1]
+
+
+def test_agrees_with_solver_on_small_board(pool):
+    b = game.Board(4,4,3)
+    b.play(1, 'x')
+    b.play(1, 'o')
+    assert pool.best_move(b, 'x', budget=2)[1] == solver.best_move(b, 'x', budget=2)[1]
+
+
+def test_rejects_sparse_boards(pool):
+    with pytest.raises(ValueError):
+        pool.best_move(game.SparseBoard(100, 100, 5), 'x')
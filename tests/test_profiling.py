@@ -0,0 +1,60 @@
+import sys
+
+import pytest
+
+import api
+import profiling
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(profiling, 'RATE', 0)
+    monkeypatch.setattr(profiling, 'ADMIN', True)
+    profiling.reset()
+    yield api.app.test_client()
+    profiling.reset()
+
+
+def _play(client, players):
+    res = client.post('/drop_token', json={'players': players, 'rows': 6, 'columns': 7})
+    game_id = res.json['gameId']
+    for i in range(4):
+        client.post(f'/drop_token/{game_id}/{players[i % 2]}', json={'column': i})
+
+
+def test_off_by_default(client):
+    _play(client, ['prof1', 'prof2'])
+    assert profiling.samples() == 0
+    assert sys.getprofile() is None
+
+
+def test_profile_requests(client, tmp_path):
+    res = client.post('/admin/profile', json={'rate': 1})
+    assert res.json['rate'] == 1
+    _play(client, ['prof3', 'prof4'])
+    assert sys.getprofile() is None
+
+    functions = {row['function']: row for row in client.get('/admin/profile').json['functions']}
+    assert functions['game.Game.play']['calls'] == 4
+    assert functions['game.Board.play']['calls'] == 4
+    assert functions['store.play']['total_ms'] >= functions['game.Game.play']['total_ms']
+    assert 'api.play_move' not in functions
+
+    stacks = profiling.collapsed().splitlines()
+    assert any(line.startswith('store.play;game.Game.play;game.Game._play;game.Board.play ') for line in stacks)
+
+    paths = profiling.dump(str(tmp_path / 'profile.collapsed'))
+    assert open(paths[0]).read() == profiling.collapsed()
+    assert 'game.Board.play' in open(paths[1]).read()
+
+    client.post('/admin/profile', json={'rate': 0})
+    samples = profiling.samples()
+    _play(client, ['prof5', 'prof6'])
+    assert profiling.samples() == samples
+
+
+def test_admin_errors(client, monkeypatch):
+    assert client.post('/admin/profile', json={'rate': 2}).status_code == 400
+    assert client.post('/admin/profile', json={'rate': 'lots'}).status_code == 400
+    monkeypatch.setattr(profiling, 'ADMIN', False)
+    assert client.get('/admin/profile').status_code == 404
@@ -0,0 +1,25 @@
+import uuid
+
+from ring import Ring
+
+
+def test_even_spread():
+    shards = [f'http://127.0.0.1:{8001 + i}' for i in range(4)]
+    ring = Ring(shards)
+    ids = [str(uuid.UUID(int=i * 7919 + 12345)) for i in range(20000)]
+    counts = {shard: 0 for shard in shards}
+    for game_id in ids:
+        counts[ring.owner(game_id)] += 1
+    for count in counts.values():
+        assert 0.2 < count / len(ids) < 0.3
+
+
+def test_few_games_move():
+    shards = [f'shard{i}' for i in range(4)]
+    before, after = Ring(shards), Ring(shards + ['shard4'])
+    ids = [f'game{i}' for i in range(20000)]
+    moved = [game_id for game_id in ids if before.owner(game_id) != after.owner(game_id)]
+
+    ## about a fifth move, all of them to the new shard
+    assert 0.15 < len(moved) / len(ids) < 0.25
+    assert {after.owner(game_id) for game_id in moved} == {'shard4'}
@@ -0,0 +1,149 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import pytest
+from starlette.testclient import TestClient
+
+import router
+from ring import Ring
+
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _start_shards(n, shards=None):
+    urls = [f'http://127.0.0.1:{_free_port()}' for i in range(n)]
+    shards = shards or urls
+    processes = []
+    for url in urls:
+        env = dict(os.environ, PYTHONPATH=SRC, CONNECT_FOUR_SHARD=url, CONNECT_FOUR_SHARDS=','.join(shards))
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', url.rsplit(':', 1)[1]],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    for url in urls:
+        for i in range(200):
+            try:
+                httpx.get(url + '/')
+                break
+            except httpx.TransportError:
+                time.sleep(0.05)
+    return urls, processes
+
+
+@pytest.fixture(scope='module')
+def shards():
+    urls, processes = _start_shards(3)
+    yield urls
+    for p in processes:
+        p.terminate()
+        p.wait()
+
+
+@pytest.fixture
+def client(shards):
+    with TestClient(router.make_app(shards)) as client:
+        yield client
+
+
+def _new_game(client, *players):
+    res = client.post('/drop_token', json={'players': list(players), 'rows': 4, 'columns': 4})
+    assert res.status_code == 200
+    return res.json()['gameId']
+
+
+def test_games_routed_to_owner(client, shards):
+    ring = Ring(shards)
+    game_ids = [_new_game(client, 'shard1', 'shard2') for i in range(6)]
+
+    ## created on each shard in turn, each game on the shard that owns it
+    assert sorted(ring.owner(game_id) for game_id in game_ids) == sorted(shards * 2)
+    for game_id in game_ids:
+        assert httpx.get(f'{ring.owner(game_id)}/drop_token/{game_id}').status_code == 200
+
+    game_id = game_ids[0]
+    for i in range(3):
+        assert client.post(f'/drop_token/{game_id}/shard1', json={'column': 0}).status_code == 200
+        assert client.post(f'/drop_token/{game_id}/shard2', json={'column': 1}).status_code == 200
+    assert client.get(f'/drop_token/{game_id}/moves/0').json()['column'] == 0
+    assert len(client.get(f'/drop_token/{game_id}/moves').json()['moves']) == 6
+    assert client.delete(f'/drop_token/{game_id}/shard1').status_code == 202
+    assert client.get(f'/drop_token/{game_id}').json()['winner'] == 'shard2'
+
+    res = client.get(f'/drop_token/{game_id}')
+    assert client.get(f'/drop_token/{game_id}', headers={'If-None-Match': res.headers['etag']}).status_code == 304
+
+    assert client.get('/drop_token/nosuchgame').status_code == 404
+
+
+def test_list_games(client):
+    game_ids = {_new_game(client, 'lister1', 'lister2') for i in range(10)}
+
+    listed = []
+    res = client.get('/drop_token', params={'limit': 2})
+    while True:
+        assert res.status_code == 200
+        data = res.json()
+        assert len(data['games']) <= 2
+        listed.extend(data['games'])
+        if 'next' not in data:
+            break
+        res = client.get('/drop_token', params={'limit': 2, 'cursor': data['next']})
+
+    assert len(listed) == len(set(listed))
+    assert game_ids <= set(listed)
+
+    assert client.get('/drop_token', params={'limit': 0}).status_code == 400
+    assert client.get('/drop_token', params={'cursor': 'nonsense'}).status_code == 400
+    assert client.get('/drop_token', params={'cursor': router._encode_cursor([''] * 4)}).status_code == 400
+
+
+def test_cursor_across_shard_change(shards):
+    ## a cursor given out by a router with fewer shards still pages
+    with TestClient(router.make_app(shards[:2])) as client:
+        _new_game(client, 'pager1', 'pager2')
+        cursor = client.get('/drop_token', params={'limit': 1}).json()['next']
+    with TestClient(router.make_app(shards)) as client:
+        res = client.get('/drop_token', params={'limit': 3, 'cursor': cursor})
+        assert res.status_code == 200
+        assert res.json()['games']
+
+
+def test_previous_shards(shards):
+    ## a new shard joins: games its owners don't have are found on their old owners
+    (added,), processes = _start_shards(1)
+    try:
+        with TestClient(router.make_app(shards)) as client:
+            game_ids = [_new_game(client, 'mover1', 'mover2') for i in range(30)]
+
+        new_ring = Ring(shards + [added])
+        moved = [game_id for game_id in game_ids if new_ring.owner(game_id) == added]
+        assert moved
+
+        with TestClient(router.make_app(shards + [added])) as client:
+            assert client.get(f'/drop_token/{moved[0]}').status_code == 404
+        with TestClient(router.make_app(shards + [added], previous=shards)) as client:
+            for game_id in moved:
+                assert client.get(f'/drop_token/{game_id}').status_code == 200
+            assert client.post(f'/drop_token/{moved[0]}/mover1', json={'column': 0}).status_code == 200
+    finally:
+        for p in processes:
+            p.terminate()
+            p.wait()
+
+
+def test_router_loads_no_engine():
+    ## the router doesn't load the game engine or open the store
+    code = "import sys, router; print(sorted({'api', 'store', 'game', 'flask'} & set(sys.modules)))"
+    out = subprocess.run([sys.executable, '-c', code], env=dict(os.environ, PYTHONPATH=SRC),
+                         capture_output=True, text=True, check=True).stdout
+    assert out.strip() == '[]'
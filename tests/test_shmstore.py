@@ -0,0 +1,157 @@
+import multiprocessing
+import random
+import threading
+import time
+import uuid
+
+import pytest
+
+import api
+import store
+from game import ColumnFullException, GameOver, OutOfTurnError
+from shmstore import SharedTable, TableFull
+
+
+@pytest.fixture
+def name(monkeypatch):
+    for attr in ('GAMES', 'PLAYERS'):
+        monkeypatch.setattr(store, attr, {})
+    monkeypatch.setattr(store, 'DB', None)
+    name = f'c4test-{uuid.uuid4().hex[:8]}'
+    store.open_shared(name)
+    yield name
+    store.open_database(None)
+    SharedTable(name).unlink()
+
+
+def _in_process(target, *args):
+    """
+    Run target in a new process, as a gunicorn worker would, with the
+    store opened on the shared table.
+    """
+    def run(name, *args):
+        store.open_shared(name)
+        target(*args)
+        store.open_database(None)
+    p = multiprocessing.get_context('fork').Process(target=run, args=(store.DB.name, *args))
+    p.start()
+    return p
+
+
+def _play_next(game_id, column):
+    g = store.get_game(game_id)
+    store.play(g, g.players[g.turn], column)
+
+
+def test_other_processes_see_games(name):
+    g = store.new_game(['alice', 'bob'], 4, 4)
+    store.play(g, g.players[0], 0)
+
+    p = _in_process(_play_next, g.id, 1)
+    p.join()
+    assert p.exitcode == 0
+
+    ## the move made by the other process is caught up with
+    h = store.get_game(g.id)
+    assert h is g
+    assert [(player.id, column) for player, column in g.history] == [('alice', 0), ('bob', 1)]
+    assert g.version == 2
+
+    ## a process that's never seen the game loads it from the table
+    store.open_shared(name)
+    h = store.get_game(g.id)
+    assert h is not g
+    assert h.history == g.history
+    assert h.tokens == g.tokens
+    assert store.get_player('bob').token == 'b'
+
+    with pytest.raises(KeyError):
+        store.get_game(str(uuid.uuid4()))
+    with pytest.raises(KeyError):
+        store.get_game('no-such-game')
+
+
+def _play_as(game_id, seat, seed):
+    """
+    Play for the player in the given seat on two threads until the game
+    is over, whatever the other processes do.
+    """
+    def play(rng):
+        while True:
+            g = store.get_game(game_id)
+            if g.status == 'DONE':
+                return
+            try:
+                store.play(g, g.players[seat], rng.randrange(g.board.m))
+            except (OutOfTurnError, GameOver, ColumnFullException):
+                pass
+    threads = [threading.Thread(target=play, args=(random.Random(seed * 2 + i),)) for i in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_processes_take_turns(name):
+    g = store.new_game(['red', 'blue'], 6, 7)
+    processes = [_in_process(_play_as, g.id, i % 2, i) for i in range(4)]
+    for p in processes:
+        p.join()
+        assert p.exitcode == 0
+
+    g = store.get_game(g.id)
+    assert g.status == 'DONE'
+    assert len(g.history) == store.DB.count(g.id)
+    seats = [g.players.index(player) for player, column in g.history]
+    assert seats == [i % 2 for i in range(len(seats))]
+
+
+def test_list_games(name):
+    games = [store.new_game([f'lister{i}', 'other'], 4, 4) for i in range(5)]
+    store.quit(games[1], games[1].players[0])
+    store.quit(games[3], games[3].players[0])
+
+    assert store.list_games('DONE') == ([games[1].id, games[3].id], None)
+    assert store.list_games('IN_PROGRESS', 0, 2) == ([games[0].id, games[2].id], 3)
+    assert store.list_games('IN_PROGRESS', 3, 2) == ([games[4].id], None)
+    assert store.list_games(None, 2, 2) == ([games[2].id, games[3].id], 4)
+
+    ## keys out of range never reach outside the slots
+    assert store.list_games(None, -20, 2) == ([games[0].id, games[1].id], 2)
+    assert store.list_games(None, 100, 2) == ([], None)
+    client = api.app.test_client()
+    cursor = api._encode_cursor(-20)
+    assert client.get('/drop_token', query_string={'cursor': cursor}).status_code == 400
+
+
+def test_wait_for_moves(name):
+    g = store.new_game(['waiter', 'mover'], 4, 4)
+    store.play(g, g.players[0], 0)
+
+    start = time.monotonic()
+    assert not store.wait_for_moves(g, 2, 0.1)
+    assert time.monotonic() - start >= 0.1
+
+    p = _in_process(_play_next, g.id, 2)
+    assert store.wait_for_moves(g, 2, 10)
+    p.join()
+    assert g.history[1][1] == 2
+
+
+def test_limits(name):
+    client = api.app.test_client()
+    res = client.post('/drop_token', json={'players': ['a', 'b'], 'rows': 20, 'columns': 20})
+    assert res.status_code == 400
+    assert 'at most 128 moves' in res.json['message']
+    res = client.post('/drop_token', json={'players': ['x' * 100, 'b'], 'rows': 4, 'columns': 4})
+    assert res.status_code == 400
+
+    table = SharedTable(f'{name}-small', games=2, players=4)
+    try:
+        for i in range(2):
+            table.add_player(f'p{i}', 'p')
+            table.add_game(str(uuid.uuid4()), 4, 4, 4, [f'p{i}'])
+        with pytest.raises(TableFull):
+            table.add_game(str(uuid.uuid4()), 4, 4, 4, ['p0'])
+    finally:
+        table.unlink()
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+import game
+import solver
+
+
+def test_takes_the_win():
+    b = game.Board(6,7)
+    for i in range(3):
+        b.play(2, 'x')
+        b.play(5, 'o')
+    column, score = solver.best_move(b, 'x')
+    assert column == 2
+    assert score > 0
+
+
+def test_blocks_the_opponent():
+    b = game.Board(6,7)
+    for j in range(3):
+        b.play(j, 'o')
+        b.play(6-j, 'x')
+    b.play(6, 'o')
+    column, score = solver.best_move(b, 'x')
+    assert column == 3
+
+
+def test_finds_forced_win():
+    ## x has two ways to complete a row on the bottom, o can block only one
+    b = game.Board(6,7)
+    b.play(2, 'x')
+    b.play(2, 'o')
+    b.play(3, 'x')
+    b.play(3, 'o')
+    column, score = solver.best_move(b, 'x', budget=2)
+    assert column in (1, 4)
+    assert score > 0
+
+
+def test_small_board_solved_exactly():
+    b = game.Board(4,4)
+    column, score = solver.best_move(b, 'x', budget=5)
+    assert 0 <= column < 4
+    assert score <= 0
+
+
+def test_suggest_move():
+    p = game.Player('Player1', '1')
+    q = game.Player('Player2', '2')
+    r = game.Player('Player3', '3')
+
+    g = game.Game(p, q, r)
+    with pytest.raises(ValueError):
+        solver.suggest_move(g)
+
+    g = game.Game(p, q, n=6, m=7)
+    for i in range(3):
+        g.play(p, 4)
+        g.play(q, 0)
+    column, score = solver.suggest_move(g)
+    assert column == 4
+
+    g.play(p, 4)
+    with pytest.raises(game.GameOver):
+        solver.suggest_move(g)
+
+    ## too big to search, so Monte Carlo tree search picks a move
+    g = game.Game(p, q, n=100, m=100)
+    column, score = solver.suggest_move(g, budget=0.05)
+    assert 0 <= column < 100
+    assert score == 0
+
+
+def test_budget_on_large_board():
+    a, b = game.Player('a'), game.Player('b')
+    g = game.Game(a, b, n=64, m=64)
+    g.play(a, 32)
+    g.play(b, 32)
+    start = time.monotonic()
+    solver.suggest_move(g, 0.05)
+    assert time.monotonic() - start < 0.1
@@ -0,0 +1,256 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import sqlstore
+import store
+from game import GameOver
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    for name in ('GAMES', 'PLAYERS'):
+        monkeypatch.setattr(store, name, {})
+    monkeypatch.setattr(store, 'DB', None)
+    path = str(tmp_path / 'games.db')
+    store.open_database(path)
+    yield path
+    store.open_database(None)
+
+
+def test_games_survive_restart(db):
+    g = store.new_game(['alice', 'bob', 'carol'], 4, 5, 3)
+    alice, bob, carol = g.players
+    for player, column in [(alice, 0), (bob, 1), (carol, 2), (alice, 0)]:
+        store.play(g, player, column)
+    store.quit(g, bob)
+    store.play(g, carol, 2)
+    store.play(g, alice, 0)
+    assert g.winner == alice
+
+    ## simulate a restart
+    store.open_database(db)
+    assert store.GAMES == {}
+    assert store.list_games() == ([g.id], None)
+    assert store.list_games('DONE') == ([g.id], None)
+    assert store.list_games('IN_PROGRESS') == ([], None)
+
+    h = store.get_game(g.id)
+    assert h.history == g.history
+    assert h.board[:, 0] == ['a', 'a', 'a', ' ']
+    assert h.status == 'DONE'
+    assert h.winner == alice
+    with pytest.raises(GameOver):
+        store.play(h, carol, 3)
+
+    ## players get the same tokens in a game after a restart
+    assert h.tokens == g.tokens == 'abc'
+    assert store.new_game(['bob', 'bert', 'alice'], 4, 4).tokens == 'b=a'
+
+    with pytest.raises(KeyError):
+        store.get_game('no-such-game')
+
+
+def test_group_commit(db):
+    games = [store.new_game([f'x{i}', f'y{i}'], 6, 7) for i in range(8)]
+    commits = store.DB.commits
+
+    ## hold the write lock so that moves queue up behind the first one
+    lock = sqlite3.connect(db, isolation_level=None)
+    lock.execute('BEGIN IMMEDIATE')
+
+    threads = [threading.Thread(target=store.play, args=(g, g.players[0], 3)) for g in games]
+    for t in threads:
+        t.start()
+
+    ## wait for every move to be queued or in the batch stuck on the lock
+    deadline = time.monotonic() + 5
+    while store.DB._queue.qsize() + store.DB.committing < len(games):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    batched = store.DB._queue.qsize()
+    lock.execute('COMMIT')
+    for t in threads:
+        t.join()
+
+    ## the moves that queued up behind the lock share a commit
+    assert store.DB.commits - commits == (2 if batched else 1)
+    store.open_database(db)
+    for g in games:
+        assert store.get_game(g.id).history == g.history
+
+
+def test_failed_write(db):
+    g = store.new_game(['alice', 'bob'], 4, 4)
+    store.play(g, g.players[0], 1)
+    with pytest.raises(sqlite3.IntegrityError):
+        store.DB.append_move(g.id, 0, 'alice', 2)
+    store.play(g, g.players[1], 3)
+    store.open_database(db)
+    assert [column for player, column in store.get_game(g.id).history] == [1, 3]
+
+
+def test_write_out_of_range(db):
+    ## a number SQLite can't hold fails its own write, not the writer
+    with pytest.raises(OverflowError):
+        store.DB.add_game('too-big', 10**20, 1, 4, [])
+    g = store.new_game(['alice', 'bob'], 6, 7)
+    store.play(g, g.players[0], 3)
+    store.open_database(db)
+    assert store.list_games() == ([g.id], None)
+
+
+def test_move_not_made_unless_logged(db, monkeypatch):
+    monkeypatch.setattr(sqlstore, 'BUSY_TIMEOUT', 0.1)
+    store.open_database(db)
+    g = store.new_game(['alice', 'bob'], 4, 4)
+    alice, bob = g.players
+    store.play(g, alice, 1)
+
+    lock = sqlite3.connect(db, isolation_level=None)
+    lock.execute('BEGIN IMMEDIATE')
+    with pytest.raises(sqlite3.OperationalError):
+        store.play(g, bob, 2)
+    with pytest.raises(sqlite3.OperationalError):
+        store.quit(g, bob)
+    lock.execute('COMMIT')
+    assert len(g.history) == 1
+
+    store.play(g, bob, 3)
+    store.open_database(db)
+    assert [column for player, column in store.get_game(g.id).history] == [1, 3]
+
+
+def test_index_paging():
+    index = store.Index()
+    for key in range(1, 11):
+        index.add(key, f'game{key}')
+    for key in range(1, 11, 2):
+        index.discard(f'game{key}')
+    assert len(index) == 5
+    assert index.page(0, 2) == [(2, 'game2'), (4, 'game4')]
+    assert index.page(4, 2) == [(6, 'game6'), (8, 'game8')]
+
+    ## sweeping out the holes doesn't change the pages
+    index.discard('game2')
+    assert index.holes == 0
+    assert index.page(0) == [(4, 'game4'), (6, 'game6'), (8, 'game8'), (10, 'game10')]
+    assert index.page(8, 2) == [(10, 'game10')]
+
+
+def _list_games_by_state():
+    ## with k=1, the first move wins
+    games = [store.new_game(['alice', 'bob'], 4, 4, 1) for i in range(5)]
+    for g in games[1::2]:
+        store.play(g, g.players[0], 0)
+
+    ids, after = store.list_games('IN_PROGRESS', limit=2)
+    assert ids == [games[0].id, games[2].id]
+    assert store.list_games('IN_PROGRESS', after, 2) == ([games[4].id], None)
+    assert store.list_games('DONE')[0] == [games[1].id, games[3].id]
+    assert len(store.list_games()[0]) == 5
+
+
+def test_list_games_by_state(db):
+    _list_games_by_state()
+    store.open_database(None)
+    _list_games_by_state()
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    for name in ('GAMES', 'PLAYERS'):
+        monkeypatch.setattr(store, name, {})
+    monkeypatch.setattr(store, 'DB', None)
+    monkeypatch.setattr(store, 'ARCHIVE', None)
+    monkeypatch.setattr(store, 'MAX_GAMES', 3)
+    store.open_database(None)
+    store.open_archive(str(tmp_path / 'archive.db'))
+    yield
+    store.open_archive(None)
+
+
+def test_evict_finished_games_to_archive(archive):
+    ## with k=1, the first move wins
+    games = [store.new_game(['alice', 'bob'], 4, 4, 1) for i in range(3)]
+    store.play(games[0], games[0].players[0], 2)
+    store.play(games[2], games[2].players[0], 3)
+
+    ## games[0] is the least recently used finished game
+    games.append(store.new_game(['alice', 'bob'], 4, 4, 1))
+    assert set(store.GAMES) == {g.id for g in games[1:]}
+
+    ## reloading it pushes out games[2], the only other finished one
+    g = store.get_game(games[0].id)
+    assert g is not games[0]
+    assert g.history == games[0].history
+    assert g.winner == games[0].winner
+    assert set(store.GAMES) == {games[0].id, games[1].id, games[3].id}
+
+    ## games in progress are never evicted to the archive
+    games.append(store.new_game(['alice', 'bob'], 4, 4, 1))
+    assert set(store.GAMES) == {games[1].id, games[3].id, games[4].id}
+    assert store.get_game(games[2].id).winner == games[2].winner
+    assert len(store.GAMES) == 4
+
+
+def test_evict_idle_games_to_database(db, monkeypatch):
+    monkeypatch.setattr(store, 'MAX_GAMES', 2)
+    monkeypatch.setattr(store, 'IDLE_SECONDS', 0.05)
+    games = [store.new_game(['alice', 'bob'], 4, 4) for i in range(2)]
+    store.play(games[0], games[0].players[0], 1)
+
+    ## nothing is idle yet
+    games.append(store.new_game(['alice', 'bob'], 4, 4))
+    assert len(store.GAMES) == 3
+
+    time.sleep(0.1)
+    store.get_game(games[1].id)
+    games.append(store.new_game(['alice', 'bob'], 4, 4))
+    assert set(store.GAMES) == {games[1].id, games[3].id}
+
+    g = store.get_game(games[0].id)
+    assert g.history == games[0].history
+    store.play(g, g.players[1], 2)
+
+
+def test_backfill_status(db):
+    g = store.new_game(['alice', 'bob'], 4, 4, 1)
+    h = store.new_game(['alice', 'bob'], 4, 4, 1)
+    store.play(g, g.players[0], 0)
+
+    ## roll the database back to before it had a status column
+    store.open_database(None)
+    conn = sqlite3.connect(db, isolation_level=None)
+    conn.execute('DROP INDEX games_by_status')
+    conn.execute('ALTER TABLE games DROP COLUMN status')
+    conn.close()
+
+    store.open_database(db)
+    assert store.list_games('DONE') == ([g.id], None)
+    assert store.list_games('IN_PROGRESS') == ([h.id], None)
+
+
+def test_evict_skips_games_used_since_picked(archive, monkeypatch):
+    games = [store.new_game(['alice', 'bob'], 4, 4, 1) for i in range(3)]
+    for g in games:
+        store.play(g, g.players[0], 0)
+
+    ## games[0] is used again between being picked and being evicted
+    stripe = store._stripe
+    def touching_stripe(locks, key):
+        if key == games[0].id:
+            store._touch(games[0])
+        return stripe(locks, key)
+    monkeypatch.setattr(store, '_stripe', touching_stripe)
+
+    store.new_game(['alice', 'bob'], 4, 4, 1)
+    assert games[0].id in store.GAMES
+    assert len(store.GAMES) == 4
+
+    monkeypatch.setattr(store, '_stripe', stripe)
+    store.new_game(['alice', 'bob'], 4, 4, 1)
+    assert games[0].id in store.GAMES
+    assert games[1].id not in store.GAMES and games[2].id not in store.GAMES
@@ -0,0 +1,81 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import game
+import transposition
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+
+
+def test_hash_is_independent_of_move_order_and_tokens():
+    a = game.Board(6,7)
+    for column, token in [(3, 'x'), (4, 'o'), (2, 'x'), (4, 'o')]:
+        a.play(column, token)
+
+    b = game.Board(6,7)
+    for column, token in [(2, 'r'), (4, 'b'), (3, 'r'), (4, 'b')]:
+        b.play(column, token)
+
+    assert a.hash == b.hash
+
+    c = game.Board(6,7)
+    for column, token in [(2, 'r'), (4, 'b'), (4, 'r'), (3, 'b')]:
+        c.play(column, token)
+    assert a.hash != c.hash
+
+    ## same moves on a different shape of board
+    d = game.Board(6,8)
+    for column, token in [(3, 'x'), (4, 'o'), (2, 'x'), (4, 'o')]:
+        d.play(column, token)
+    assert a.hash != d.hash
+
+
+def test_table_get_and_put():
+    t = TranspositionTable(1 << 4)
+    assert t.get(12345) is None
+
+    t.put(12345, -7, UPPER, 9, 3)
+    assert t.get(12345) == (-7, UPPER, 9, 3)
+    assert t.get(12345 + (1 << 4)) is None
+    assert t.stats['hits'] == 1
+    assert t.stats['misses'] == 2
+
+    with pytest.raises(ValueError):
+        TranspositionTable(1000)
+
+
+def test_table_prefers_deeper_searches():
+    t = TranspositionTable(1 << 4)
+    t.put(1, 5, EXACT, 10, 2)
+
+    ## a shallower search of another position in the same slot is dropped
+    t.put(17, 1, LOWER, 3, 0)
+    assert t.get(17) is None
+    assert t.get(1) == (5, EXACT, 10, 2)
+
+    ## unless the deeper search is from an earlier generation
+    t.new_search()
+    t.put(17, 1, LOWER, 3, 0)
+    assert t.get(17) == (1, LOWER, 3, 0)
+    assert t.get(1) is None
+
+
+def test_table_shared_by_searches():
+    import solver
+    t = TranspositionTable(1 << 12)
+    b = game.Board(4,4)
+    first = solver.best_move(b, 'x', budget=5, table=t)
+    misses = t.misses
+    assert first == solver.best_move(b, 'x', budget=5, table=t)
+    assert t.misses - misses < misses
+
+
+def test_table_made_on_first_search():
+    code = ('import game, solver, transposition\n'
+            'assert transposition._TABLE is None\n'
+            'solver.best_move(game.Board(4, 4, 3), "x", budget=0.1)\n'
+            'assert transposition._TABLE is transposition.shared_table()\n')
+    src = os.path.dirname(transposition.__file__)
+    subprocess.run([sys.executable, '-c', code], env=dict(os.environ, PYTHONPATH=src), check=True)
@@ -0,0 +1,81 @@
+import timeit
+
+import jsonschema
+import pytest
+
+import api
+
+
+GOOD_GAMES = [
+    {'players': ['alice', 'bob'], 'rows': 6, 'columns': 7},
+    {'players': ['alice', 'bob', 'carol'], 'rows': 4, 'columns': 5, 'k': 3},
+    {'players': ['alice'], 'rows': 1, 'columns': 1, 'extra': 'ignored'},
+]
+
+BAD_GAMES = [
+    None,
+    [],
+    {'players': ['harry', 'draco'], 'quaffles': 1},
+    {'players': [], 'rows': 6, 'columns': 7},
+    {'players': [1, 2], 'rows': 6, 'columns': 7},
+    {'players': ['alice', ''], 'rows': 6, 'columns': 7},
+    {'players': [f'p{i}' for i in range(27)], 'rows': 6, 'columns': 7},
+    {'players': 'alice', 'rows': 6, 'columns': 7},
+    {'players': ['alice', 'bob'], 'rows': 0, 'columns': 7},
+    {'players': ['alice', 'bob'], 'rows': 6, 'columns': '7'},
+    {'players': ['alice', 'bob'], 'rows': True, 'columns': 7},
+    {'players': ['alice', 'bob'], 'rows': 6, 'columns': 7, 'k': 0},
+    {'players': ['alice', 'bob'], 'rows': 4.0, 'columns': 7},
+    {'players': ['alice', 'bob'], 'rows': 4, 'columns': 4, 'k': 2.0},
+    {'players': ['alice', 'bob'], 'rows': 10**20, 'columns': 1},
+    {'players': ['alice', 'bob'], 'rows': 1, 'columns': api.MAX_BOARD_SIDE + 1},
+]
+
+
+@pytest.mark.parametrize('data', GOOD_GAMES)
+def test_good_games(data):
+    api._validate_game(data)
+    jsonschema.validate(data, api.GAME_SCHEMA)
+
+
+@pytest.mark.parametrize('data', BAD_GAMES)
+def test_bad_games(data):
+    with pytest.raises(jsonschema.ValidationError):
+        api._validate_game(data)
+
+
+def test_k_too_long():
+    api._validate_game({'players': ['alice', 'bob'], 'rows': 3, 'columns': 5, 'k': 5})
+    with pytest.raises(api.ClientError):
+        api._validate_game({'players': ['alice', 'bob'], 'rows': 4, 'columns': 4, 'k': 60000})
+
+
+def test_moves():
+    api._validate_move({'column': 3})
+    for data in (None, {}, {'column': '3'}, {'column': None}, {'column': False}, {'column': 1.0}, {'row': 3}):
+        with pytest.raises(jsonschema.ValidationError):
+            api._validate_move(data)
+
+
+def test_error_response():
+    client = api.app.test_client()
+    res = client.post('/drop_token', json={'players': [1, 2], 'rows': 6, 'columns': 7})
+    assert res.status_code == 400
+    assert res.json['message'] == "1 is not of type 'string'"
+    assert 'ValidationError' in res.json['exception']
+
+
+def test_validation_cost():
+    """
+    Compare the cost per request of validating each kind of request with
+    jsonschema.validate, which builds a validator every time, and with the
+    fast path.
+    """
+    n = 200
+    for name, data, schema, check in [
+            ('new game', GOOD_GAMES[0], api.GAME_SCHEMA, api._validate_game),
+            ('move', {'column': 3}, api.MOVE_SCHEMA, api._validate_move)]:
+        slow = timeit.timeit(lambda: jsonschema.validate(data, schema), number=n) / n
+        fast = timeit.timeit(lambda: check(data), number=n) / n
+        print(f'{name}: {slow*1e6:.1f} us with jsonschema.validate, {fast*1e6:.2f} us on the fast path')
+        assert fast < slow